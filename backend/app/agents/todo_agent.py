@@ -1,10 +1,23 @@
 """OpenRouter Agent for Todo Management using Mistral model."""
 import os
+import inspect
 import json
-from typing import List, Dict, Any
-from openai import OpenAI
+import time
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional
+from openai import AsyncOpenAI
+from sqlalchemy import event
+from sqlmodel import Session
 from app.config import settings
+from app.conversations import load_conversation_context, load_conversation_history, load_pending_tasks
+from app.history_cache import history_cache
 from app.mcp import tools
+from app.mcp.compensation import CompensationLog
+from app.llm import build_resilient_llm
+from app.metrics import metrics
+from app.transcripts import pending_turns
+from app.usage import usage_recorder
+from app import tracing
 
 # Initialize OpenRouter client (compatible with OpenAI SDK)
 openrouter_api_key = settings.OPENROUTER_API_KEY or os.getenv("OPENROUTER_API_KEY")
@@ -12,23 +25,33 @@ if not openrouter_api_key:
     raise ValueError("OPENROUTER_API_KEY environment variable is required")
 
 # Configure OpenAI client to use OpenRouter
-client = OpenAI(
+# (async so LLM waits never block the event loop shared with other requests)
+# (retries and timeouts are handled by app.llm, so the SDK's own are off)
+client = AsyncOpenAI(
     api_key=openrouter_api_key,
-    base_url="https://openrouter.ai/api/v1",
+    base_url=settings.LLM_BASE_URL,
+    max_retries=0,
     default_headers={
         "HTTP-Referer": settings.APP_URL or "https://github.com/your-username/todo-app",  # Optional: for tracking
         "X-Title": settings.APP_NAME or "Todo Chatbot",  # Optional: for tracking
     }
 )
 
+# Timeouts, retries, hedging and circuit breaking around the client
+llm = build_resilient_llm(client)
+
 SYSTEM_PROMPT = """You are a helpful todo assistant. You help users manage their tasks through natural conversation.
 
 Your capabilities:
 - Create tasks when user mentions adding/creating/remembering something
 - List tasks when user asks to see/show/view tasks
+- Count tasks with task_stats when the user asks how many they have
 - Update tasks when user wants to change/modify/edit
+- Reorder tasks with move_task when the user wants a task higher, lower, first or last
 - Delete tasks when user says remove/delete/cancel
 - Complete tasks when user says done/finished/complete
+- Find a task's ID with find_task when the user describes a task instead of giving its number
+- Set due dates and priorities, and answer "what's due" with list_tasks' due_within_hours
 
 Guidelines:
 - Always confirm actions with friendly, concise messages
@@ -74,6 +97,15 @@ TOOLS = [
                         "type": "string",
                         "description": "Optional task description",
                         "default": ""
+                    },
+                    "due_at": {
+                        "type": "string",
+                        "description": "Optional due date/time in ISO 8601 (e.g. 2025-03-01T17:00:00Z), UTC unless an offset is given"
+                    },
+                    "priority": {
+                        "type": "string",
+                        "enum": ["none", "low", "medium", "high"],
+                        "description": "Optional priority"
                     }
                 },
                 "required": ["user_id", "title"]
@@ -97,6 +129,27 @@ TOOLS = [
                         "description": "Filter by status: 'all', 'pending', or 'completed'",
                         "enum": ["all", "pending", "completed"],
                         "default": "all"
+                    },
+                    "due_within_hours": {
+                        "type": "number",
+                        "description": "Only tasks due within this many hours from now, including overdue ones, soonest first (e.g. 24 for 'due today or tomorrow')"
+                    }
+                },
+                "required": ["user_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "task_stats",
+            "description": "Count the user's pending, completed and overdue tasks. Use this instead of list_tasks when only the numbers are needed",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "user_id": {
+                        "type": "string",
+                        "description": "The user's ID"
                     }
                 },
                 "required": ["user_id"]
@@ -107,7 +160,7 @@ TOOLS = [
         "type": "function",
         "function": {
             "name": "update_task",
-            "description": "Update a task's title or description",
+            "description": "Update a task's title, description, due date or priority",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -126,6 +179,49 @@ TOOLS = [
                     "description": {
                         "type": "string",
                         "description": "New description (optional)"
+                    },
+                    "due_at": {
+                        "type": "string",
+                        "description": "New due date/time in ISO 8601, UTC unless an offset is given; empty string removes it (optional)"
+                    },
+                    "priority": {
+                        "type": "string",
+                        "enum": ["none", "low", "medium", "high"],
+                        "description": "New priority (optional)"
+                    }
+                },
+                "required": ["user_id", "task_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "move_task",
+            "description": "Move a task in the user's list order: right after or before another task, or to the top or bottom. Give exactly one of after_task_id, before_task_id or position",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "user_id": {
+                        "type": "string",
+                        "description": "The user's ID"
+                    },
+                    "task_id": {
+                        "type": "integer",
+                        "description": "The task ID to move"
+                    },
+                    "after_task_id": {
+                        "type": "integer",
+                        "description": "Place the task right after this task"
+                    },
+                    "before_task_id": {
+                        "type": "integer",
+                        "description": "Place the task right before this task"
+                    },
+                    "position": {
+                        "type": "string",
+                        "enum": ["top", "bottom"],
+                        "description": "Move the task to the top or bottom of the list"
                     }
                 },
                 "required": ["user_id", "task_id"]
@@ -153,6 +249,36 @@ TOOLS = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_task",
+            "description": "Find the user's tasks matching a description, to get a task ID when the user refers to a task by name (e.g. 'the dentist one')",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "user_id": {
+                        "type": "string",
+                        "description": "The user's ID"
+                    },
+                    "query": {
+                        "type": "string",
+                        "description": "How the user described the task"
+                    },
+                    "status": {
+                        "type": "string",
+                        "enum": ["pending", "all"],
+                        "description": "Search pending tasks only (default) or all tasks"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of matches (default 3)"
+                    }
+                },
+                "required": ["user_id", "query"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -180,17 +306,175 @@ TOOLS = [
 TOOL_MAP = {
     "add_task": tools.add_task,
     "list_tasks": tools.list_tasks,
+    "task_stats": tools.task_stats,
+    "find_task": tools.find_task,
     "update_task": tools.update_task,
+    "move_task": tools.move_task,
     "delete_task": tools.delete_task,
     "complete_task": tools.complete_task,
 }
 
+# Tools that never write; a batch of only these may run on a read replica
+READ_ONLY_TOOLS = {"list_tasks", "find_task", "task_stats"}
+
+# Read-only tools whose results a write can change; tools not listed affect all of them
+TOOL_INVALIDATES = {
+    "move_task": {"list_tasks"},
+}
+
+
+@event.listens_for(Session, "after_rollback")
+def _count_rollbacks(session):
+    # Lets run_agent notice a tool call that rolled back earlier writes of its batch
+    session.info["rollbacks"] = session.info.get("rollbacks", 0) + 1
+
+
+def _rollback_count(session: Optional[Session]) -> int:
+    return session.info.get("rollbacks", 0) if session is not None else 0
+
+
+class ToolMemo:
+    """Results of read-only tool calls within one agent run, by their arguments.
+    
+    A write tool call drops the entries it could have changed, whether or not
+    it succeeded. A call that rolls the session back undoes other writes of
+    its batch too, so it clears the memo. A repeated read returns what
+    running the tool again would, without the query.
+    """
+    
+    def __init__(self):
+        self._results: Dict[tuple, tuple[Dict[str, Any], str]] = {}
+    
+    @staticmethod
+    def key(name: str, args: Dict[str, Any]) -> Optional[tuple]:
+        """Memo key for a call, with defaults filled in; None if it is not memoizable."""
+        if name not in READ_ONLY_TOOLS:
+            return None
+        try:
+            bound = inspect.signature(TOOL_MAP[name]).bind(**args)
+        except TypeError:
+            return None  # Bad arguments; let the call report them
+        bound.apply_defaults()
+        arguments = {k: v for k, v in bound.arguments.items() if k not in ("user_id", "session")}
+        return name, json.dumps(arguments, sort_keys=True, default=str)
+    
+    def get(self, key: tuple) -> Optional[tuple[Dict[str, Any], str]]:
+        """A memoized (result, serialized result)."""
+        return self._results.get(key)
+    
+    def put(self, key: tuple, result: Dict[str, Any], content: str) -> None:
+        if result.get("status") == "success":
+            self._results[key] = (result, content)
+    
+    def invalidate(self, name: str) -> None:
+        """Drop the results a call to the named tool could have changed."""
+        if name in READ_ONLY_TOOLS or not self._results:
+            return
+        affected = TOOL_INVALIDATES.get(name, READ_ONLY_TOOLS)
+        self._results = {key: value for key, value in self._results.items() if key[0] not in affected}
+    
+    def clear(self) -> None:
+        self._results.clear()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def render_task_context(tasks: List[tuple[int, str]], truncated: bool, max_tokens: int) -> Optional[str]:
+    """Compact pending-task snapshot for the system message.
+    
+    Returns None when the user has too many pending tasks to fit the token
+    budget; the model then finds tasks with list_tasks as usual.
+    """
+    if truncated:
+        return None
+    if not tasks:
+        text = "The user has no pending tasks."
+    else:
+        lines = [f"- {task_id}: {title[:80]}" for task_id, title in tasks]
+        text = (
+            "The user's pending tasks at the start of this message (id: title). "
+            "Use these ids directly instead of calling list_tasks:\n" + "\n".join(lines)
+        )
+    if estimate_tokens(text) > max_tokens:
+        return None
+    return text
+
+
+def load_agent_context(
+    session: Session,
+    conversation_id: int,
+    user_id: int,
+    version: Optional[datetime] = None
+) -> tuple[List[Dict[str, str]], Optional[str], Optional[datetime]]:
+    """Load conversation history and, if enabled, the pending-task snapshot.
+    
+    Both come from one query. Given the conversation's ``updated_at`` as
+    version, history is served from the worker's history cache when it is
+    current. Returns (history, task_context, history_version); pass
+    history_version to history_cache.append() after writing the turn.
+    """
+    if version is not None:
+        # Turns still in the write-behind writer are part of this worker's view
+        turns = pending_turns(conversation_id)
+        if turns:
+            version = max(version, turns[-1].created_at)
+    history = history_cache.get(conversation_id, version) if version is not None else None
+    
+    if not settings.AGENT_TASK_CONTEXT_ENABLED:
+        if history is None:
+            history = load_conversation_history(session, conversation_id)
+            if version is not None:
+                history_cache.put(conversation_id, version, history)
+        return history, None, version
+    
+    if history is None:
+        history, tasks, truncated = load_conversation_context(
+            session, conversation_id, user_id, settings.AGENT_TASK_CONTEXT_MAX_TASKS
+        )
+        if version is not None:
+            history_cache.put(conversation_id, version, history)
+    else:
+        tasks, truncated = load_pending_tasks(session, user_id, settings.AGENT_TASK_CONTEXT_MAX_TASKS)
+    task_context = render_task_context(tasks, truncated, settings.AGENT_TASK_CONTEXT_MAX_TOKENS)
+    if task_context is None:
+        metrics.increment("agent.task_context.skipped")
+    else:
+        metrics.observe("agent.task_context.tokens", estimate_tokens(task_context))
+    return history, task_context, version
+
+
+# Tools whose successful result needs no LLM phrasing (their message says it all)
+CONFIRMABLE_TOOLS = {"add_task", "complete_task", "delete_task", "update_task", "move_task"}
+
+
+def synthesize_confirmation(results: List[tuple[str, Dict[str, Any]]]) -> Optional[str]:
+    """Render a confirmation for a batch of successful mutation tool calls.
+    
+    Returns None when any call in the batch is not a confirmable tool or did
+    not succeed, in which case the LLM should phrase the reply.
+    """
+    if not results:
+        return None
+    lines = []
+    for name, result in results:
+        if name not in CONFIRMABLE_TOOLS or result.get("status") != "success" or not result.get("message"):
+            return None
+        lines.append(f"✓ {result['message']}")
+    return "\n".join(lines)
+
 
 async def run_agent(
     user_id: str,
     user_message: str,
     conversation_history: List[Dict[str, str]] = None,
-    session = None
+    session = None,
+    session_factory: Optional[Callable[[], Session]] = None,
+    compensation_log: Optional[CompensationLog] = None,
+    task_context: Optional[str] = None,
+    read_session_factory: Optional[Callable[[], Session]] = None
 ) -> tuple[str, List[str]]:
     """
     Run the OpenRouter agent with tool calling (using Mistral model).
@@ -199,6 +483,16 @@ async def run_agent(
         user_id: User ID
         user_message: User's message
         conversation_history: Previous messages in the conversation
+        session: Database session shared by all tool calls (caller commits)
+        session_factory: Alternative to session: a fresh session is opened
+            for each batch of tool calls and committed right after, so no
+            connection is held while waiting on the LLM
+        compensation_log: With session_factory, collects undo entries for
+            task writes in committed batches (see app.mcp.compensation)
+        task_context: Pending-task snapshot from render_task_context, added
+            to the system message
+        read_session_factory: With session_factory, opens the session for
+            batches made up only of READ_ONLY_TOOLS (e.g. a replica session)
     
     Returns:
         Tuple of (assistant_response, list_of_tool_calls)
@@ -207,8 +501,12 @@ async def run_agent(
         conversation_history = []
     
     # Build messages array
+    # The current time lets the model resolve "tomorrow" or "by Friday" to a due_at
+    system_prompt = f"{SYSTEM_PROMPT}\nCurrent time (UTC): {datetime.utcnow():%Y-%m-%d %H:%M}\n"
+    if task_context:
+        system_prompt = f"{system_prompt}{task_context}\n"
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT}
+        {"role": "system", "content": system_prompt}
     ]
     
     # Add conversation history
@@ -218,66 +516,160 @@ async def run_agent(
     messages.append({"role": "user", "content": user_message})
     
     tool_calls_made = []
+    tool_memo = ToolMemo()
     max_iterations = 5  # Prevent infinite loops
     iteration = 0
     
     while iteration < max_iterations:
         iteration += 1
         
-        # Call OpenRouter API with Mistral model
-        model = settings.LLM_MODEL or "mistralai/mistral-small-3.1-24b-instruct:free"
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=TOOLS,
-            tool_choice="auto"
-        )
-        
-        assistant_message = response.choices[0].message
-        messages.append(assistant_message.model_dump())
-        
-        # Check if tool calls are needed
-        if assistant_message.tool_calls:
-            for tool_call in assistant_message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                
-                # Add user_id to all tool calls
-                function_args["user_id"] = user_id
-                
-                tool_calls_made.append(function_name)
-                
-                # Execute tool
-                tool_func = TOOL_MAP.get(function_name)
-                if tool_func:
-                    try:
-                        # Pass session if available
-                        if session is not None:
-                            function_args["session"] = session
-                        tool_result = await tool_func(**function_args)
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_name,
-                            "content": json.dumps(tool_result)
-                        })
-                    except Exception as e:
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_name,
-                            "content": json.dumps({"status": "error", "message": str(e)})
-                        })
-                else:
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": function_name,
-                        "content": json.dumps({"status": "error", "message": f"Unknown tool: {function_name}"})
+        with tracing.span("agent.iteration", **{"agent.iteration": iteration}) as iteration_span:
+            # Call OpenRouter API with Mistral model
+            model = settings.LLM_MODEL or "mistralai/mistral-small-3.1-24b-instruct:free"
+            with tracing.span(
+                "llm.chat.completions.create",
+                **{"llm.model": model, "llm.request.message_count": len(messages)}
+            ) as llm_span:
+                started = time.perf_counter()
+                response = await llm.create(
+                    model=model,
+                    messages=messages,
+                    tools=TOOLS,
+                    tool_choice="auto"
+                )
+                usage = getattr(response, "usage", None)
+                # Attributed to the model that answered (e.g. a fallback)
+                usage_recorder.record(
+                    int(user_id), getattr(response, "model", None) or model, usage, time.perf_counter() - started
+                )
+                if usage is not None:
+                    llm_span.set_attributes({
+                        "llm.usage.prompt_tokens": usage.prompt_tokens,
+                        "llm.usage.completion_tokens": usage.completion_tokens,
+                        "llm.usage.total_tokens": usage.total_tokens,
                     })
-        else:
-            # No more tool calls, return the response
-            return assistant_message.content, tool_calls_made
+                llm_span.set_attributes({
+                    "llm.response.model": getattr(response, "model", None),
+                    "llm.finish_reason": response.choices[0].finish_reason,
+                    "llm.response.tool_call_count": len(response.choices[0].message.tool_calls or []),
+                })
+            
+            assistant_message = response.choices[0].message
+            messages.append(assistant_message.model_dump())
+            
+            # Check if tool calls are needed
+            if assistant_message.tool_calls:
+                # Without a shared session, hold a connection only for this batch of tools
+                owns_session = session is None and session_factory is not None
+                read_only = read_session_factory is not None and all(
+                    tool_call.function.name in READ_ONLY_TOOLS for tool_call in assistant_message.tool_calls
+                )
+                if owns_session:
+                    tool_session = read_session_factory() if read_only else session_factory()
+                else:
+                    tool_session = session
+                if owns_session and compensation_log is not None:
+                    tool_session.info["compensation_log"] = compensation_log
+                batch_results = []
+                try:
+                    for tool_call in assistant_message.tool_calls:
+                        function_name = tool_call.function.name
+                        function_args = json.loads(tool_call.function.arguments)
+                        
+                        # Add user_id to all tool calls
+                        function_args["user_id"] = user_id
+                        
+                        tool_calls_made.append(function_name)
+                        
+                        # Execute tool
+                        tool_func = TOOL_MAP.get(function_name)
+                        memo_key = ToolMemo.key(function_name, function_args) if tool_func else None
+                        memoized = tool_memo.get(memo_key) if memo_key else None
+                        with tracing.span(f"tool.{function_name}", **{"tool.name": function_name}) as tool_span:
+                            if memoized is not None:
+                                # Same read earlier in this run, with no write since
+                                tool_result, content = memoized
+                                metrics.increment("agent.tool_memo_hits")
+                                batch_results.append((function_name, tool_result))
+                                tool_span.set_attributes({
+                                    "tool.status": tool_result.get("status"),
+                                    "tool.row_count": tool_result.get("count"),
+                                    "tool.memoized": True,
+                                })
+                                messages.append({
+                                    "role": "tool",
+                                    "tool_call_id": tool_call.id,
+                                    "name": function_name,
+                                    "content": content
+                                })
+                            elif tool_func:
+                                rollbacks = _rollback_count(tool_session)
+                                try:
+                                    # Pass session if available
+                                    if tool_session is not None:
+                                        function_args["session"] = tool_session
+                                    tool_result = await tool_func(**function_args)
+                                    content = json.dumps(tool_result)
+                                    if _rollback_count(tool_session) != rollbacks:
+                                        tool_memo.clear()
+                                    else:
+                                        tool_memo.invalidate(function_name)
+                                        if memo_key:
+                                            tool_memo.put(memo_key, tool_result, content)
+                                    batch_results.append((function_name, tool_result))
+                                    tool_span.set_attributes({
+                                        "tool.status": tool_result.get("status"),
+                                        "tool.row_count": tool_result.get("count"),
+                                    })
+                                    messages.append({
+                                        "role": "tool",
+                                        "tool_call_id": tool_call.id,
+                                        "name": function_name,
+                                        "content": content
+                                    })
+                                except Exception as e:
+                                    if _rollback_count(tool_session) != rollbacks:
+                                        tool_memo.clear()
+                                    else:
+                                        tool_memo.invalidate(function_name)
+                                    tool_span.record_exception(e)
+                                    batch_results.append((function_name, {"status": "error"}))
+                                    messages.append({
+                                        "role": "tool",
+                                        "tool_call_id": tool_call.id,
+                                        "name": function_name,
+                                        "content": json.dumps({"status": "error", "message": str(e)})
+                                    })
+                            else:
+                                tool_span.set_attribute("tool.status", "unknown")
+                                batch_results.append((function_name, {"status": "error"}))
+                                messages.append({
+                                    "role": "tool",
+                                    "tool_call_id": tool_call.id,
+                                    "name": function_name,
+                                    "content": json.dumps({"status": "error", "message": f"Unknown tool: {function_name}"})
+                                })
+                    if owns_session:
+                        tool_session.commit()
+                        if compensation_log is not None:
+                            compensation_log.commit()
+                finally:
+                    if owns_session:
+                        # Entries of a batch that failed to commit have nothing to undo
+                        if compensation_log is not None:
+                            compensation_log.discard_pending()
+                        tool_session.close()
+                
+                # Confirm simple mutations locally instead of asking the LLM to phrase them
+                if settings.AGENT_SYNTHESIZE_CONFIRMATIONS:
+                    confirmation = synthesize_confirmation(batch_results)
+                    if confirmation is not None:
+                        metrics.increment("agent.llm_calls_skipped")
+                        iteration_span.set_attribute("agent.synthesized_response", True)
+                        return confirmation, tool_calls_made
+            else:
+                # No more tool calls, return the response
+                return assistant_message.content, tool_calls_made
     
     # If we've done too many iterations, return the last message
     if messages:
@@ -14,10 +14,148 @@ class Settings(BaseSettings):
     OPENROUTER_API_KEY: Optional[str] = None
     # LLM model to use (default: Mistral free model)
     LLM_MODEL: str = "mistralai/mistral-small-3.1-24b-instruct:free"
+    # OpenAI-compatible API base URL
+    LLM_BASE_URL: str = "https://openrouter.ai/api/v1"
+    # Deadline for a single LLM request attempt
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    # Retries after a timeout, connection error, 429 or 5xx
+    LLM_MAX_RETRIES: int = 2
+    # Backoff before retry n is random in [0, base * 2^n], capped at the max
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 0.5
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 8.0
+    # Model tried once after retries are spent, and the target of hedged requests
+    LLM_FALLBACK_MODEL: Optional[str] = None
+    # Race attempts slower than the latency percentile against LLM_FALLBACK_MODEL
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: float = 95
+    # Never hedge earlier than this (also used until enough latencies are seen)
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 2.0
+    # Consecutive failed calls that open the circuit (0 disables the breaker)
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    # How long an open circuit rejects calls before letting a probe through
+    LLM_CIRCUIT_RESET_SECONDS: float = 30.0
+    # USD per million tokens, for per-user cost accounting (the default model is free)
+    LLM_PRICE_PROMPT_PER_MTOK: float = 0.0
+    LLM_PRICE_CACHED_PROMPT_PER_MTOK: float = 0.0
+    LLM_PRICE_COMPLETION_PER_MTOK: float = 0.0
+    # How often per-user LLM usage counters are written to llm_usage
+    USAGE_FLUSH_INTERVAL_SECONDS: float = 10.0
+    # Prompt plus completion tokens a user may spend per UTC day (0 disables the budget)
+    USER_DAILY_TOKEN_BUDGET: int = 0
+    # How stale a worker's copy of a user's stored usage may get (usage by other workers shows up after this)
+    USAGE_BUDGET_REFRESH_SECONDS: float = 30.0
+    # Comma-separated user ids allowed to call /api/admin endpoints
+    ADMIN_USER_IDS: str = ""
+    # Longest profile the admin profiler endpoints may take, in seconds
+    PROFILER_MAX_SECONDS: float = 60.0
+    # Reply to successful add/update/complete/delete tool calls with a locally
+    # rendered confirmation instead of a second LLM call
+    AGENT_SYNTHESIZE_CONFIRMATIONS: bool = False
+    # Put a snapshot of the user's pending tasks (ids and titles) in the system
+    # message so the model can act on them without calling list_tasks first
+    AGENT_TASK_CONTEXT_ENABLED: bool = False
+    # Largest pending task set to inline; larger sets fall back to list_tasks
+    AGENT_TASK_CONTEXT_MAX_TASKS: int = 50
+    # Token budget (estimated) for the inlined snapshot
+    AGENT_TASK_CONTEXT_MAX_TOKENS: int = 800
+    # Write chat transcripts in the background (batched, spooled to local disk)
+    # instead of before responding; not for serverless deployments
+    TRANSCRIPT_WRITE_BEHIND: bool = False
+    # Directory for transcript spool files (must survive restarts)
+    TRANSCRIPT_SPOOL_DIR: str = "./transcript-spool"
+    # How often pending transcript rows are flushed
+    TRANSCRIPT_FLUSH_INTERVAL_SECONDS: float = 0.2
+    # Flush early once this many turns are pending
+    TRANSCRIPT_BATCH_SIZE: int = 500
+    # fsync the spool on every turn (disable to trade crash safety for latency)
+    TRANSCRIPT_SPOOL_FSYNC: bool = True
+    # Memory budget (estimated bytes) for cached conversation histories per worker (0 disables)
+    HISTORY_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    # How long Idempotency-Key responses are kept for replay
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    # How long a retry waits for the original request to finish before a 409
+    IDEMPOTENCY_WAIT_SECONDS: float = 60.0
+    # An in-progress key not finished after this long is taken over by a retry
+    IDEMPOTENCY_IN_FLIGHT_TIMEOUT_SECONDS: int = 600
+    # Minimum time between sweeps of expired keys
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: int = 600
+    # Users whose find_task index is kept in memory (least recently used are dropped)
+    TASK_INDEX_MAX_USERS: int = 1000
+    # Rebuild a user's find_task index after this long even if their tasks look unchanged
+    TASK_INDEX_TTL_SECONDS: int = 300
+    # Largest accepted task import upload, in bytes
+    TASK_IMPORT_MAX_BYTES: int = 20 * 1024 * 1024
+    # How often per-user task counters are recounted to repair drift (0 disables), and users per pass transaction
+    TASK_STATS_RECONCILE_INTERVAL_SECONDS: int = 3600
+    TASK_STATS_RECONCILE_BATCH_SIZE: int = 500
+    # How often users whose manual task order ran short of rank precision are renumbered
+    TASK_RANK_REBALANCE_INTERVAL_SECONDS: int = 30
+    # Optional read replicas (comma-separated URLs) for read-only routes and tools
+    DATABASE_REPLICA_URLS: str = ""
+    # Replicas lagging more than this are skipped (reads go to the primary)
+    REPLICA_MAX_LAG_SECONDS: float = 5.0
+    # How often replica lag is measured
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS: float = 2.0
     # Optional: Your app name for OpenRouter tracking
     APP_NAME: Optional[str] = "Todo Chatbot"
     # Optional: Your app URL for OpenRouter tracking
     APP_URL: Optional[str] = None
+    # Tracing exporter for chat/agent/LLM/tool/SQL spans: "none", "file" or "otlp"
+    TRACING_EXPORTER: str = "none"
+    # JSON-lines output path used by the "file" exporter
+    TRACING_FILE_PATH: str = "traces.jsonl"
+    # OTLP/HTTP collector endpoint used by the "otlp" exporter
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    # Service name reported to the collector
+    TRACING_SERVICE_NAME: str = "todo-api"
+    # Compress responses with gzip/brotli (opt-in)
+    COMPRESSION_ENABLED: bool = False
+    # Responses smaller than this many bytes are sent uncompressed
+    COMPRESSION_MIN_SIZE: int = 1024
+    # gzip level (1-9) and brotli quality (0-11); lower is faster
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    # Chat rate limit per user (token bucket); 0 (the default) disables it
+    CHAT_RATE_LIMIT_PER_MINUTE: float = 0
+    CHAT_RATE_LIMIT_BURST: int = 5
+    # Concurrent agent runs per user; 0 (the default) disables the cap. Shared
+    # across workers with the redis backend; more than one worker requires it
+    CHAT_MAX_CONCURRENT_PER_USER: int = 0
+    # Requests queued behind the cap (per worker), and how long they may wait for a slot
+    CHAT_MAX_QUEUED_PER_USER: int = 4
+    CHAT_QUEUE_TIMEOUT_SECONDS: float = 15
+    # Rate limit and concurrency cap state: "memory" (per worker) or "redis" (shared, needs REDIS_URL)
+    RATE_LIMIT_BACKEND: str = "memory"
+    REDIS_URL: Optional[str] = None
+    # Run chat turns as background jobs by default (clients can override per request)
+    CHAT_BACKGROUND_JOBS: bool = False
+    # Where jobs run: "inprocess" (worker pool in the API) or "external" (python -m app.worker)
+    JOB_WORKER_MODE: str = "inprocess"
+    # Concurrent agent runs per worker pool/process
+    JOB_WORKERS: int = 4
+    # How often external workers and long-polling clients check the job table
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0
+    # Longest a status request may wait for a job to finish (long polling)
+    JOB_MAX_WAIT_SECONDS: float = 25
+    # Running jobs not updated for this long are treated as crashed
+    JOB_STALE_SECONDS: int = 600
+    # Summarize and archive chat messages older than this many days (0 disables compaction)
+    MESSAGE_COMPACT_AFTER_DAYS: int = 0
+    # Messages per conversation always kept verbatim by compaction
+    MESSAGE_COMPACT_KEEP_RECENT: int = 20
+    # Delete conversations idle for this many days (0 keeps them forever)
+    CONVERSATION_RETENTION_DAYS: int = 0
+    # Copy compacted and expired messages to message_archive before deleting them
+    MESSAGE_ARCHIVE_ENABLED: bool = True
+    # Delete archived messages after this many days (0 keeps them forever)
+    MESSAGE_ARCHIVE_RETENTION_DAYS: int = 0
+    # How often the retention job runs, and rows deleted per transaction
+    RETENTION_INTERVAL_SECONDS: int = 3600
+    RETENTION_BATCH_SIZE: int = 1000
+    # Run the due-date reminder scheduler in each worker
+    REMINDERS_ENABLED: bool = False
+    # Window of upcoming due dates the scheduler holds in memory; refilled once per window
+    REMINDER_HORIZON_SECONDS: int = 3600
     
     class Config:
         env_file = ".env"
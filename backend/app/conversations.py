@@ -0,0 +1,136 @@
+"""Conversation and message persistence helpers shared by chat routes and jobs."""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import literal, null, union_all
+from sqlmodel import Session, select
+from app.models import Conversation, Message, Task
+from app.transcripts import pending_turns, unwritten_messages
+
+
+def get_or_create_conversation(session: Session, user_id: int, conversation_id: Optional[int]) -> Conversation:
+    """Load the user's conversation, or create a new one when no id is given."""
+    if conversation_id:
+        statement = select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        )
+        conversation = session.exec(statement).first()
+
+        if not conversation:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found"
+            )
+        return conversation
+
+    # Create new conversation
+    conversation = Conversation(user_id=user_id)
+    session.add(conversation)
+    session.commit()
+    session.refresh(conversation)
+    return conversation
+
+
+def load_conversation_history(session: Session, conversation_id: int) -> List[Dict[str, str]]:
+    """Load a conversation's messages in OpenAI format, oldest first."""
+    # Turns still waiting in the write-behind transcript writer (snapshot first)
+    pending = pending_turns(conversation_id)
+    statement = select(Message).where(
+        Message.conversation_id == conversation_id
+    ).order_by(Message.created_at)
+    messages = session.exec(statement).all()
+    history = [
+        {"role": msg.role, "content": msg.content}
+        for msg in messages
+    ]
+    return history + unwritten_messages(pending, {msg.created_at for msg in messages})
+
+
+def load_conversation_context(
+    session: Session,
+    conversation_id: int,
+    user_id: int,
+    max_tasks: int
+) -> Tuple[List[Dict[str, str]], List[Tuple[int, str]], bool]:
+    """Load history plus a snapshot of the user's pending tasks in one query.
+    
+    Returns (history, pending_tasks, truncated); pending_tasks holds (id,
+    title) pairs, newest first, and truncated is True when the user has more
+    than max_tasks pending tasks.
+    """
+    messages = select(
+        literal("message").label("kind"),
+        Message.id.label("id"),
+        Message.role.label("role"),
+        Message.content.label("content"),
+        Message.created_at.label("created_at"),
+    ).where(Message.conversation_id == conversation_id)
+    # LIMIT inside a UNION member needs a subquery on most databases
+    tasks = _pending_tasks_query(user_id, max_tasks).subquery()
+    
+    # Turns still waiting in the write-behind transcript writer (snapshot first)
+    turns = pending_turns(conversation_id)
+    rows = session.exec(union_all(messages, select(tasks))).all()
+    
+    history = [
+        {"role": row.role, "content": row.content}
+        for row in sorted(
+            (row for row in rows if row.kind == "message"),
+            key=lambda row: (row.created_at, row.id)
+        )
+    ]
+    pending = sorted(
+        (row for row in rows if row.kind == "task"),
+        key=lambda row: (row.created_at, row.id),
+        reverse=True
+    )
+    history += unwritten_messages(turns, {row.created_at for row in rows if row.kind == "message"})
+    truncated = len(pending) > max_tasks
+    return history, [(row.id, row.content) for row in pending[:max_tasks]], truncated
+
+
+def _pending_tasks_query(user_id: int, max_tasks: int):
+    """Newest pending tasks, one more than max_tasks to detect truncation."""
+    return select(
+        literal("task").label("kind"),
+        Task.id.label("id"),
+        null().label("role"),
+        Task.title.label("content"),
+        Task.created_at.label("created_at"),
+    ).where(
+        Task.user_id == user_id,
+        Task.completed == False
+    ).order_by(Task.created_at.desc(), Task.id.desc()).limit(max_tasks + 1)
+
+
+def load_pending_tasks(session: Session, user_id: int, max_tasks: int) -> Tuple[List[Tuple[int, str]], bool]:
+    """The task half of load_conversation_context, for when history is cached."""
+    rows = session.exec(_pending_tasks_query(user_id, max_tasks)).all()
+    return [(row.id, row.content) for row in rows[:max_tasks]], len(rows) > max_tasks
+
+
+def add_turn(session: Session, conversation_id: int, user_id: int, user_content: str, assistant_content: str) -> datetime:
+    """Stage one user/assistant exchange and bump the conversation timestamp (caller commits).
+    
+    Returns the new ``updated_at``, the conversation's history version.
+    """
+    session.add(Message(
+        conversation_id=conversation_id,
+        user_id=user_id,
+        role="user",
+        content=user_content
+    ))
+    session.add(Message(
+        conversation_id=conversation_id,
+        user_id=user_id,
+        role="assistant",
+        content=assistant_content
+    ))
+
+    updated_at = datetime.utcnow()
+    conversation = session.get(Conversation, conversation_id)
+    if conversation is not None:
+        conversation.updated_at = updated_at
+        session.add(conversation)
+    return updated_at
@@ -1,26 +1,319 @@
-"""Database connection and session management."""
+"""Database connection and session management.
+
+With DATABASE_REPLICA_URLS set, read-only work can use read_session() (or
+the get_read_session dependency) to read from a replica. Replica lag is
+measured in the background; replicas lagging more than
+REPLICA_MAX_LAG_SECONDS, or failing the check, are skipped. Reads for a user
+who committed a write within the last
+REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_INTERVAL_SECONDS go to the
+primary, so users see their own writes.
+
+Recent writes are marked in Redis when REDIS_URL is set, so every worker
+sees them. Without it they are only known to the worker that made them, and
+replicas are refused when more than one worker runs (WEB_CONCURRENCY).
+"""
+import itertools
+import logging
+import math
 import os
+import threading
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import event, inspect, text
 from sqlmodel import SQLModel, create_engine, Session
 from app.config import settings
+from app.metrics import metrics
+from app.tracing import instrument_engine
+
+logger = logging.getLogger(__name__)
 
-# Create database engine
 # For serverless (Vercel), use connection pooling with smaller pool size
 is_serverless = os.getenv("VERCEL") == "1" or os.getenv("SERVERLESS", "false").lower() == "true"
 pool_size = 1 if is_serverless else 5  # Smaller pool for serverless
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    echo=os.getenv("ENVIRONMENT", "development") == "development",  # Log SQL queries only in development
-    pool_pre_ping=True,  # Verify connections before using
-    pool_size=pool_size,
-    max_overflow=0 if is_serverless else 10,  # No overflow for serverless
-    pool_recycle=300,  # Recycle connections after 5 minutes
+
+def create_db_engine(url: Optional[str] = None):
+    """Create the database engine (the primary unless a URL is given)."""
+    db_engine = create_engine(
+        url or settings.DATABASE_URL,
+        echo=os.getenv("ENVIRONMENT", "development") == "development",  # Log SQL queries only in development
+        pool_pre_ping=True,  # Verify connections before using
+        pool_size=pool_size,
+        max_overflow=0 if is_serverless else 10,  # No overflow for serverless
+        pool_recycle=300,  # Recycle connections after 5 minutes
+    )
+    # Emit a tracing span per SQL statement (no-op when tracing is disabled)
+    instrument_engine(db_engine)
+    instrument_pool(db_engine)
+    return db_engine
+
+
+def instrument_pool(db_engine) -> None:
+    """Track pool occupancy: connections checked out and how long each is held."""
+
+    @event.listens_for(db_engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        metrics.adjust_gauge("db.pool.checked_out", 1)
+
+    @event.listens_for(db_engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        if started is None:
+            return  # Never checked out (e.g. invalidated during connect)
+        metrics.adjust_gauge("db.pool.checked_out", -1)
+        metrics.observe("db.pool.hold_ms", (time.perf_counter() - started) * 1000)
+
+
+# Create database engine
+engine = create_db_engine()
+
+
+# Seconds a replica is behind; 0 when it has replayed everything it received
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
 )
 
 
+class _Replica:
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.engine = create_db_engine(url)
+        self.lag: Optional[float] = None  # None until measured or after a failed check
+
+
+class LocalWriteMarks:
+    """Users who wrote within the window, as known to this process."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._last_write: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._last_write[user_id] = now
+            if len(self._last_write) > 10_000:
+                cutoff = now - self.window
+                self._last_write = {uid: at for uid, at in self._last_write.items() if at > cutoff}
+
+    def recent(self, user_id: int) -> bool:
+        wrote_at = self._last_write.get(user_id)
+        return wrote_at is not None and time.monotonic() - wrote_at < self.window
+
+
+class RedisWriteMarks:
+    """Users who wrote within the window, shared by all workers as expiring Redis keys."""
+
+    def __init__(self, url: str, window: float, prefix: str = "recent-write:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("DATABASE_REPLICA_URLS with REDIS_URL requires the 'redis' package") from e
+        self.window_ms = max(1, math.ceil(window * 1000))
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0)
+
+    def mark(self, user_id: int) -> None:
+        try:
+            self._client.set(f"{self.prefix}{user_id}", 1, px=self.window_ms)
+        except Exception as e:
+            metrics.increment("db.write_marks.errors")
+            logger.warning(f"Could not mark a recent write of user {user_id}: {e}")
+
+    def recent(self, user_id: int) -> bool:
+        try:
+            return bool(self._client.exists(f"{self.prefix}{user_id}"))
+        except Exception as e:
+            metrics.increment("db.write_marks.errors")
+            logger.warning(f"Could not check recent writes of user {user_id}: {e}")
+            return True  # Unknown: read from the primary
+
+
+class ReplicaRouter:
+    """Chooses the engine for read-only work."""
+
+    def __init__(self, urls: List[str], max_lag: float, check_interval: float, redis_url: Optional[str] = None):
+        self.replicas = [_Replica(i, url) for i, url in enumerate(urls)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # A replica may have fallen this far behind since its last check
+        self.read_your_writes_window = max_lag + check_interval
+        if redis_url and self.replicas:
+            self.write_marks = RedisWriteMarks(redis_url, self.read_your_writes_window)
+        else:
+            self.write_marks = LocalWriteMarks(self.read_your_writes_window)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._checker_pid: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def note_write(self, user_id: int) -> None:
+        """Record a committed write so the user's next reads see it."""
+        self.write_marks.mark(user_id)
+
+    def read_engine(self, user_id: Optional[int] = None):
+        """A replica engine if one is usable for this read, else the primary."""
+        if not self.enabled:
+            return engine
+        self._ensure_checker()
+        if user_id is not None and self.write_marks.recent(user_id):
+            metrics.increment("db.reads.primary_recent_write")
+            return engine
+        healthy = [r for r in self.replicas if r.lag is not None and r.lag <= self.max_lag]
+        if not healthy:
+            metrics.increment("db.reads.primary_fallback")
+            return engine
+        metrics.increment("db.reads.replica")
+        return healthy[next(self._next) % len(healthy)].engine
+
+    def check_lag(self) -> None:
+        """Measure every replica's lag once."""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    if conn.dialect.name == "postgresql":
+                        replica.lag = float(conn.execute(POSTGRES_LAG_QUERY).scalar() or 0.0)
+                    else:
+                        conn.execute(text("SELECT 1"))  # e.g. SQLite files standing in locally
+                        replica.lag = 0.0
+            except Exception as e:
+                if replica.lag is not None:
+                    logger.warning(f"Replica {replica.index} failed its lag check: {e}")
+                replica.lag = None
+            metrics.set_gauge(f"db.replica.{replica.index}.lag_seconds", replica.lag if replica.lag is not None else -1)
+
+    def dispose(self) -> None:
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+    def _ensure_checker(self) -> None:
+        # One checker thread per process; started lazily so forked workers get their own
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        self.check_lag()
+        threading.Thread(target=self._run_checker, name="replica-lag", daemon=True).start()
+
+    def _run_checker(self) -> None:
+        pid = os.getpid()
+        while self._checker_pid == pid:
+            time.sleep(self.check_interval)
+            self.check_lag()
+
+
+def _build_replica_router() -> ReplicaRouter:
+    urls = [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+    if urls and not settings.REDIS_URL and int(os.getenv("WEB_CONCURRENCY") or "1") > 1:
+        # Another worker would not know about a user's write and could read from a lagging replica
+        raise ValueError("DATABASE_REPLICA_URLS with more than one worker requires REDIS_URL")
+    return ReplicaRouter(
+        urls=urls,
+        max_lag=settings.REPLICA_MAX_LAG_SECONDS,
+        check_interval=settings.REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+        redis_url=settings.REDIS_URL,
+    )
+
+
+replicas = _build_replica_router()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_users(session, flush_context):
+    """Remember which users this transaction writes for."""
+    if not replicas.enabled:
+        return
+    users = session.info.setdefault("written_users", set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        user_id = getattr(obj, "user_id", None)
+        if user_id is not None:
+            users.add(user_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_written_users(orm_execute_state):
+    """Same for bulk INSERTs with a user_id column (e.g. transcript and import batches)."""
+    if not replicas.enabled or not orm_execute_state.is_insert:
+        return
+    params = orm_execute_state.parameters
+    rows = params if isinstance(params, list) else [params or {}]
+    users = orm_execute_state.session.info.setdefault("written_users", set())
+    users.update(row["user_id"] for row in rows if row.get("user_id") is not None)
+
+
+@event.listens_for(Session, "after_commit")
+def _note_written_users(session):
+    for user_id in session.info.pop("written_users", ()):
+        replicas.note_write(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_written_users(session):
+    session.info.pop("written_users", None)
+
+
+def reinit_engine_after_fork():
+    """Give a forked worker its own connection pool.
+
+    With a preloaded app (gunicorn --preload) the engine is created in the
+    master process. Pooled connections must never be shared between
+    processes, so each child swaps in a fresh, empty pool. close=False
+    leaves the parent's sockets alone instead of closing them from the child.
+    The engine object itself is kept, so modules holding a reference to it
+    keep working.
+    """
+    engine.dispose(close=False)
+    replicas.dispose()
+
+
+# Any fork (gunicorn preload, multiprocessing) re-initializes the pool in the child
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reinit_engine_after_fork)
+
+
 def init_db():
     """Initialize database tables."""
     SQLModel.metadata.create_all(engine)
+    add_missing_columns()
+
+
+def add_missing_columns() -> None:
+    """Additive migration: add columns and indexes new to existing tables.
+
+    create_all only creates missing tables. New columns must be nullable or
+    have a server_default.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    logger.info(f"Created index {index.name}")
 
 
 def get_session():
@@ -28,3 +321,13 @@ def get_session():
     with Session(engine) as session:
         yield session
 
+
+def read_session(user_id: Optional[int] = None) -> Session:
+    """A session for read-only work on behalf of a user (a replica when one is usable)."""
+    return Session(replicas.read_engine(user_id))
+
+
+def get_read_session(user_id: int):
+    """Read-only session for routes under /api/{user_id}/ (user_id is the path parameter)."""
+    with read_session(user_id) as session:
+        yield session
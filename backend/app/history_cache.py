@@ -0,0 +1,131 @@
+"""Per-worker cache of conversation histories.
+
+Entries are keyed by conversation id and versioned by the conversation's
+``updated_at``, which every transcript write bumps in the same transaction
+as the messages. A read whose version matches the cached one skips the
+message query; a write made through this worker appends its two messages to
+the cached entry, so the next turn is a hit as well. Writes made elsewhere
+(other workers, background jobs) change the version and force a reload.
+
+The cache is bounded by the estimated size of the cached messages and evicts
+least recently used conversations first.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+from app.config import settings
+from app.metrics import metrics
+
+# Rough per-message overhead of the dict, strings and list slot
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def estimate_size(messages: List[Dict[str, str]]) -> int:
+    """Approximate memory held by a list of messages."""
+    return sum(
+        MESSAGE_OVERHEAD_BYTES + len(message["role"]) + len(message["content"].encode("utf-8"))
+        for message in messages
+    )
+
+
+class _Entry(NamedTuple):
+    version: datetime
+    messages: List[Dict[str, str]]
+    size: int
+
+
+class HistoryCache:
+    """Append-only, version-checked LRU of conversation histories."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, conversation_id: int, version: datetime) -> Optional[List[Dict[str, str]]]:
+        """Cached history if its version matches, else None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self._record("misses")
+                return None
+            if entry.version != version:
+                self._remove(conversation_id)
+                self._record("stale")
+                return None
+            self._entries.move_to_end(conversation_id)
+            self._record("hits")
+        return list(entry.messages)
+
+    def put(self, conversation_id: int, version: datetime, messages: List[Dict[str, str]]) -> None:
+        """Cache a history loaded at the given version."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remove(conversation_id)
+            self._insert(conversation_id, _Entry(version, list(messages), estimate_size(messages)))
+
+    def append(self, conversation_id: int, old_version: datetime, new_version: datetime,
+               messages: List[Dict[str, str]]) -> None:
+        """Add newly written messages, if the entry is still at old_version."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            self._remove(conversation_id)
+            if entry.version != old_version:
+                return  # Someone else wrote in between; reload on next read
+            self._insert(conversation_id, _Entry(
+                new_version, entry.messages + list(messages), entry.size + estimate_size(messages)
+            ))
+
+    def invalidate(self, conversation_id: int) -> None:
+        with self._lock:
+            self._remove(conversation_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self._publish()
+
+    def _record(self, outcome: str) -> None:
+        metrics.increment(f"history_cache.{outcome}")
+        hits = metrics.counter("history_cache.hits")
+        lookups = hits + metrics.counter("history_cache.misses") + metrics.counter("history_cache.stale")
+        metrics.set_gauge("history_cache.hit_rate", round(hits / lookups, 4))
+
+    def _insert(self, conversation_id: int, entry: _Entry) -> None:
+        if entry.size > self.max_bytes:
+            return  # Larger than the whole cache; never cached
+        self._entries[conversation_id] = entry
+        self.total_bytes += entry.size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            metrics.increment("history_cache.evictions")
+        self._publish()
+
+    def _remove(self, conversation_id: int) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+            self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("history_cache.bytes", self.total_bytes)
+        metrics.set_gauge("history_cache.entries", len(self._entries))
+
+
+# Global cache for this worker process
+history_cache = HistoryCache(max_bytes=settings.HISTORY_CACHE_MAX_BYTES)
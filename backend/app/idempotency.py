@@ -0,0 +1,246 @@
+"""Idempotency-Key support for retried POST requests.
+
+The first request with a key claims it by inserting an ``in_progress`` row;
+its response is stored in the same transaction as the work it describes.
+A retry with the same key then gets the stored response back, or, while the
+original is still running, waits for it instead of starting the work again.
+A request that fails releases its key so the next retry runs normally.
+Keys are scoped per user and endpoint and expire after IDEMPOTENCY_TTL_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple, Union
+from fastapi import HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL_SECONDS = 0.5
+
+# Wake-ups for retries waiting on a request running in this process
+_inflight: Dict[Tuple[int, str, str], asyncio.Event] = {}
+_last_purge = 0.0
+
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request body, to reject a key reused for a different request."""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class StoredResponse:
+    """A completed request's response, replayed for retries."""
+
+    def __init__(self, status_code: int, body: str):
+        self.status_code = status_code
+        self.body = body
+
+    def to_response(self) -> Response:
+        metrics.increment("idempotency.replayed")
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+class ClaimedKey:
+    """A key this request owns until it stores a response or releases it."""
+
+    def __init__(self, record_id: int, user_id: int, scope: str, key: str):
+        self.record_id = record_id
+        self.slot = (user_id, scope, key)
+        _inflight.setdefault(self.slot, asyncio.Event())
+
+    def store(self, session: Session, status_code: int, body: Any) -> None:
+        """Stage the response in the caller's transaction (the caller commits)."""
+        session.exec(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.id == self.record_id)
+            .values(
+                status="completed",
+                response_status=status_code,
+                response_body=json.dumps(jsonable_encoder(body)),
+                updated_at=datetime.utcnow(),
+            )
+        )
+
+    def done(self) -> None:
+        """The stored response committed; wake waiting retries."""
+        self._wake()
+
+    async def release(self) -> None:
+        """The request failed; free the key so a retry runs the work again."""
+        try:
+            # Shielded: release also runs when the request was cancelled
+            await asyncio.shield(run_in_threadpool(self._delete))
+        finally:
+            self._wake()
+
+    def _delete(self) -> None:
+        try:
+            with Session(engine) as session:
+                session.exec(delete(IdempotencyKey).where(
+                    IdempotencyKey.id == self.record_id,
+                    IdempotencyKey.status == "in_progress"
+                ))
+                session.commit()
+        except Exception as e:
+            logger.warning(f"Could not release idempotency key {self.slot}: {e}")
+
+    def _wake(self) -> None:
+        event = _inflight.pop(self.slot, None)
+        if event is not None:
+            event.set()
+
+
+def _try_insert(user_id: int, scope: str, key: str, fingerprint: str) -> Optional[int]:
+    """Insert an in-progress row; None if the key already exists."""
+    now = datetime.utcnow()
+    record = IdempotencyKey(
+        user_id=user_id,
+        scope=scope,
+        key=key,
+        request_hash=fingerprint,
+        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+    )
+    with Session(engine) as session:
+        session.add(record)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return None
+        return record.id
+
+
+def _load(user_id: int, scope: str, key: str) -> Optional[IdempotencyKey]:
+    with Session(engine) as session:
+        statement = select(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.scope == scope,
+            IdempotencyKey.key == key
+        )
+        record = session.exec(statement).first()
+        if record is not None:
+            session.expunge(record)
+        return record
+
+
+def _delete_expired(record: IdempotencyKey) -> None:
+    with Session(engine) as session:
+        session.exec(delete(IdempotencyKey).where(
+            IdempotencyKey.id == record.id,
+            IdempotencyKey.expires_at < datetime.utcnow()
+        ))
+        session.commit()
+
+
+def _take_over(record: IdempotencyKey) -> bool:
+    """Claim an in-progress row whose owner stopped without finishing."""
+    with Session(engine) as session:
+        result = session.exec(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.id == record.id, IdempotencyKey.updated_at == record.updated_at)
+            .values(updated_at=datetime.utcnow())
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def purge_expired() -> int:
+    """Delete expired keys."""
+    global _last_purge
+    _last_purge = time.monotonic()
+    with Session(engine) as session:
+        result = session.exec(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+        session.commit()
+        return result.rowcount
+
+
+def _maybe_purge() -> None:
+    if time.monotonic() - _last_purge < settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS:
+        return
+    try:
+        removed = purge_expired()
+        if removed:
+            logger.info(f"Purged {removed} expired idempotency key(s)")
+    except Exception as e:
+        logger.warning(f"Idempotency key cleanup failed: {e}")
+
+
+async def claim_key(user_id: int, scope: str, key: str, fingerprint: str) -> Union[ClaimedKey, StoredResponse]:
+    """Claim the key, or return the stored response of the request that owns it.
+
+    If the owner is still running, waits for it (up to
+    IDEMPOTENCY_WAIT_SECONDS) rather than running the work a second time.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"
+        )
+    if time.monotonic() - _last_purge >= settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS:
+        await run_in_threadpool(_maybe_purge)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.IDEMPOTENCY_WAIT_SECONDS
+    waited = False
+    while True:
+        record_id = await run_in_threadpool(_try_insert, user_id, scope, key, fingerprint)
+        if record_id is not None:
+            return ClaimedKey(record_id, user_id, scope, key)
+
+        record = await run_in_threadpool(_load, user_id, scope, key)
+        if record is None:
+            continue  # Released between our insert and load
+        if record.expires_at < datetime.utcnow():
+            await run_in_threadpool(_delete_expired, record)
+            continue
+        if record.request_hash != fingerprint:
+            raise HTTPException(
+                status_code=422,  # Unprocessable Content; the constant's name differs across Starlette versions
+                detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+            )
+        if record.status == "completed":
+            return StoredResponse(record.response_status, record.response_body)
+
+        stale_at = record.updated_at + timedelta(seconds=settings.IDEMPOTENCY_IN_FLIGHT_TIMEOUT_SECONDS)
+        if datetime.utcnow() > stale_at and await run_in_threadpool(_take_over, record):
+            logger.warning(f"Taking over stale in-progress idempotency key {(user_id, scope, key)}")
+            return ClaimedKey(record.id, user_id, scope, key)
+
+        if not waited:
+            metrics.increment("idempotency.attached")
+            waited = True
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": str(max(1, round(POLL_INTERVAL_SECONDS * 4)))}
+            )
+        # Woken at once if the owner runs in this process; otherwise poll
+        event = _inflight.get((user_id, scope, key))
+        if event is None:
+            await asyncio.sleep(min(remaining, POLL_INTERVAL_SECONDS))
+            continue
+        try:
+            await asyncio.wait_for(event.wait(), min(remaining, POLL_INTERVAL_SECONDS))
+        except asyncio.TimeoutError:
+            pass
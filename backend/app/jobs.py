@@ -0,0 +1,279 @@
+"""Background agent runs: job records, worker pool and completion notifications.
+
+The AgentJob table doubles as a local queue stand-in. The API inserts a
+``queued`` row; a worker claims it with a conditional UPDATE (so two workers
+can never run the same job), runs the agent and persists the resulting
+messages. Workers run either in-process (JOB_WORKER_MODE=inprocess, fed by an
+asyncio queue) or in a separate ``python -m app.worker`` process that polls
+the table (JOB_WORKER_MODE=external).
+
+Serverless platforms freeze or discard the process once the response is
+sent, so an in-process pool would leave jobs queued until a later cold
+start. There jobs always run in external mode, and a worker must run
+elsewhere.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine, is_serverless
+from app.models import AgentJob, User
+from app.metrics import metrics
+from app.ratelimit import RateLimitExceeded
+from app.conversations import add_turn
+from app.agents.todo_agent import load_agent_context, run_agent
+from app.mcp.compensation import CompensationLog
+from app import tracing
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def _worker_mode() -> str:
+    if settings.JOB_WORKER_MODE == "inprocess" and is_serverless:
+        logger.warning("JOB_WORKER_MODE=inprocess is not supported on serverless platforms; "
+                       "background jobs stay queued until `python -m app.worker` runs them")
+        return "external"
+    return settings.JOB_WORKER_MODE
+
+
+# The effective JOB_WORKER_MODE
+worker_mode = _worker_mode()
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def create_job(session: Session, user_id: int, conversation_id: int, message: str, max_active: int = 0) -> AgentJob:
+    """Insert a queued job and commit it.
+    
+    With max_active > 0, raises RateLimitExceeded instead if the user already
+    has that many jobs queued or running.
+    """
+    if max_active > 0:
+        # Lock the user row so concurrent requests count and insert one at a time
+        session.exec(select(User.id).where(User.id == user_id).with_for_update()).first()
+        active = session.exec(
+            select(func.count()).select_from(AgentJob)
+            .where(AgentJob.user_id == user_id, AgentJob.status.in_(ACTIVE_STATUSES))
+        ).one()
+        if active >= max_active:
+            session.rollback()
+            metrics.increment("jobs.rejected")
+            raise RateLimitExceeded(settings.JOB_POLL_INTERVAL_SECONDS, "Too many background jobs in progress")
+    job = AgentJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        message=message,
+    )
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    metrics.increment("jobs.created")
+    return job
+
+
+def get_job(job_id: str, user_id: int) -> Optional[AgentJob]:
+    """Fetch a job owned by the user, using a short-lived session."""
+    with Session(engine) as session:
+        statement = select(AgentJob).where(AgentJob.id == job_id, AgentJob.user_id == user_id)
+        job = session.exec(statement).first()
+        if job is not None:
+            session.expunge(job)
+        return job
+
+
+def _claim_job(job_id: str) -> Optional[Tuple[AgentJob, List[Dict[str, str]], Optional[str]]]:
+    """Atomically move a job from queued to running and load its history and task context."""
+    with Session(engine) as session:
+        result = session.exec(
+            update(AgentJob)
+            .where(AgentJob.id == job_id, AgentJob.status == "queued")
+            .values(status="running", updated_at=datetime.utcnow())
+        )
+        session.commit()
+        if result.rowcount != 1:
+            return None  # Already claimed by another worker (or gone)
+
+        job = session.get(AgentJob, job_id)
+        history, task_context, _ = load_agent_context(session, job.conversation_id, job.user_id)
+        session.expunge(job)
+        return job, history, task_context
+
+
+def _complete_job(job: AgentJob, response: str, tool_calls: List[str]) -> None:
+    """Persist the turn's messages and mark the job succeeded in one transaction."""
+    with Session(engine) as session:
+        add_turn(session, job.conversation_id, job.user_id, job.message, response)
+        session.exec(
+            update(AgentJob)
+            .where(AgentJob.id == job.id)
+            .values(status="succeeded", response=response, tool_calls=json.dumps(tool_calls), updated_at=datetime.utcnow())
+        )
+        session.commit()
+
+
+def _fail_job(job_id: str, error: str) -> None:
+    with Session(engine) as session:
+        session.exec(
+            update(AgentJob)
+            .where(AgentJob.id == job_id)
+            .values(status="failed", error=error[:1000], updated_at=datetime.utcnow())
+        )
+        session.commit()
+
+
+async def execute_job(job_id: str) -> None:
+    """Run one queued job to completion (no-op if another worker claimed it)."""
+    # Job bookkeeping runs in the threadpool so it never blocks the event loop
+    claimed = await run_in_threadpool(_claim_job, job_id)
+    if claimed is None:
+        return
+    job, history, task_context = claimed
+
+    with tracing.span("job.run", **{"job.id": job_id, "user.id": job.user_id}):
+        compensation = CompensationLog()
+        try:
+            # A DB session is opened only around each batch of tool calls
+            response, tool_calls = await run_agent(
+                user_id=str(job.user_id),
+                user_message=job.message,
+                conversation_history=history,
+                task_context=task_context,
+                session_factory=lambda: Session(engine),
+                compensation_log=compensation
+            )
+            await run_in_threadpool(_complete_job, job, response, tool_calls)
+        except Exception as e:
+            logger.warning(f"Agent job {job_id} failed: {e}")
+            await run_in_threadpool(compensation.compensate, lambda: Session(engine))
+            await run_in_threadpool(_fail_job, job_id, f"Error calling AI agent: {str(e)}")
+            metrics.increment("jobs.failed")
+        else:
+            metrics.increment("jobs.succeeded")
+
+    notify_job_finished(job_id)
+
+
+def fail_stale_jobs() -> int:
+    """Fail jobs left running by a crashed worker.
+
+    They are not retried: their tools may already have changed tasks.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    with Session(engine) as session:
+        result = session.exec(
+            update(AgentJob)
+            .where(AgentJob.status == "running", AgentJob.updated_at < cutoff)
+            .values(status="failed", error="Worker stopped before the job finished", updated_at=datetime.utcnow())
+        )
+        session.commit()
+        return result.rowcount
+
+
+def queued_job_ids(limit: int) -> List[str]:
+    """Oldest queued job ids."""
+    with Session(engine) as session:
+        statement = select(AgentJob.id).where(
+            AgentJob.status == "queued"
+        ).order_by(AgentJob.created_at).limit(limit)
+        return list(session.exec(statement).all())
+
+
+# Completion notifications for long-polling clients served by this process
+_job_events: Dict[str, asyncio.Event] = {}
+
+
+def notify_job_finished(job_id: str) -> None:
+    event = _job_events.pop(job_id, None)
+    if event is not None:
+        event.set()
+
+
+async def wait_for_job(job_id: str, user_id: int, timeout: float) -> Optional[AgentJob]:
+    """Return the job once it finishes, or its current state after timeout.
+
+    Jobs run in this process wake the waiter immediately; jobs run by an
+    external worker are picked up by polling. No DB connection is held
+    between polls.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        job = get_job(job_id, user_id)
+        remaining = deadline - loop.time()
+        if job is None or job.status in TERMINAL_STATUSES or remaining <= 0:
+            return job
+        event = _job_events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), min(remaining, settings.JOB_POLL_INTERVAL_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+
+
+class JobQueue:
+    """In-process worker pool fed by an asyncio queue."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """Start the workers and pick up jobs queued before a restart."""
+        if self.started:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"agent-job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        try:
+            fail_stale_jobs()
+            for job_id in queued_job_ids(limit=1000):
+                self._queue.put_nowait(job_id)
+        except Exception as e:
+            logger.warning(f"Could not recover queued jobs: {e}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, job_id: str) -> None:
+        """Queue a committed job (starts the pool lazily, e.g. without lifespan events)."""
+        self.start()
+        self._queue.put_nowait(job_id)
+        metrics.set_gauge("jobs.queue_depth", self._queue.qsize())
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await execute_job(job_id)
+            except Exception as e:
+                logger.exception(f"Unexpected error running job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+                metrics.set_gauge("jobs.queue_depth", self._queue.qsize())
+
+
+job_queue = JobQueue(workers=settings.JOB_WORKERS)
+
+
+def enqueue_job(job_id: str) -> None:
+    """Hand a committed job to the configured worker."""
+    if worker_mode == "inprocess":
+        job_queue.enqueue(job_id)
+    # In "external" mode the worker process polls the table for queued rows
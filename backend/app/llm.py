@@ -0,0 +1,247 @@
+"""Resilient LLM calls: per-attempt deadlines, retries, hedging and a circuit breaker.
+
+Wraps ``client.chat.completions.create``. Each attempt gets its own deadline.
+Rate limits (429), server errors (5xx), timeouts and connection errors are
+retried with full-jitter exponential backoff, honouring Retry-After. With
+LLM_HEDGE_ENABLED, an attempt still running past the recent latency
+percentile is raced against the same request to LLM_FALLBACK_MODEL; the first
+success wins. After the retries are spent, one last attempt goes to the
+fallback model. A circuit breaker counts consecutive failed calls and rejects
+calls outright while the provider looks down, then lets a probe through after
+LLM_CIRCUIT_RESET_SECONDS.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Optional
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailableError(Exception):
+    """Raised without calling the provider while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM provider unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open probe after a cool-down."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise LLMUnavailableError unless a call may go through."""
+        state = self.state
+        if state == "closed" or self.failure_threshold <= 0:
+            return
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True  # Let one call test the provider
+            return
+        metrics.increment("llm.circuit.rejected")
+        remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+        raise LLMUnavailableError(max(remaining, 1.0))
+
+    def release_probe(self) -> None:
+        """The half-open probe ended without a verdict (e.g. it was cancelled)."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("LLM circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        metrics.set_gauge("llm.circuit.open", 0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.failure_threshold > 0 and (self.failures >= self.failure_threshold or self.opened_at is not None):
+            if self.opened_at is None:
+                logger.warning(f"LLM circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            metrics.set_gauge("llm.circuit.open", 1)
+
+
+class LatencyTracker:
+    """Recent successful attempt latencies, for the hedging threshold."""
+
+    def __init__(self, max_samples: int = 200):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 20) -> Optional[float]:
+        """Latency at the percentile, or None until enough samples are seen."""
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Transient provider failures: timeouts, connection errors, 429 and 5xx."""
+    if isinstance(exc, (asyncio.TimeoutError, APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ResilientLLM:
+    """Drop-in for ``client.chat.completions.create`` with the policies above."""
+
+    def __init__(self, client, timeout: float, max_retries: int, retry_base_delay: float,
+                 retry_max_delay: float, fallback_model: Optional[str] = None,
+                 hedge_enabled: bool = False, hedge_percentile: float = 95,
+                 hedge_min_delay: float = 2.0, breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.fallback_model = fallback_model
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(failure_threshold=0, reset_seconds=0)
+        self.latency = LatencyTracker()
+
+    async def create(self, model: str, **kwargs: Any):
+        """Create a chat completion; the response's ``model`` says which model answered."""
+        self.breaker.before_call()
+        try:
+            response = await self._create(model, kwargs)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            elif isinstance(e, APIStatusError):
+                self.breaker.record_success()  # The provider answered; the request was bad
+            else:
+                self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _create(self, model: str, kwargs: dict):
+        fallback = self.fallback_model if self.fallback_model and self.fallback_model != model else None
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = _retry_after(last_error)
+                if delay is None:
+                    delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+                metrics.increment("llm.retries")
+                await asyncio.sleep(min(delay, self.retry_max_delay))
+            try:
+                return await self._hedged_attempt(model, fallback, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                logger.warning(f"LLM attempt {attempt + 1} on {model} failed: {type(e).__name__}: {e}")
+
+        if fallback is None:
+            raise last_error
+        metrics.increment("llm.fallbacks")
+        return await self._attempt(fallback, kwargs)
+
+    async def _attempt(self, model: str, kwargs: dict):
+        """One request under the per-attempt deadline."""
+        metrics.increment("llm.attempts")
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(model=model, **kwargs),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            metrics.increment("llm.timeouts")
+            raise
+        elapsed = time.perf_counter() - started
+        self.latency.record(elapsed)
+        metrics.observe("llm.latency_ms", elapsed * 1000)
+        return response
+
+    async def _hedged_attempt(self, model: str, fallback: Optional[str], kwargs: dict):
+        """Race a slow primary attempt against the fallback model."""
+        if not (self.hedge_enabled and fallback):
+            return await self._attempt(model, kwargs)
+
+        hedge_delay = max(self.latency.percentile(self.hedge_percentile) or 0, self.hedge_min_delay)
+        primary = asyncio.ensure_future(self._attempt(model, kwargs))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            metrics.increment("llm.hedges")
+            hedge = asyncio.ensure_future(self._attempt(fallback, kwargs))
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.increment("llm.hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def build_resilient_llm(client) -> ResilientLLM:
+    """ResilientLLM configured from settings."""
+    return ResilientLLM(
+        client,
+        timeout=settings.LLM_TIMEOUT_SECONDS,
+        max_retries=settings.LLM_MAX_RETRIES,
+        retry_base_delay=settings.LLM_RETRY_BASE_DELAY_SECONDS,
+        retry_max_delay=settings.LLM_RETRY_MAX_DELAY_SECONDS,
+        fallback_model=settings.LLM_FALLBACK_MODEL,
+        hedge_enabled=settings.LLM_HEDGE_ENABLED,
+        hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+        breaker=CircuitBreaker(
+            failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+            reset_seconds=settings.LLM_CIRCUIT_RESET_SECONDS,
+        ),
+    )
@@ -2,8 +2,19 @@
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.config import settings
 from app.database import init_db
-from app.routes import auth, tasks, chat
+from app.compression import CompressionMiddleware
+from app.metrics import metrics
+from app.profiler import ProfilerMiddleware
+from app.jobs import job_queue, worker_mode
+from app.reminders import reminder_scheduler
+from app.retention import retention_enabled, retention_job
+from app.task_order import rebalance_job
+from app.task_stats import reconcile_job
+from app.transcripts import transcript_writer
+from app.usage import usage_recorder
+from app.routes import admin, auth, tasks, chat
 
 # Create FastAPI app
 app = FastAPI(
@@ -37,6 +48,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Optional gzip/brotli response compression
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MIN_SIZE,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+    )
+
+# Samples a request only while an admin has armed /api/admin/profile/next
+app.add_middleware(ProfilerMiddleware)
+
 # Initialize database on startup
 # Note: In serverless environments, this runs on cold start
 @app.on_event("startup")
@@ -48,11 +71,50 @@ async def startup_event():
         # Log error but don't fail startup (tables might already exist)
         import logging
         logging.warning(f"Database initialization warning: {e}")
+    
+    # Start the in-process agent job workers
+    if worker_mode == "inprocess":
+        job_queue.start()
+    
+    # Write spooled chat turns left by a previous run, then start batching
+    if settings.TRANSCRIPT_WRITE_BEHIND:
+        transcript_writer.start()
+    
+    # Compact, expire and purge chat messages per the retention settings
+    if retention_enabled():
+        retention_job.start()
+    
+    # Write per-user LLM usage counters in batches
+    usage_recorder.start()
+    
+    # Repair drift in the per-user task counters
+    if settings.TASK_STATS_RECONCILE_INTERVAL_SECONDS > 0:
+        reconcile_job.start()
+    
+    # Renumber manual task orders that ran short of rank precision
+    rebalance_job.start()
+    
+    # Fire reminders for tasks as they come due
+    if settings.REMINDERS_ENABLED:
+        reminder_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers."""
+    await job_queue.stop()
+    await transcript_writer.stop()
+    await retention_job.stop()
+    await reminder_scheduler.stop()
+    await reconcile_job.stop()
+    await rebalance_job.stop()
+    await usage_recorder.stop()
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(tasks.router)
 app.include_router(chat.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
@@ -68,3 +130,7 @@ async def health():
     """Health check endpoint."""
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process metrics for this worker."""
+    return metrics.snapshot()
@@ -0,0 +1,79 @@
+"""Compensation log for task writes committed during one agent turn.
+
+When tools commit in short per-batch transactions, a turn that fails later
+(LLM error, failure persisting the transcript) can no longer be undone with a
+single rollback. Tools record the inverse of each write here; the chat route
+replays the inverses for committed batches so a failed turn leaves no task
+changes behind, as it did when the whole turn was one transaction.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlmodel import Session
+from app.models import Task
+
+logger = logging.getLogger(__name__)
+
+
+class CompensationLog:
+    """Undo entries, split into committed and not-yet-committed ones."""
+
+    def __init__(self):
+        self.committed: List[Tuple[str, int, Optional[Dict[str, Any]]]] = []
+        self.pending: List[Tuple[str, int, Optional[Dict[str, Any]]]] = []
+
+    def record_created(self, task: Task) -> None:
+        """Undo: delete the new task."""
+        self.pending.append(("created", task.id, None))
+
+    def record_updated(self, task: Task, previous: Dict[str, Any]) -> None:
+        """Undo: restore the given previous field values."""
+        self.pending.append(("updated", task.id, previous))
+
+    def record_deleted(self, task: Task) -> None:
+        """Undo: re-insert the task with its original id and values."""
+        self.pending.append(("deleted", task.id, task.model_dump()))
+
+    def commit(self) -> None:
+        """The batch holding the pending entries committed."""
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def discard_pending(self) -> None:
+        """The batch holding the pending entries rolled back."""
+        self.pending = []
+
+    def compensate(self, session_factory: Callable[[], Session]) -> None:
+        """Apply the inverse of every committed write, newest first, in one transaction."""
+        if not self.committed:
+            return
+        with session_factory() as session:
+            for kind, task_id, data in reversed(self.committed):
+                task = session.get(Task, task_id)
+                if kind == "created":
+                    if task is not None:
+                        session.delete(task)
+                elif kind == "updated":
+                    if task is not None:
+                        for field, value in data.items():
+                            setattr(task, field, value)
+                        session.add(task)
+                elif kind == "deleted":
+                    if task is None:
+                        session.add(Task(**data))
+                session.flush()
+            session.commit()
+        logger.info(f"Compensated {len(self.committed)} task write(s) from a failed agent turn")
+        self.committed = []
+
+
+def get_compensation_log(session: Session) -> Optional[CompensationLog]:
+    """The log attached to a tool session, if any."""
+    return session.info.get("compensation_log")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_entries(session):
+    log = session.info.get("compensation_log")
+    if log is not None:
+        log.discard_pending()
@@ -0,0 +1,144 @@
+"""Per-user fuzzy task lookup for resolving references like "the dentist one".
+
+Titles are embedded locally (no model download, CPU only) as hashed
+character trigrams plus whole words, L2-normalized, so cosine similarity is a
+single matrix-vector product. Each user's index is built from the database on
+first use and kept in an LRU. Before an index is used, the user's task count
+and newest ``updated_at`` are compared with the values it was built from, so
+a write from any worker process causes a rebuild. Indexes are also rebuilt
+after TASK_INDEX_TTL_SECONDS.
+
+Building and searching run database queries and NumPy work; call them from a
+worker thread.
+"""
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+from app.config import settings
+from app.metrics import metrics
+from app.models import Task
+
+DIMENSIONS = 1024
+_WORD_RE = re.compile(r"\w+")
+
+
+def embed(text: str) -> np.ndarray:
+    """Hashed character-trigram and word features, L2-normalized."""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        vector[zlib.crc32(b"w:" + word.encode()) % DIMENSIONS] += 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode()) % DIMENSIONS] += 1.0
+    # Damp repeated features so long titles don't dominate
+    np.sqrt(vector, out=vector)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class TaskMatch(NamedTuple):
+    task_id: int
+    title: str
+    completed: bool
+    score: float
+
+
+def task_version(session: Session, user_id: int) -> Tuple[int, Optional[datetime]]:
+    """The user's task count and newest updated_at; every task write changes one of them."""
+    count, newest = session.exec(
+        select(func.count(), func.max(Task.updated_at)).where(Task.user_id == user_id)
+    ).one()
+    return count, newest
+
+
+class _UserIndex:
+    """Embeddings for one user's tasks, one row per task."""
+
+    def __init__(self, tasks: List[Task], version: Tuple[int, Optional[datetime]]):
+        self.version = version
+        self.ids: List[int] = [task.id for task in tasks]
+        self.titles: List[str] = [task.title for task in tasks]
+        self.completed: List[bool] = [task.completed for task in tasks]
+        self.vectors = (
+            np.vstack([embed(task.title) for task in tasks])
+            if tasks else np.zeros((0, DIMENSIONS), dtype=np.float32)
+        )
+        self.built_at = time.monotonic()
+
+    def search(self, query: str, include_completed: bool, limit: int, min_score: float) -> List[TaskMatch]:
+        if not self.ids:
+            return []
+        scores = self.vectors @ embed(query)
+        if not include_completed:
+            scores = np.where(np.array(self.completed), -1.0, scores)
+        best = np.argsort(-scores)[:limit]
+        return [
+            TaskMatch(self.ids[row], self.titles[row], self.completed[row], round(float(scores[row]), 3))
+            for row in best
+            if scores[row] >= min_score
+        ]
+
+
+class TaskIndex:
+    """LRU of per-user indexes, rebuilt when the user's tasks change."""
+
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._indexes: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(self, session: Session, user_id: int, query: str, include_completed: bool = False,
+               limit: int = 3, min_score: float = 0.2) -> List[TaskMatch]:
+        """Best-matching tasks for the query, most similar first."""
+        index = self._get(session, user_id)
+        with self._lock:
+            return index.search(query, include_completed, limit, min_score)
+
+    def _get(self, session: Session, user_id: int) -> _UserIndex:
+        version = task_version(session, user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if (index is not None and index.version == version
+                    and time.monotonic() - index.built_at < self.ttl_seconds):
+                self._indexes.move_to_end(user_id)
+                metrics.increment("task_index.hits")
+                return index
+        if index is not None and index.version != version:
+            metrics.increment("task_index.stale")
+
+        metrics.increment("task_index.builds")
+        index = build_index(session, user_id, version)
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+
+def build_index(session: Session, user_id: int,
+                version: Optional[Tuple[int, Optional[datetime]]] = None) -> _UserIndex:
+    """Build a user's index from the tasks visible to the session."""
+    tasks = session.exec(select(Task).where(Task.user_id == user_id)).all()
+    return _UserIndex(list(tasks), version if version is not None else task_version(session, user_id))
+
+
+# Global index shared by the agent tools of this process
+task_index = TaskIndex(
+    max_users=settings.TASK_INDEX_MAX_USERS,
+    ttl_seconds=settings.TASK_INDEX_TTL_SECONDS,
+)
@@ -1,15 +1,41 @@
 """MCP Tools for task management."""
 from sqlmodel import Session, select
+from fastapi.concurrency import run_in_threadpool
 from app.database import get_session
 from app.models import Task, User
+from app.reminders import parse_due_at
+from app.mcp.compensation import get_compensation_log
+from app.mcp.task_index import build_index, task_index
+from app.singleflight import task_reads
+from app.task_events import has_uncommitted_changes
+from app.task_order import move_task as move_task_in_order
+from app.task_stats import get_stats
 from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
 import asyncio
 
+# Tool-facing priority names, by stored value
+PRIORITIES = ("none", "low", "medium", "high")
+
+
+def _task_fields(due_at: Optional[str], priority: Optional[str]) -> Dict[str, Any]:
+    """Convert the tools' due_at/priority arguments to column values ("" clears due_at)."""
+    fields: Dict[str, Any] = {}
+    if due_at is not None:
+        fields["due_at"] = parse_due_at(due_at) if due_at.strip() else None
+    if priority is not None:
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        fields["priority"] = PRIORITIES.index(priority)
+    return fields
+
 
 async def add_task(
     user_id: str,
     title: str,
     description: str = "",
+    due_at: Optional[str] = None,
+    priority: Optional[str] = None,
     session: Session = None
 ) -> Dict[str, Any]:
     """
@@ -19,6 +45,8 @@ async def add_task(
         user_id: User identifier (as string, will be converted to int)
         title: Task title (required)
         description: Task description (optional)
+        due_at: Due date/time, ISO 8601, UTC unless an offset is given (optional)
+        priority: "none", "low", "medium" or "high" (optional)
         session: Database session (required - must be passed from chat endpoint)
     
     Returns:
@@ -33,10 +61,19 @@ async def add_task(
         
         user_id_int = int(user_id)
         
+        try:
+            fields = _task_fields(due_at, priority)
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid task fields: {str(e)}"
+            }
+        
         new_task = Task(
             user_id=user_id_int,
             title=title,
-            description=description or ""
+            description=description or "",
+            **fields
         )
         
         session.add(new_task)
@@ -50,6 +87,10 @@ async def add_task(
                 "message": "Failed to create task - no ID assigned"
             }
         
+        compensation = get_compensation_log(session)
+        if compensation is not None:
+            compensation.record_created(new_task)
+        
         return {
             "task_id": new_task.id,
             "status": "success",
@@ -67,6 +108,7 @@ async def add_task(
 async def list_tasks(
     user_id: str,
     status: str = "all",
+    due_within_hours: Optional[float] = None,
     session: Session = None
 ) -> Dict[str, Any]:
     """
@@ -75,6 +117,8 @@ async def list_tasks(
     Args:
         user_id: User identifier (as string)
         status: Filter by status - "all", "pending", or "completed"
+        due_within_hours: Only tasks due within this many hours, including
+            overdue ones, soonest first (optional)
         session: Database session (required - must be passed from chat endpoint)
     
     Returns:
@@ -89,39 +133,161 @@ async def list_tasks(
         
         user_id_int = int(user_id)
         
-        # Expire all to ensure we see the latest data including flushed changes
-        session.expire_all()
+        def query() -> Dict[str, Any]:
+            # Expire all to ensure we see the latest data including flushed changes
+            session.expire_all()
+            
+            statement = select(Task).where(Task.user_id == user_id_int)
+            
+            if status == "pending":
+                statement = statement.where(Task.completed == False)
+            elif status == "completed":
+                statement = statement.where(Task.completed == True)
+            
+            if due_within_hours is not None:
+                horizon = datetime.utcnow() + timedelta(hours=float(due_within_hours))
+                statement = statement.where(Task.due_at <= horizon).order_by(Task.due_at, Task.priority.desc())
+            else:
+                # The user's manual order, as shown in the app
+                statement = statement.order_by(Task.rank, Task.id)
+            
+            tasks = session.exec(statement).all()
+            
+            task_list = [
+                {
+                    "id": task.id,
+                    "title": task.title,
+                    "description": task.description,
+                    "completed": task.completed,
+                    "due_at": task.due_at.isoformat() if task.due_at else None,
+                    "priority": PRIORITIES[task.priority],
+                    "created_at": task.created_at.isoformat()
+                }
+                for task in tasks
+            ]
+            
+            return {
+                "status": "success",
+                "count": len(task_list),
+                "tasks": task_list,
+                "message": f"Found {len(task_list)} task(s)"
+            }
+        
+        # This session's own uncommitted writes are invisible to other
+        # sessions, so only share the query when there are none
+        if has_uncommitted_changes(session):
+            return query()
         
-        statement = select(Task).where(Task.user_id == user_id_int)
+        async def shared_query() -> Dict[str, Any]:
+            return await run_in_threadpool(query)
         
-        if status == "pending":
-            statement = statement.where(Task.completed == False)
-        elif status == "completed":
-            statement = statement.where(Task.completed == True)
+        return dict(await task_reads.do(user_id_int, ("mcp", status, due_within_hours), shared_query))
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Failed to list tasks: {str(e)}"
+        }
+
+
+async def task_stats(
+    user_id: str,
+    session: Session = None
+) -> Dict[str, Any]:
+    """
+    Count the user's tasks without listing them.
+    
+    Args:
+        user_id: User identifier (as string)
+        session: Database session (required - must be passed from chat endpoint)
+    
+    Returns:
+        Dict with status and pending, completed, total and overdue counts
+    """
+    try:
+        if session is None:
+            return {
+                "status": "error",
+                "message": "Database session is required"
+            }
+        
+        # Reads the counter row, which includes this session's own flushed writes
+        counts = await run_in_threadpool(get_stats, session, int(user_id))
+        
+        return {
+            "status": "success",
+            "pending": counts.pending,
+            "completed": counts.completed,
+            "total": counts.total,
+            "overdue": counts.overdue,
+            "message": f"{counts.pending} pending, {counts.completed} completed, {counts.overdue} overdue"
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Failed to count tasks: {str(e)}"
+        }
+
+
+async def find_task(
+    user_id: str,
+    query: str,
+    status: str = "pending",
+    limit: int = 3,
+    session: Session = None
+) -> Dict[str, Any]:
+    """
+    Find the user's tasks that best match a description.
+    
+    Args:
+        user_id: User identifier (as string)
+        query: How the user referred to the task (e.g. "the dentist one")
+        status: "pending" (default) or "all" to include completed tasks
+        limit: Maximum number of matches (1-10)
+        session: Database session (required - must be passed from chat endpoint)
+    
+    Returns:
+        Dict with status and matches (task_id, title, completed, score), best first
+    """
+    try:
+        if session is None:
+            return {
+                "status": "error",
+                "message": "Database session is required"
+            }
+        
+        user_id_int = int(user_id)
+        include_completed = status == "all"
+        limit = max(1, min(int(limit), 10))
         
-        tasks = session.exec(statement.order_by(Task.created_at.desc())).all()
+        def search():
+            # The shared index only reflects committed writes; search this
+            # session's own view when it has uncommitted ones
+            if has_uncommitted_changes(session):
+                return build_index(session, user_id_int).search(query, include_completed, limit, min_score=0.2)
+            return task_index.search(session, user_id_int, query, include_completed, limit)
         
-        task_list = [
+        found = await run_in_threadpool(search)
+        
+        matches = [
             {
-                "id": task.id,
-                "title": task.title,
-                "description": task.description,
-                "completed": task.completed,
-                "created_at": task.created_at.isoformat()
+                "task_id": match.task_id,
+                "title": match.title,
+                "completed": match.completed,
+                "score": match.score
             }
-            for task in tasks
+            for match in found
         ]
         
         return {
             "status": "success",
-            "count": len(task_list),
-            "tasks": task_list,
-            "message": f"Found {len(task_list)} task(s)"
+            "count": len(matches),
+            "matches": matches,
+            "message": f"Found {len(matches)} matching task(s)" if matches else f"No task matches '{query}'"
         }
     except Exception as e:
         return {
             "status": "error",
-            "message": f"Failed to list tasks: {str(e)}"
+            "message": f"Failed to find task: {str(e)}"
         }
 
 
@@ -130,6 +296,8 @@ async def update_task(
     task_id: int,
     title: Optional[str] = None,
     description: Optional[str] = None,
+    due_at: Optional[str] = None,
+    priority: Optional[str] = None,
     session: Session = None
 ) -> Dict[str, Any]:
     """
@@ -140,6 +308,8 @@ async def update_task(
         task_id: Task ID to update
         title: New title (optional)
         description: New description (optional)
+        due_at: New due date/time, ISO 8601; "" removes it (optional)
+        priority: "none", "low", "medium" or "high" (optional)
         session: Database session (required - must be passed from chat endpoint)
     
     Returns:
@@ -154,6 +324,14 @@ async def update_task(
         
         user_id_int = int(user_id)
         
+        try:
+            fields = _task_fields(due_at, priority)
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid task fields: {str(e)}"
+            }
+        
         statement = select(Task).where(
             Task.id == task_id,
             Task.user_id == user_id_int
@@ -166,10 +344,26 @@ async def update_task(
                 "message": f"Task {task_id} not found"
             }
         
+        compensation = get_compensation_log(session)
+        if compensation is not None:
+            compensation.record_updated(task, {
+                "title": task.title,
+                "description": task.description,
+                "due_at": task.due_at,
+                "priority": task.priority,
+                "reminded_at": task.reminded_at,
+                "updated_at": task.updated_at
+            })
+        
         if title is not None:
             task.title = title
         if description is not None:
             task.description = description
+        if "priority" in fields:
+            task.priority = fields["priority"]
+        if "due_at" in fields and fields["due_at"] != task.due_at:
+            task.due_at = fields["due_at"]
+            task.reminded_at = None  # Remind again at the new time
         
         from datetime import datetime
         task.updated_at = datetime.utcnow()
@@ -192,6 +386,76 @@ async def update_task(
         }
 
 
+async def move_task(
+    user_id: str,
+    task_id: int,
+    after_task_id: Optional[int] = None,
+    before_task_id: Optional[int] = None,
+    position: Optional[str] = None,
+    session: Session = None
+) -> Dict[str, Any]:
+    """
+    Move a task in the user's manual order.
+    
+    Args:
+        user_id: User identifier (as string)
+        task_id: Task ID to move
+        after_task_id: Place it right after this task (optional)
+        before_task_id: Place it right before this task (optional)
+        position: "top" or "bottom" (optional; give exactly one of the three)
+        session: Database session (required - must be passed from chat endpoint)
+    
+    Returns:
+        Dict with task_id, status, and title
+    """
+    try:
+        if session is None:
+            return {
+                "status": "error",
+                "message": "Database session is required"
+            }
+        
+        user_id_int = int(user_id)
+        
+        task = session.exec(select(Task).where(Task.id == task_id, Task.user_id == user_id_int)).first()
+        if not task:
+            return {
+                "status": "error",
+                "message": f"Task {task_id} not found"
+            }
+        
+        previous = {"rank": task.rank, "updated_at": task.updated_at}
+        
+        try:
+            task = move_task_in_order(session, user_id_int, task_id, after_task_id, before_task_id, position)
+        except (LookupError, ValueError) as e:
+            return {
+                "status": "error",
+                "message": f"Cannot move task: {str(e)}"
+            }
+        
+        compensation = get_compensation_log(session)
+        if compensation is not None:
+            compensation.record_updated(task, previous)
+        
+        task.updated_at = datetime.utcnow()
+        session.add(task)
+        session.flush()
+        
+        return {
+            "task_id": task.id,
+            "status": "success",
+            "title": task.title,
+            "message": f"Task '{task.title}' moved"
+        }
+    except Exception as e:
+        session.rollback()
+        return {
+            "status": "error",
+            "message": f"Failed to move task: {str(e)}"
+        }
+
+
 async def delete_task(
     user_id: str,
     task_id: int,
@@ -230,6 +494,9 @@ async def delete_task(
             }
         
         task_title = task.title
+        compensation = get_compensation_log(session)
+        if compensation is not None:
+            compensation.record_deleted(task)
         session.delete(task)
         session.flush()
         
@@ -283,6 +550,13 @@ async def complete_task(
                 "message": f"Task {task_id} not found"
             }
         
+        compensation = get_compensation_log(session)
+        if compensation is not None:
+            compensation.record_updated(task, {
+                "completed": task.completed,
+                "updated_at": task.updated_at
+            })
+        
         task.completed = not task.completed
         from datetime import datetime
         task.updated_at = datetime.utcnow()
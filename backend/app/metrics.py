@@ -0,0 +1,84 @@
+"""In-process metrics registry (counters, gauges and timing summaries)."""
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict
+
+
+class Metrics:
+    """Thread-safe registry exposed at /metrics.
+
+    Values are per worker process; each worker reports its own numbers.
+    """
+
+    def __init__(self, max_samples: int = 2048):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=max_samples))
+        self._sample_totals: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set a gauge to an absolute value."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def adjust_gauge(self, name: str, delta: float) -> None:
+        """Move a gauge up or down."""
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + delta
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a sample (latency, size...) for percentile summaries."""
+        with self._lock:
+            self._samples[name].append(value)
+            totals = self._sample_totals[name]
+            totals[0] += 1
+            totals[1] += value
+
+    def counter(self, name: str) -> float:
+        """Current value of a counter."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def gauge(self, name: str) -> float:
+        """Current value of a gauge."""
+        with self._lock:
+            return self._gauges.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return all metrics as a JSON-serializable dict."""
+        with self._lock:
+            summaries = {}
+            for name, samples in self._samples.items():
+                ordered = sorted(samples)
+                count, total = self._sample_totals[name]
+                summaries[name] = {
+                    "count": count,
+                    "sum": round(total, 3),
+                    "p50": _percentile(ordered, 50),
+                    "p95": _percentile(ordered, 95),
+                    "p99": _percentile(ordered, 99),
+                    "max": ordered[-1] if ordered else None,
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries,
+            }
+
+
+def _percentile(ordered: list, pct: float):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index], 3)
+
+
+# Global metrics registry
+metrics = Metrics()
@@ -1,7 +1,8 @@
 """Database models for User and Task."""
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
 
 
 class User(SQLModel, table=True):
@@ -17,6 +18,15 @@ class User(SQLModel, table=True):
 class Task(SQLModel, table=True):
     """Task model for todo items."""
     
+    __table_args__ = (
+        # A user's pending tasks by due date ("what's due soon")
+        Index("ix_task_user_completed_due_at", "user_id", "completed", "due_at"),
+        # All pending tasks by due date (reminder scheduler window scans)
+        Index("ix_task_completed_due_at", "completed", "due_at"),
+        # A user's tasks in manual order (ordered pages are range scans)
+        Index("ix_task_user_rank", "user_id", "rank"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     title: str = Field(min_length=1, max_length=200)
@@ -24,6 +34,22 @@ class Task(SQLModel, table=True):
     completed: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    due_at: Optional[datetime] = None  # UTC
+    priority: int = Field(default=0, sa_column_kwargs={"server_default": "0"})  # 0 none, 1 low, 2 medium, 3 high
+    reminded_at: Optional[datetime] = None  # When the reminder for due_at fired; reset when due_at changes
+    # Manual order, ascending; assigned on insert (app.task_order)
+    rank: Optional[float] = Field(default=None, nullable=False, sa_column_kwargs={"server_default": "0"})
+
+
+class TaskStats(SQLModel, table=True):
+    """Per-user task counts, updated in the same transaction as task writes (app.task_stats)."""
+    
+    __tablename__ = "task_stats"
+    
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    pending: int = Field(default=0)
+    completed: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class Conversation(SQLModel, table=True):
@@ -41,7 +67,76 @@ class Message(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     conversation_id: int = Field(foreign_key="conversation.id", index=True)
     user_id: int = Field(foreign_key="user.id", index=True)
-    role: str = Field(max_length=20)  # "user" or "assistant"
+    role: str = Field(max_length=20)  # "user", "assistant" or "system" (summary of compacted turns)
+    content: str = Field(max_length=5000)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ArchivedMessage(SQLModel, table=True):
+    """A message moved out of the message table by compaction or retention."""
+    
+    __tablename__ = "message_archive"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    message_id: int = Field(unique=True)  # id in the message table; guards against double archiving
+    conversation_id: int = Field(index=True)  # No foreign keys: outlives the conversation
+    user_id: int = Field(index=True)
+    role: str = Field(max_length=20)
     content: str = Field(max_length=5000)
+    created_at: datetime
+    archived_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class AgentJob(SQLModel, table=True):
+    """Background agent run queued from the chat endpoint."""
+    
+    id: str = Field(primary_key=True, max_length=32)  # uuid4 hex
+    user_id: int = Field(foreign_key="user.id", index=True)
+    conversation_id: int = Field(foreign_key="conversation.id", index=True)
+    status: str = Field(default="queued", max_length=20, index=True)  # queued, running, succeeded, failed
+    message: str = Field(max_length=5000)
+    response: Optional[str] = Field(default=None, max_length=5000)
+    tool_calls: str = Field(default="[]")  # JSON-encoded list of tool names
+    error: Optional[str] = Field(default=None, max_length=1000)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """Outcome of a request sent with an Idempotency-Key header."""
+    
+    __table_args__ = (UniqueConstraint("user_id", "scope", "key"),)
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    scope: str = Field(max_length=50)  # e.g. "tasks.create", "chat"
+    key: str = Field(max_length=255)
+    request_hash: str = Field(max_length=64)  # sha256 of the request body
+    status: str = Field(default="in_progress", max_length=20)  # in_progress, completed
+    response_status: Optional[int] = None
+    response_body: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+
 
+class LLMUsage(SQLModel, table=True):
+    """LLM usage per user, UTC day and model, accumulated by app.usage."""
+    
+    __tablename__ = "llm_usage"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "model"),
+        Index("ix_llm_usage_day_user_id", "day", "user_id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    day: date
+    model: str = Field(max_length=100)
+    requests: int = Field(default=0)
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    cached_tokens: int = Field(default=0)  # Part of prompt_tokens served from the provider's prompt cache
+    latency_ms: float = Field(default=0)  # Sum over requests
+    cost_usd: float = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
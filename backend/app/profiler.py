@@ -0,0 +1,223 @@
+"""On-demand sampling profiler for a running worker.
+
+Sampler runs a thread that snapshots the Python stacks of all threads
+(sys._current_frames) every interval and counts identical stacks. The
+result is in the collapsed format ("thread;outer;...;inner count" per
+line) that flamegraph.pl, inferno and speedscope read. The sampler thread
+only exists while a profile runs, so an idle worker pays nothing. Apart
+from that, ProfilerMiddleware checks one attribute per request.
+
+Profiles come from the admin routes in two ways:
+
+* sample_for() samples the whole worker for a number of seconds, and
+* profile_next_request() arms a trigger. The next request whose path
+  starts with a prefix (and optionally has a given method) is sampled from
+  start to end. Other requests running at the same time show up in the
+  samples too.
+
+Only one profile runs at a time, and only in the worker that serves the
+admin request.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.config import settings
+from app.metrics import metrics
+
+# Leaf frames of threads that are waiting, not working; dropped unless asked for
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+
+class Profile(NamedTuple):
+    """A finished profile."""
+    collapsed: str
+    samples: int
+    duration: float
+    request: Optional[str] = None
+
+
+def _short_path(filename: str) -> str:
+    """Path relative to the sys.path entry it was imported from."""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+
+class Sampler:
+    """Counts the stacks of every thread, sampled every interval seconds."""
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.duration = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling (blocks up to one interval; call it off the event loop)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            # ";" separates frames in the collapsed format
+            label = f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_id:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                stack.append(f"thread:{names.get(ident, ident)}".replace(";", ":"))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def result(self, request: Optional[str] = None) -> Profile:
+        return Profile(self.collapsed(), self.samples, self.duration, request)
+
+
+class ProfilerBusy(Exception):
+    """Another profile is running in this worker."""
+
+
+class RequestTrigger:
+    """Profile the next request matching a path prefix (and method)."""
+
+    def __init__(self, path_prefix: str, method: Optional[str], interval: float, include_idle: bool):
+        self.path_prefix = path_prefix
+        self.method = method.upper() if method else None
+        self.interval = interval
+        self.include_idle = include_idle
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Set by the middleware once a request claimed the trigger
+        self.sampler: Optional[Sampler] = None
+        self.request: Optional[str] = None
+
+    def matches(self, scope: Scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["path"].startswith(self.path_prefix)
+            and not scope["path"].startswith("/api/admin")
+            and (self.method is None or scope["method"] == self.method)
+        )
+
+
+class Profiler:
+    """Runs at most one profile at a time."""
+
+    def __init__(self):
+        self.trigger: Optional[RequestTrigger] = None
+        self._busy = False
+
+    def _acquire(self) -> None:
+        if self._busy:
+            raise ProfilerBusy()
+        self._busy = True
+        metrics.increment("profiler.runs")
+
+    async def sample_for(self, seconds: float, interval: float, include_idle: bool = False) -> Profile:
+        """Sample every thread of this worker for the given time."""
+        self._acquire()
+        try:
+            sampler = Sampler(interval, include_idle)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return sampler.result()
+        finally:
+            self._busy = False
+
+    async def profile_next_request(self, path_prefix: str, method: Optional[str], timeout: float,
+                                   interval: float, include_idle: bool = False) -> Optional[Profile]:
+        """Sample the next matching request; None if none arrives within the timeout."""
+        self._acquire()
+        trigger = RequestTrigger(path_prefix, method, interval, include_idle)
+        self.trigger = trigger
+        try:
+            try:
+                return await asyncio.wait_for(asyncio.shield(trigger.result), timeout)
+            except asyncio.TimeoutError:
+                if self.trigger is trigger:
+                    return None
+            # The request started just in time; wait for it to finish, but not forever
+            try:
+                return await asyncio.wait_for(asyncio.shield(trigger.result), settings.PROFILER_MAX_SECONDS)
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(trigger.sampler.stop)
+                metrics.increment("profiler.truncated")
+                return trigger.sampler.result(f"{trigger.request} (unfinished)")
+        finally:
+            if self.trigger is trigger:
+                self.trigger = None
+            self._busy = False
+
+
+profiler = Profiler()
+
+
+class ProfilerMiddleware:
+    """Samples the request an armed RequestTrigger is waiting for."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        trigger = profiler.trigger
+        if trigger is None or not trigger.matches(scope):
+            await self.app(scope, receive, send)
+            return
+        # Claim it before the first await, so only this request is profiled
+        profiler.trigger = None
+        sampler = trigger.sampler = Sampler(trigger.interval, trigger.include_idle)
+        trigger.request = f"{scope['method']} {scope['path']}"
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+            if not trigger.result.done():
+                trigger.result.set_result(sampler.result(trigger.request))
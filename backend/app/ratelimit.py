@@ -0,0 +1,358 @@
+"""Per-user rate limiting and concurrency control."""
+import asyncio
+import logging
+import math
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+from fastapi import HTTPException, status
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller is over its rate or concurrency limit."""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class InMemoryRateLimitBackend:
+    """Token buckets kept in a dict on this worker.
+
+    A check is a dict lookup plus a little arithmetic with no awaits in
+    between, so it is safe on a single event loop without locking.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, last_refill_monotonic]
+        self._buckets: Dict[str, list] = {}
+
+    async def try_acquire(self, key: str) -> float:
+        """Take one token; return 0 if allowed, else seconds until one is free."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def _prune(self, now: float) -> None:
+        """Drop buckets that have refilled completely (idle callers)."""
+        full_after = self.burst / self.rate
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated >= full_after]
+        for key in idle:
+            del self._buckets[key]
+
+
+# Token bucket in Redis: refill, take one token and return the wait time
+_REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local retry = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  retry = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry)
+"""
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by all workers through Redis (one round trip per check)."""
+
+    def __init__(self, url: str, rate_per_second: float, burst: int, prefix: str = "ratelimit:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from e
+        self.rate = rate_per_second
+        self.burst = burst
+        self.prefix = prefix
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+
+    async def try_acquire(self, key: str) -> float:
+        """Take one token; return 0 if allowed, else seconds until one is free."""
+        retry = await self._script(keys=[self.prefix + key], args=[self.rate, self.burst])
+        return float(retry)
+
+
+class _UserSlots:
+    __slots__ = ("active", "waiters")
+
+    def __init__(self):
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class ConcurrencyLimiter:
+    """Cap concurrent operations per key, queueing overflow with a deadline.
+
+    Released slots are handed directly to the oldest waiter, so queued
+    requests are served in arrival order. Callers beyond the queue length
+    are rejected immediately.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float, name: str = "concurrency"):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self._slots: Dict[str, _UserSlots] = {}
+
+    def active(self, key: str) -> int:
+        """Number of slots currently held for key."""
+        slots = self._slots.get(key)
+        return slots.active if slots else 0
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        """Hold one slot for key for the duration of the block."""
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    async def acquire(self, key: str) -> None:
+        """Take a slot, waiting up to queue_timeout; raise RateLimitExceeded otherwise."""
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = _UserSlots()
+
+        if slots.active < self.max_concurrent and not slots.waiters:
+            slots.active += 1
+            metrics.adjust_gauge(f"{self.name}.active", 1)
+            return
+
+        if len(slots.waiters) >= self.max_queued:
+            metrics.increment(f"{self.name}.rejected")
+            raise RateLimitExceeded(self.queue_timeout, "Too many concurrent requests")
+
+        waiter = asyncio.get_running_loop().create_future()
+        slots.waiters.append(waiter)
+        metrics.increment(f"{self.name}.queued")
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(key, slots, waiter)
+            raise
+        if not waiter.done():
+            self._abandon(key, slots, waiter)
+            metrics.increment(f"{self.name}.timeouts")
+            raise RateLimitExceeded(self.queue_timeout, "Timed out waiting for a free slot")
+
+    def _abandon(self, key: str, slots: _UserSlots, waiter: asyncio.Future) -> None:
+        """Leave the queue; pass the slot on if it was handed over meanwhile."""
+        if waiter.done() and not waiter.cancelled():
+            self.release(key)
+            return
+        waiter.cancel()
+        try:
+            slots.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, key: str) -> None:
+        """Give a slot back, handing it to the oldest live waiter if any."""
+        slots = self._slots[key]
+        while slots.waiters:
+            waiter = slots.waiters.popleft()
+            if not waiter.done():
+                # Hand the slot over without changing the active count
+                waiter.set_result(None)
+                return
+        slots.active -= 1
+        metrics.adjust_gauge(f"{self.name}.active", -1)
+        if slots.active == 0:
+            del self._slots[key]
+
+
+# Concurrency slots in Redis: a sorted set of lease ids scored by expiry time.
+# Drop expired leases, then add this one if fewer than the maximum remain.
+_REDIS_TAKE_SLOT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local lease_seconds = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + lease_seconds, ARGV[2])
+redis.call('EXPIRE', KEYS[1], math.ceil(lease_seconds) + 1)
+return 1
+"""
+
+
+class RedisConcurrencyLimiter:
+    """Cap concurrent operations per key across all workers through Redis.
+
+    Each held slot is a lease in a sorted set, so a slot left by a crashed
+    worker frees itself after lease_seconds. Callers over the cap poll for a
+    free slot until queue_timeout; max_queued limits the waiters per worker,
+    and waiters are not served in strict arrival order.
+    """
+
+    def __init__(self, url: str, max_concurrent: int, max_queued: int, queue_timeout: float,
+                 name: str = "concurrency", lease_seconds: float = 600, poll_interval: float = 0.1,
+                 prefix: str = "concurrency:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from e
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(_REDIS_TAKE_SLOT)
+        self._waiting: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        """Hold one slot for key for the duration of the block."""
+        lease = await self.acquire(key)
+        try:
+            yield
+        finally:
+            await self.release(key, lease)
+
+    async def _take(self, key: str, lease: str) -> bool:
+        taken = await self._script(keys=[self.prefix + key], args=[self.max_concurrent, lease, self.lease_seconds])
+        return bool(int(taken))
+
+    async def acquire(self, key: str) -> str:
+        """Take a slot, waiting up to queue_timeout; returns its lease id or raises RateLimitExceeded."""
+        lease = secrets.token_hex(8)
+        if await self._take(key, lease):
+            metrics.adjust_gauge(f"{self.name}.active", 1)
+            return lease
+
+        if self._waiting.get(key, 0) >= self.max_queued:
+            metrics.increment(f"{self.name}.rejected")
+            raise RateLimitExceeded(self.queue_timeout, "Too many concurrent requests")
+
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        metrics.increment(f"{self.name}.queued")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        try:
+            while loop.time() < deadline:
+                await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - loop.time())))
+                if await self._take(key, lease):
+                    metrics.adjust_gauge(f"{self.name}.active", 1)
+                    return lease
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+        metrics.increment(f"{self.name}.timeouts")
+        raise RateLimitExceeded(self.queue_timeout, "Timed out waiting for a free slot")
+
+    async def release(self, key: str, lease: str) -> None:
+        """Give a slot back (it expires on its own if Redis cannot be reached)."""
+        metrics.adjust_gauge(f"{self.name}.active", -1)
+        try:
+            await self._client.zrem(self.prefix + key, lease)
+        except Exception as e:
+            logger.warning(f"Could not release concurrency slot for {key}: {e}")
+
+
+def _build_rate_backend():
+    """Create the chat rate limit backend from settings (None disables it)."""
+    if settings.CHAT_RATE_LIMIT_PER_MINUTE <= 0:
+        return None
+    rate = settings.CHAT_RATE_LIMIT_PER_MINUTE / 60
+    burst = max(1, settings.CHAT_RATE_LIMIT_BURST)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("REDIS_URL is required when RATE_LIMIT_BACKEND=redis")
+        return RedisRateLimitBackend(settings.REDIS_URL, rate, burst)
+    return InMemoryRateLimitBackend(rate, burst)
+
+
+def _build_concurrency_limiter():
+    """Create the per-user agent-run limiter from settings (None disables it)."""
+    if settings.CHAT_MAX_CONCURRENT_PER_USER <= 0:
+        return None
+    limits = dict(
+        max_concurrent=settings.CHAT_MAX_CONCURRENT_PER_USER,
+        max_queued=settings.CHAT_MAX_QUEUED_PER_USER,
+        queue_timeout=settings.CHAT_QUEUE_TIMEOUT_SECONDS,
+        name="chat.concurrency",
+    )
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("REDIS_URL is required when RATE_LIMIT_BACKEND=redis")
+        return RedisConcurrencyLimiter(settings.REDIS_URL, **limits)
+    if int(os.getenv("WEB_CONCURRENCY") or "1") > 1:
+        # Each worker would allow the cap on its own, multiplying it
+        raise ValueError("CHAT_MAX_CONCURRENT_PER_USER with more than one worker requires RATE_LIMIT_BACKEND=redis")
+    return ConcurrencyLimiter(**limits)
+
+
+chat_rate_limiter = _build_rate_backend()
+chat_concurrency = _build_concurrency_limiter()
+
+
+def too_many_requests(exc: RateLimitExceeded) -> HTTPException:
+    """Translate a limiter rejection into a 429 response."""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=exc.reason,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+async def check_chat_rate_limit(user_id: int) -> None:
+    """Consume one chat token for the user or raise a 429."""
+    if chat_rate_limiter is None:
+        return
+    retry_after = await chat_rate_limiter.try_acquire(f"chat:{user_id}")
+    if retry_after > 0:
+        metrics.increment("chat.rate_limit.rejected")
+        raise too_many_requests(RateLimitExceeded(retry_after, "Rate limit exceeded"))
+
+
+@asynccontextmanager
+async def chat_slot(user_id: int):
+    """Hold one of the user's concurrent agent-run slots (429 on overflow)."""
+    if chat_concurrency is None:
+        yield
+        return
+    try:
+        async with chat_concurrency.slot(str(user_id)):
+            yield
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
@@ -0,0 +1,209 @@
+"""Due-date reminders for tasks.
+
+ReminderScheduler keeps a min-heap of the pending tasks due within the next
+REMINDER_HORIZON_SECONDS and sleeps until the earliest one. The heap is
+refilled by one range scan on the (completed, due_at) index per horizon,
+not by polling, and kept current between scans by committed task changes
+(app.task_events). Stale heap entries (task completed, deleted or
+rescheduled) are skipped when they surface.
+
+Before firing, a reminder is claimed by setting ``reminded_at`` on the
+task, only if it is still pending, not yet reminded and due. Each worker
+runs its own scheduler, so this claim makes every reminder fire once, and
+tasks rescheduled by another worker never fire at their old time.
+
+Firing calls the callbacks registered with subscribe(); by default
+reminders are only logged and counted. Delivery (email, push) plugs in there.
+"""
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import update
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import Task
+from app.task_events import TaskChange, subscribe as subscribe_task_changes
+
+logger = logging.getLogger(__name__)
+
+
+class Reminder(NamedTuple):
+    """A task that has come due."""
+    task_id: int
+    user_id: int
+    title: str
+    due_at: datetime
+
+
+_subscribers: List[Callable[[List[Reminder]], None]] = []
+
+
+def subscribe(callback: Callable[[List[Reminder]], None]):
+    """Register a callback for fired reminders (usable as a decorator)."""
+    _subscribers.append(callback)
+    return callback
+
+
+def normalize_due_at(value: Optional[datetime]) -> Optional[datetime]:
+    """Due dates are stored as naive UTC; convert timezone-aware values."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_due_at(value: str) -> datetime:
+    """Parse an ISO 8601 date or datetime (UTC unless an offset is given)."""
+    return normalize_due_at(datetime.fromisoformat(value.strip().replace("Z", "+00:00")))
+
+
+class ReminderScheduler:
+    """Fires reminders for tasks as they come due."""
+
+    def __init__(self, horizon_seconds: float):
+        self.horizon = timedelta(seconds=horizon_seconds)
+        self._heap: List[Tuple[datetime, int]] = []
+        self._due: Dict[int, datetime] = {}  # task id -> due_at of its live heap entry
+        self._window_end: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._due)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="reminders")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def apply(self, changes: List[TaskChange]) -> None:
+        """Track committed task changes that fall inside the current window."""
+        if self._window_end is None:
+            return
+        wake = False
+        # Same bounds as refill: tasks overdue by more than the horizon are not reminded
+        oldest = datetime.utcnow() - self.horizon
+        with self._lock:
+            for change in changes:
+                if change.kind == "deleted" or change.completed or change.due_at is None:
+                    self._due.pop(change.task_id, None)  # Its heap entry is skipped later
+                elif oldest <= change.due_at <= self._window_end:
+                    wake = wake or not self._heap or change.due_at < self._heap[0][0]
+                    self._push(change.due_at, change.task_id)
+                else:
+                    self._due.pop(change.task_id, None)
+        if wake and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _push(self, due_at: datetime, task_id: int) -> None:
+        self._due[task_id] = due_at
+        heapq.heappush(self._heap, (due_at, task_id))
+
+    def refill(self, now: datetime) -> None:
+        """Load tasks due before the end of the next window (and recently missed ones)."""
+        window_end = now + self.horizon
+        with Session(engine) as session:
+            rows = session.exec(
+                select(Task.id, Task.due_at).where(
+                    Task.completed == False,
+                    Task.due_at >= now - self.horizon,
+                    Task.due_at <= window_end,
+                    Task.reminded_at == None
+                )
+            ).all()
+        with self._lock:
+            self._window_end = window_end
+            for task_id, due_at in rows:
+                if self._due.get(task_id) != due_at:
+                    self._push(due_at, task_id)
+        metrics.set_gauge("reminders.scheduled", len(self._due))
+
+    def pop_due(self, now: datetime) -> List[int]:
+        """Remove and return the ids of tasks due by now."""
+        task_ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, task_id = heapq.heappop(self._heap)
+                if self._due.get(task_id) == due_at:
+                    del self._due[task_id]
+                    task_ids.append(task_id)
+        return task_ids
+
+    def claim(self, task_ids: List[int], now: datetime) -> List[Reminder]:
+        """Mark the tasks reminded; returns those this worker won and that are still due."""
+        with Session(engine) as session:
+            rows = session.execute(
+                update(Task)
+                .where(
+                    Task.id.in_(task_ids),
+                    Task.completed == False,
+                    Task.reminded_at == None,
+                    Task.due_at <= now
+                )
+                .values(reminded_at=now)
+                .returning(Task.id, Task.user_id, Task.title, Task.due_at)
+            ).all()
+            session.commit()
+        return [Reminder(*row) for row in rows]
+
+    def fire(self, reminders: List[Reminder], now: datetime) -> None:
+        for reminder in reminders:
+            metrics.observe("reminders.delay_ms", (now - reminder.due_at).total_seconds() * 1000)
+        metrics.increment("reminders.fired", len(reminders))
+        for callback in _subscribers:
+            try:
+                callback(reminders)
+            except Exception as e:
+                logger.warning(f"Reminder subscriber {callback!r} failed: {e}")
+
+    def _seconds_until_next(self, now: datetime) -> float:
+        with self._lock:
+            next_at = min(self._heap[0][0], self._window_end) if self._heap else self._window_end
+        return max(0.0, (next_at - now).total_seconds())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                now = datetime.utcnow()
+                if self._window_end is None or now >= self._window_end:
+                    await asyncio.to_thread(self.refill, now)
+                task_ids = self.pop_due(now)
+                if task_ids:
+                    reminders = await asyncio.to_thread(self.claim, task_ids, now)
+                    if reminders:
+                        self.fire(reminders, now)
+                timeout = self._seconds_until_next(datetime.utcnow())
+            except Exception as e:
+                metrics.increment("reminders.errors")
+                logger.warning(f"Reminder scheduler error: {e}")
+                timeout = 5.0
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+@subscribe
+def _log_reminders(reminders: List[Reminder]) -> None:
+    for reminder in reminders:
+        logger.info(f"Task {reminder.task_id} of user {reminder.user_id} is due: {reminder.title}")
+
+
+reminder_scheduler = ReminderScheduler(horizon_seconds=settings.REMINDER_HORIZON_SECONDS)
+subscribe_task_changes(reminder_scheduler.apply)
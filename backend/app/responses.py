@@ -0,0 +1,43 @@
+"""Custom response classes."""
+import json
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """Encode values the standard json module does not handle."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson when it is installed.
+
+    Routes return plain dicts/lists built from row tuples together with this
+    class, which skips FastAPI's response_model validation and the
+    jsonable_encoder pass. Datetimes are rendered in the same ISO 8601 form
+    that the default encoder produces.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode content as compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=_default,
+    ).encode("utf-8")
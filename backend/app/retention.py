@@ -0,0 +1,276 @@
+"""Chat message retention: compaction, archiving and conversation deletion.
+
+Every chat turn adds two message rows, so without retention the table (and
+its indexes) grows forever. A background job, enabled per deployment:
+
+* compacts conversations: messages older than MESSAGE_COMPACT_AFTER_DAYS,
+  beyond the MESSAGE_COMPACT_KEEP_RECENT newest, are replaced by a single
+  ``system`` summary message listing what the user asked for,
+* deletes conversations idle for CONVERSATION_RETENTION_DAYS, and
+* purges the archive after MESSAGE_ARCHIVE_RETENTION_DAYS.
+
+With MESSAGE_ARCHIVE_ENABLED, compacted and expired messages are copied to
+message_archive before they are deleted. All deletes run in transactions of
+at most RETENTION_BATCH_SIZE rows. Compaction bumps the conversation's
+``updated_at`` so every worker's history cache reloads it.
+
+Several workers may run the job at once: compaction locks the conversation
+row, and the archive's unique message_id rejects a second copy.
+
+Run a single pass from cron or a shell with:
+
+    python -m app.retention
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import delete, func, insert, literal
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine, replicas
+from app.history_cache import history_cache
+from app.metrics import metrics
+from app.models import AgentJob, ArchivedMessage, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ROLE = "system"
+SUMMARY_HEADER = "Earlier messages in this conversation were compacted. Requests the user made before:"
+SUMMARY_MAX_CHARS = 2000
+SUMMARY_LINE_MAX_CHARS = 150
+
+
+def summarize(previous: Optional[str], messages: List[Message]) -> str:
+    """Fold the user's messages into the running summary, dropping the oldest lines to fit."""
+    lines = previous.splitlines()[1:] if previous else []
+    for message in messages:
+        if message.role == "user":
+            text = " ".join(message.content.split())
+            if len(text) > SUMMARY_LINE_MAX_CHARS:
+                text = text[:SUMMARY_LINE_MAX_CHARS - 3] + "..."
+            lines.append(f"- {text}")
+    while lines and len(SUMMARY_HEADER) + sum(len(line) + 1 for line in lines) > SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    return "\n".join([SUMMARY_HEADER] + lines)
+
+
+def _move_messages(session: Session, message_ids: List[int], archive: bool) -> None:
+    """Delete messages, copying them to the archive first if asked to."""
+    if archive:
+        session.execute(insert(ArchivedMessage).from_select(
+            ["message_id", "conversation_id", "user_id", "role", "content", "created_at", "archived_at"],
+            select(
+                Message.id, Message.conversation_id, Message.user_id, Message.role,
+                Message.content, Message.created_at, literal(datetime.utcnow())
+            ).where(Message.id.in_(message_ids))
+        ))
+        metrics.increment("retention.messages_archived", len(message_ids))
+    session.execute(delete(Message).where(Message.id.in_(message_ids)))
+
+
+def compact_conversation(conversation_id: int, cutoff: datetime, keep_recent: int,
+                         batch_size: int, archive: bool) -> int:
+    """Summarize and remove a conversation's old messages; returns how many were removed."""
+    removed = 0
+    while True:
+        with Session(engine) as session:
+            # Serializes compaction of this conversation across workers
+            conversation = session.exec(
+                select(Conversation).where(Conversation.id == conversation_id).with_for_update()
+            ).first()
+            if conversation is None:
+                return removed
+            recent = session.exec(
+                select(Message.id)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(keep_recent)
+            ).all()
+            old = session.exec(
+                select(Message)
+                .where(
+                    Message.conversation_id == conversation_id,
+                    Message.role != SUMMARY_ROLE,
+                    Message.created_at < cutoff,
+                    Message.id.not_in(recent)
+                )
+                .order_by(Message.created_at, Message.id)
+                .limit(batch_size)
+            ).all()
+            if not old:
+                return removed
+
+            summary = session.exec(
+                select(Message).where(Message.conversation_id == conversation_id, Message.role == SUMMARY_ROLE)
+            ).first()
+            content = summarize(summary.content if summary else None, old)
+            if summary is None:
+                summary = Message(conversation_id=conversation_id, user_id=conversation.user_id, role=SUMMARY_ROLE)
+            # Dated with the last message it covers, so it sorts before the kept ones
+            summary.content = content
+            summary.created_at = old[-1].created_at
+            session.add(summary)
+            session.flush()
+            _move_messages(session, [message.id for message in old], archive)
+            # A new history version, without restarting the idle clock for retention
+            conversation.updated_at += timedelta(microseconds=1)
+            session.add(conversation)
+            try:
+                session.commit()
+            except IntegrityError:
+                return removed  # Another worker archived these first
+        removed += len(old)
+        history_cache.invalidate(conversation_id)
+        metrics.increment("retention.messages_compacted", len(old))
+
+
+def delete_conversation(conversation_id: int, batch_size: int, archive: bool = False) -> bool:
+    """Delete a conversation with its messages and jobs, in bounded batches.
+
+    Returns False if it did not exist.
+    """
+    with Session(engine) as session:
+        user_id = session.exec(select(Conversation.user_id).where(Conversation.id == conversation_id)).first()
+    if user_id is None:
+        return False
+
+    while True:
+        with Session(engine) as session:
+            ids = session.exec(
+                select(Message.id).where(Message.conversation_id == conversation_id).limit(batch_size)
+            ).all()
+            if len(ids) < batch_size:
+                break  # The rest go with the conversation below
+            _move_messages(session, list(ids), archive)
+            session.commit()
+
+    with Session(engine) as session:
+        if ids:
+            _move_messages(session, list(ids), archive)
+        # Catches messages written while the batches ran
+        session.execute(delete(Message).where(Message.conversation_id == conversation_id))
+        session.execute(delete(AgentJob).where(AgentJob.conversation_id == conversation_id))
+        session.execute(delete(Conversation).where(Conversation.id == conversation_id))
+        session.commit()
+
+    history_cache.invalidate(conversation_id)
+    # Keep this user's reads off replicas that may still have the conversation
+    replicas.note_write(user_id)
+    metrics.increment("retention.conversations_deleted")
+    return True
+
+
+def compact_all(now: datetime) -> int:
+    if settings.MESSAGE_COMPACT_AFTER_DAYS <= 0:
+        return 0
+    cutoff = now - timedelta(days=settings.MESSAGE_COMPACT_AFTER_DAYS)
+    keep_recent = settings.MESSAGE_COMPACT_KEEP_RECENT
+    with Session(engine) as session:
+        conversation_ids = session.exec(
+            select(Message.conversation_id)
+            .where(Message.role != SUMMARY_ROLE)
+            .group_by(Message.conversation_id)
+            .having(func.count() > keep_recent, func.min(Message.created_at) < cutoff)
+        ).all()
+    return sum(
+        compact_conversation(conversation_id, cutoff, keep_recent,
+                             settings.RETENTION_BATCH_SIZE, settings.MESSAGE_ARCHIVE_ENABLED)
+        for conversation_id in conversation_ids
+    )
+
+
+def expire_conversations(now: datetime) -> int:
+    if settings.CONVERSATION_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = now - timedelta(days=settings.CONVERSATION_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        with Session(engine) as session:
+            conversation_ids = session.exec(
+                select(Conversation.id).where(Conversation.updated_at < cutoff).limit(settings.RETENTION_BATCH_SIZE)
+            ).all()
+        for conversation_id in conversation_ids:
+            deleted += delete_conversation(
+                conversation_id, settings.RETENTION_BATCH_SIZE, archive=settings.MESSAGE_ARCHIVE_ENABLED
+            )
+        if len(conversation_ids) < settings.RETENTION_BATCH_SIZE:
+            return deleted
+
+
+def purge_archive(now: datetime) -> int:
+    if settings.MESSAGE_ARCHIVE_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = now - timedelta(days=settings.MESSAGE_ARCHIVE_RETENTION_DAYS)
+    purged = 0
+    while True:
+        with Session(engine) as session:
+            ids = session.exec(
+                select(ArchivedMessage.id).where(ArchivedMessage.archived_at < cutoff).limit(settings.RETENTION_BATCH_SIZE)
+            ).all()
+            if ids:
+                session.execute(delete(ArchivedMessage).where(ArchivedMessage.id.in_(ids)))
+                session.commit()
+        purged += len(ids)
+        if len(ids) < settings.RETENTION_BATCH_SIZE:
+            metrics.increment("retention.archive_purged", purged)
+            return purged
+
+
+def retention_enabled() -> bool:
+    return any(days > 0 for days in (
+        settings.MESSAGE_COMPACT_AFTER_DAYS,
+        settings.CONVERSATION_RETENTION_DAYS,
+        settings.MESSAGE_ARCHIVE_RETENTION_DAYS,
+    ))
+
+
+def run_retention() -> Dict[str, int]:
+    """One pass of every enabled retention step."""
+    now = datetime.utcnow()
+    stats = {
+        "messages_compacted": compact_all(now),
+        "conversations_deleted": expire_conversations(now),
+        "archive_purged": purge_archive(now),
+    }
+    metrics.increment("retention.runs")
+    return stats
+
+
+class RetentionJob:
+    """Runs run_retention() every RETENTION_INTERVAL_SECONDS in the background."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="retention")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                stats = await asyncio.to_thread(run_retention)
+                if any(stats.values()):
+                    logger.info(f"Retention pass: {stats}")
+            except Exception as e:
+                metrics.increment("retention.errors")
+                logger.warning(f"Retention pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+retention_job = RetentionJob(interval=settings.RETENTION_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(run_retention())
@@ -0,0 +1,137 @@
+"""Admin routes (restricted to ADMIN_USER_IDS)."""
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from sqlmodel import Session, select
+from typing import List, Optional
+from pydantic import BaseModel
+from app.config import settings
+from app.database import get_session
+from app.models import User
+from app.profiler import Profile, ProfilerBusy, profiler
+from app.routes.tasks import get_current_user_id
+from app.usage import top_consumers, usage_recorder
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+class UsageSummary(BaseModel):
+    """A user's LLM usage over a period."""
+    user_id: int
+    email: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    total_tokens: int
+    cost_usd: float
+    avg_latency_ms: float
+
+
+def admin_user_ids() -> set:
+    return {int(user_id) for user_id in settings.ADMIN_USER_IDS.split(",") if user_id.strip()}
+
+
+def require_admin(token_user_id: int = Depends(get_current_user_id)) -> int:
+    """Allow only users listed in ADMIN_USER_IDS."""
+    if token_user_id not in admin_user_ids():
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return token_user_id
+
+
+@router.get("/usage/top", response_model=List[UsageSummary])
+async def top_usage(
+    days: int = Query(1, ge=1, le=366, description="Number of UTC days to include, ending today"),
+    limit: int = Query(20, ge=1, le=500),
+    order: str = Query("tokens", pattern="^(tokens|cost)$", description="Rank by total tokens or cost"),
+    session: Session = Depends(get_session),
+    admin_id: int = Depends(require_admin)
+):
+    """Users with the highest LLM usage.
+    
+    Includes this worker's unflushed usage; other workers' shows up after
+    their next flush.
+    """
+    await run_in_threadpool(usage_recorder.flush)
+    
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = await run_in_threadpool(top_consumers, session, since, limit, order)
+    user_ids = [row["user_id"] for row in rows]
+    emails = dict(session.exec(select(User.id, User.email).where(User.id.in_(user_ids))).all()) if user_ids else {}
+    return [UsageSummary(email=emails.get(row["user_id"], ""), **row) for row in rows]
+
+
+def _profile_response(profile: Profile) -> PlainTextResponse:
+    headers = {
+        "X-Profile-Samples": str(profile.samples),
+        "X-Profile-Duration": f"{profile.duration:.3f}",
+    }
+    if profile.request:
+        headers["X-Profile-Request"] = profile.request
+    return PlainTextResponse(profile.collapsed, headers=headers)
+
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A profile is already running in this worker"
+    )
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(10.0, gt=0, description="How long to sample"),
+    interval_ms: float = Query(5.0, ge=1, le=1000, description="Time between samples"),
+    include_idle: bool = Query(False, description="Keep samples of threads waiting for work"),
+    admin_id: int = Depends(require_admin)
+):
+    """Sample every thread of the worker serving this request.
+    
+    Returns collapsed stacks ("frame;frame;... count" per line) for
+    flamegraph.pl, inferno or speedscope.
+    """
+    if seconds > settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds may be at most {settings.PROFILER_MAX_SECONDS:g}"
+        )
+    try:
+        profile = await profiler.sample_for(seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusy:
+        raise _busy()
+    return _profile_response(profile)
+
+
+@router.post("/profile/next", response_class=PlainTextResponse)
+async def profile_next_request(
+    path: str = Query(..., min_length=1, description="Profile the next request whose path starts with this"),
+    method: Optional[str] = Query(None, description="Only match this HTTP method"),
+    timeout: float = Query(30.0, gt=0, description="How long to wait for a matching request"),
+    interval_ms: float = Query(1.0, ge=0.5, le=1000, description="Time between samples"),
+    include_idle: bool = Query(False, description="Keep samples of threads waiting for work"),
+    admin_id: int = Depends(require_admin)
+):
+    """Profile the next matching request this worker serves, from start to end.
+    
+    Requests to /api/admin never match. Other requests in flight at the
+    same time appear in the samples too.
+    """
+    if timeout > settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"timeout may be at most {settings.PROFILER_MAX_SECONDS:g}"
+        )
+    try:
+        profile = await profiler.profile_next_request(path, method, timeout, interval_ms / 1000, include_idle)
+    except ProfilerBusy:
+        raise _busy()
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No request matching {path} arrived within {timeout:g}s"
+        )
+    return _profile_response(profile)
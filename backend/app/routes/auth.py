@@ -2,8 +2,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
 from pydantic import BaseModel, EmailStr
-from app.database import get_session
-from app.models import User
+from app.database import get_session, read_session, replicas
+from app.models import TaskStats, User
 from app.auth import verify_password, get_password_hash, create_access_token
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
@@ -51,6 +51,9 @@ async def signup(request: SignupRequest, session: Session = Depends(get_session)
     )
     
     session.add(new_user)
+    session.flush()
+    # Counters start at zero and are kept current by task writes
+    session.add(TaskStats(user_id=new_user.id))
     session.commit()
     session.refresh(new_user)
     
@@ -70,9 +73,13 @@ async def signup(request: SignupRequest, session: Session = Depends(get_session)
 @router.post("/login", response_model=AuthResponse)
 async def login(request: LoginRequest, session: Session = Depends(get_session)):
     """Login and get access token."""
-    # Find user by email
+    # Find user by email, on a replica when configured; a user who just
+    # signed up may not have reached it yet, so retry a miss on the primary
     statement = select(User).where(User.email == request.email)
-    user = session.exec(statement).first()
+    with read_session() as replica_session:
+        user = replica_session.exec(statement).first()
+    if user is None and replicas.enabled:
+        user = session.exec(statement).first()
     
     if not user or not verify_password(request.password, user.hashed_password):
         raise HTTPException(
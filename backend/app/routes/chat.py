@@ -1,12 +1,28 @@
 """Chat routes for AI chatbot."""
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+import json
+import math
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
 from typing import Optional
-from pydantic import BaseModel
-from app.database import get_session
-from app.models import Conversation, Message, User
+from pydantic import BaseModel, Field
+from app.config import settings
+from app.database import engine, read_session, replicas
+from app.models import AgentJob, Conversation
 from app.auth import decode_token
-from app.agents.todo_agent import run_agent
+from app.agents.todo_agent import load_agent_context, run_agent
+from app import tracing
+from app.conversations import add_turn, get_or_create_conversation
+from app.history_cache import history_cache
+from app.idempotency import IDEMPOTENCY_HEADER, ClaimedKey, StoredResponse, claim_key, request_fingerprint
+from app.jobs import create_job, enqueue_job, wait_for_job
+from app.llm import LLMUnavailableError
+from app.mcp.compensation import CompensationLog
+from app.ratelimit import RateLimitExceeded, check_chat_rate_limit, chat_slot, too_many_requests
+from app.retention import delete_conversation
+from app.transcripts import MAX_CONTENT_LENGTH, transcript_writer
+from app.usage import check_budget
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
@@ -14,7 +30,10 @@ router = APIRouter(prefix="/api", tags=["chat"])
 class ChatRequest(BaseModel):
     """Chat request model."""
     conversation_id: Optional[int] = None
-    message: str
+    # Stored as is in the message and job tables
+    message: str = Field(max_length=MAX_CONTENT_LENGTH)
+    # Run as a background job and return a job id (defaults to CHAT_BACKGROUND_JOBS)
+    background: Optional[bool] = None
 
 
 class ChatResponse(BaseModel):
@@ -24,6 +43,28 @@ class ChatResponse(BaseModel):
     tool_calls: list[str] = []
 
 
+class ChatJobResponse(BaseModel):
+    """Background chat job status model."""
+    job_id: str
+    conversation_id: int
+    status: str
+    response: Optional[str] = None
+    tool_calls: list[str] = []
+    error: Optional[str] = None
+
+
+def job_response(job: AgentJob) -> ChatJobResponse:
+    """Build the API representation of a job."""
+    return ChatJobResponse(
+        job_id=job.id,
+        conversation_id=job.conversation_id,
+        status=job.status,
+        response=job.response,
+        tool_calls=json.loads(job.tool_calls or "[]"),
+        error=job.error
+    )
+
+
 def get_current_user_id(authorization: Optional[str] = Header(None)) -> int:
     """Extract user_id from JWT token."""
     if not authorization:
@@ -66,92 +107,210 @@ def verify_user_access(user_id: int, token_user_id: int):
         )
 
 
-@router.post("/{user_id}/chat", response_model=ChatResponse)
+@router.post(
+    "/{user_id}/chat",
+    response_model=ChatResponse,
+    responses={status.HTTP_202_ACCEPTED: {"model": ChatJobResponse}}
+)
 async def chat(
     user_id: int,
     request: ChatRequest,
-    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     token_user_id: int = Depends(get_current_user_id)
 ):
-    """Chat endpoint for AI assistant."""
+    """Chat endpoint for AI assistant.
+    
+    A retry sent with the same Idempotency-Key gets the stored response, or
+    waits for the original turn if it is still running, instead of running
+    the agent again.
+    """
     verify_user_access(user_id, token_user_id)
     
-    # Get or create conversation
-    if request.conversation_id:
-        statement = select(Conversation).where(
-            Conversation.id == request.conversation_id,
-            Conversation.user_id == user_id
-        )
-        conversation = session.exec(statement).first()
-        
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
-    else:
-        # Create new conversation
-        conversation = Conversation(user_id=user_id)
-        session.add(conversation)
-        session.commit()
-        session.refresh(conversation)
-    
-    # Load conversation history from database (before adding new message)
-    statement = select(Message).where(
-        Message.conversation_id == conversation.id
-    ).order_by(Message.created_at)
-    messages = session.exec(statement).all()
-    
-    # Convert to OpenAI format
-    conversation_history = [
-        {"role": msg.role, "content": msg.content}
-        for msg in messages
-    ]
-    
-    # Call agent (this will use tools that modify the database)
+    if not idempotency_key:
+        return await _chat_turn(user_id, request, None)
+    
+    claimed = await claim_key(user_id, "chat", idempotency_key, request_fingerprint(request))
+    if isinstance(claimed, StoredResponse):
+        return claimed.to_response()
     try:
-        assistant_response, tool_calls = await run_agent(
-            user_id=str(user_id),
-            user_message=request.message,
-            conversation_history=conversation_history,
-            session=session
-        )
-    except Exception as e:
-        session.rollback()
+        response = await _chat_turn(user_id, request, claimed)
+    except BaseException:
+        await claimed.release()
+        raise
+    claimed.done()
+    return response
+
+
+def _load_turn_context(session: Session, user_id: int, conversation_id: Optional[int]):
+    """Get or create the conversation and load what the agent needs from it."""
+    conversation = get_or_create_conversation(session, user_id, conversation_id)
+    history, task_context, history_version = load_agent_context(
+        session, conversation.id, user_id, version=conversation.updated_at
+    )
+    return conversation.id, history, task_context, history_version
+
+
+async def _chat_turn(user_id: int, request: ChatRequest, claimed: Optional[ClaimedKey]):
+    """Run one chat turn (or queue it as a job).
+    
+    The turn runs as short units of work so no pooled connection is held
+    while waiting on the LLM: load history, release the connection, run the
+    agent (tools get a connection per batch and commit it), then persist
+    the transcript. If the turn fails after tools committed, their writes
+    are undone from the compensation log. With an idempotency key, the
+    response is stored in the same transaction as the job or transcript.
+    """
+    # Fast 429 for callers over their rate, then cap concurrent agent runs
+    await check_chat_rate_limit(user_id)
+    # Refuse before spending more tokens once today's budget is used up
+    await check_budget(user_id)
+    
+    background = request.background if request.background is not None else settings.CHAT_BACKGROUND_JOBS
+    if background:
+        # Queue the agent run and return immediately; clients poll the job.
+        # Queued and running jobs count against the concurrent agent-run cap.
+        with Session(engine) as session:
+            conversation = get_or_create_conversation(session, user_id, request.conversation_id)
+            try:
+                job = create_job(
+                    session, user_id, conversation.id, request.message,
+                    max_active=settings.CHAT_MAX_CONCURRENT_PER_USER
+                )
+            except RateLimitExceeded as e:
+                raise too_many_requests(e)
+            body = job_response(job).model_dump()
+            if claimed is not None:
+                claimed.store(session, status.HTTP_202_ACCEPTED, body)
+                session.commit()
+        enqueue_job(job.id)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=body)
+    
+    async with chat_slot(user_id):
+        with tracing.span("chat", **{"user.id": user_id}) as chat_span:
+            # Get or create conversation and load its history (before adding
+            # the new message); the connection is released on exit
+            with tracing.span("chat.load_history") as history_span:
+                # Existing conversations are read from a replica when configured;
+                # one created moments ago may not be there yet, so retry a miss
+                # on the primary
+                try:
+                    with read_session(user_id) if request.conversation_id else Session(engine) as session:
+                        conversation_id, conversation_history, task_context, history_version = \
+                            _load_turn_context(session, user_id, request.conversation_id)
+                except HTTPException as e:
+                    if e.status_code != status.HTTP_404_NOT_FOUND or not replicas.enabled:
+                        raise
+                    with Session(engine) as session:
+                        conversation_id, conversation_history, task_context, history_version = \
+                            _load_turn_context(session, user_id, request.conversation_id)
+                history_span.set_attribute("db.row_count", len(conversation_history))
+                history_span.set_attribute("agent.task_context", task_context is not None)
+            chat_span.set_attribute("conversation.id", conversation_id)
+            
+            # Call agent (this will use tools that modify the database)
+            compensation = CompensationLog()
+            try:
+                assistant_response, tool_calls = await run_agent(
+                    user_id=str(user_id),
+                    user_message=request.message,
+                    conversation_history=conversation_history,
+                    task_context=task_context,
+                    session_factory=lambda: Session(engine),
+                    compensation_log=compensation,
+                    read_session_factory=lambda: read_session(user_id)
+                )
+            except LLMUnavailableError as e:
+                compensation.compensate(lambda: Session(engine))
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=str(e),
+                    headers={"Retry-After": str(math.ceil(e.retry_after))}
+                )
+            except Exception as e:
+                compensation.compensate(lambda: Session(engine))
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Error calling AI agent: {str(e)}"
+                )
+            chat_span.set_attribute("agent.tool_call_count", len(tool_calls))
+            
+            with tracing.span("chat.commit"):
+                # Save the user message, assistant response and conversation
+                # timestamp in one transaction
+                response = ChatResponse(
+                    conversation_id=conversation_id,
+                    response=assistant_response,
+                    tool_calls=tool_calls
+                )
+                try:
+                    if settings.TRANSCRIPT_WRITE_BEHIND:
+                        # Spool the turn; it is inserted in the background
+                        turn = await transcript_writer.submit(conversation_id, user_id, request.message, assistant_response)
+                        new_version = turn.created_at
+                        if claimed is not None:
+                            with Session(engine) as session:
+                                claimed.store(session, status.HTTP_200_OK, response)
+                                session.commit()
+                    else:
+                        with Session(engine) as session:
+                            new_version = add_turn(session, conversation_id, user_id, request.message, assistant_response)
+                            if claimed is not None:
+                                claimed.store(session, status.HTTP_200_OK, response)
+                            session.commit()
+                except Exception:
+                    compensation.compensate(lambda: Session(engine))
+                    raise
+                # Keep this worker's cached history current for the next turn
+                history_cache.append(conversation_id, history_version, new_version, [
+                    {"role": "user", "content": request.message},
+                    {"role": "assistant", "content": assistant_response}
+                ])
+    
+    return response
+
+
+@router.get("/{user_id}/chat/jobs/{job_id}", response_model=ChatJobResponse)
+async def get_chat_job(
+    user_id: int,
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the job to finish (long polling)"),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Get the status and result of a background chat job."""
+    verify_user_access(user_id, token_user_id)
+    
+    # No request-scoped session: waiting must not hold a pooled connection
+    job = await wait_for_job(job_id, user_id, min(wait, settings.JOB_MAX_WAIT_SECONDS))
+    
+    if not job:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error calling AI agent: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
         )
     
-    # Save user message (after agent call, so it's in the same transaction)
-    user_message = Message(
-        conversation_id=conversation.id,
-        user_id=user_id,
-        role="user",
-        content=request.message
-    )
-    session.add(user_message)
-    
-    # Save assistant response
-    assistant_message = Message(
-        conversation_id=conversation.id,
-        user_id=user_id,
-        role="assistant",
-        content=assistant_response
-    )
-    session.add(assistant_message)
+    return job_response(job)
+
+
+@router.delete("/{user_id}/conversations/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_conversation_route(
+    user_id: int,
+    conversation_id: int,
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Delete a conversation and all of its messages.
     
-    # Update conversation timestamp
-    from datetime import datetime
-    conversation.updated_at = datetime.utcnow()
-    session.add(conversation)
+    Messages are removed in batches of RETENTION_BATCH_SIZE, so a long
+    conversation never holds one large transaction.
+    """
+    verify_user_access(user_id, token_user_id)
     
-    # Commit everything at once (user message, assistant message, and any task changes from tools)
-    session.commit()
+    with Session(engine) as session:
+        owner = session.exec(select(Conversation.user_id).where(Conversation.id == conversation_id)).first()
+    if owner != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
     
-    return ChatResponse(
-        conversation_id=conversation.id,
-        response=assistant_response,
-        tool_calls=tool_calls
-    )
-
+    await run_in_threadpool(delete_conversation, conversation_id, settings.RETENTION_BATCH_SIZE)
+    return None
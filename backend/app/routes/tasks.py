@@ -1,12 +1,23 @@
 """Task CRUD routes."""
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+import tempfile
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
-from typing import Optional, List
-from pydantic import BaseModel
-from datetime import datetime
-from app.database import get_session
+from typing import Literal, Optional, List
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta
+from app.config import settings
+from app.database import get_read_session, get_session
 from app.models import Task
 from app.auth import decode_token
+from app.idempotency import IDEMPOTENCY_HEADER, StoredResponse, claim_key, request_fingerprint
+from app.responses import FastJSONResponse
+from app.reminders import normalize_due_at
+from app.singleflight import task_reads
+from app.task_order import ORDER, after_position, move_task as move_task_in_order
+from app.task_stats import get_stats
+from app.task_transfer import FORMATS, MEDIA_TYPES, ImportResult, export_tasks, import_tasks
 
 router = APIRouter(prefix="/api", tags=["tasks"])
 
@@ -15,6 +26,8 @@ class TaskCreate(BaseModel):
     """Task creation model."""
     title: str
     description: str = ""
+    due_at: Optional[datetime] = None
+    priority: int = Field(0, ge=0, le=3, description="0 none, 1 low, 2 medium, 3 high")
 
 
 class TaskUpdate(BaseModel):
@@ -22,6 +35,15 @@ class TaskUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     completed: Optional[bool] = None
+    due_at: Optional[datetime] = None
+    priority: Optional[int] = Field(None, ge=0, le=3)
+
+
+class TaskMove(BaseModel):
+    """Where to move a task: exactly one of after_id, before_id or position."""
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+    position: Optional[Literal["top", "bottom"]] = None
 
 
 class TaskResponse(BaseModel):
@@ -31,10 +53,72 @@ class TaskResponse(BaseModel):
     title: str
     description: str
     completed: bool
+    due_at: Optional[datetime] = None
+    priority: int = 0
+    rank: float = 0
     created_at: datetime
     updated_at: datetime
 
 
+class TaskStatsResponse(BaseModel):
+    """Task counts for a user."""
+    pending: int
+    completed: int
+    total: int
+    overdue: int
+
+
+# Columns selected by the fast read path, in TaskResponse field order
+TASK_COLUMNS = (
+    Task.id,
+    Task.user_id,
+    Task.title,
+    Task.description,
+    Task.completed,
+    Task.due_at,
+    Task.priority,
+    Task.rank,
+    Task.created_at,
+    Task.updated_at,
+)
+TASK_FIELDS = tuple(column.key for column in TASK_COLUMNS)
+
+# sort= orderings of the task list; without one, tasks come in manual order
+TASK_ORDERINGS = {
+    "due": (Task.due_at.is_(None), Task.due_at, Task.priority.desc()),
+    "priority": (Task.priority.desc(), Task.due_at.is_(None), Task.due_at),
+}
+
+FIELDS_QUERY_DESCRIPTION = (
+    "Comma-separated list of fields to return (id is always included), "
+    f"e.g. 'title,completed'. Allowed: {', '.join(TASK_FIELDS)}"
+)
+
+
+def select_task_columns(fields: Optional[str]) -> tuple:
+    """Resolve a fields= query parameter to the columns to select.
+    
+    Narrowing happens in the SQL projection, so unrequested columns are
+    neither read from the database nor serialized.
+    """
+    if not fields:
+        return TASK_COLUMNS
+    
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(TASK_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown field(s): {', '.join(sorted(unknown))}"
+        )
+    
+    # id is always returned so clients can address the task
+    return tuple(
+        column for column in TASK_COLUMNS
+        if column.key == "id" or column.key in requested
+    )
+
+
 def get_current_user_id(authorization: Optional[str] = Header(None)) -> int:
     """Extract user_id from JWT token."""
     if not authorization:
@@ -77,64 +161,222 @@ def verify_user_access(user_id: int, token_user_id: int):
         )
 
 
-@router.get("/{user_id}/tasks", response_model=List[TaskResponse])
+@router.get("/{user_id}/tasks", response_model=List[TaskResponse], response_class=FastJSONResponse)
 async def list_tasks(
     user_id: int,
-    session: Session = Depends(get_session),
+    fields: Optional[str] = Query(None, description=FIELDS_QUERY_DESCRIPTION),
+    sort: Optional[str] = Query(
+        None, pattern=f"^({'|'.join(TASK_ORDERINGS)})$",
+        description="'due' (soonest first, undated last) or 'priority' (highest first); default is manual order"
+    ),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (manual order only)"),
+    after: Optional[int] = Query(None, description="Id of the last task of the previous page (manual order only)"),
+    session: Session = Depends(get_read_session),
     token_user_id: int = Depends(get_current_user_id)
 ):
-    """List all tasks for a user."""
+    """List a user's tasks, in manual order unless sorted otherwise."""
     verify_user_access(user_id, token_user_id)
     
-    statement = select(Task).where(Task.user_id == user_id)
-    tasks = session.exec(statement).all()
+    if sort and (limit or after):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pagination is only supported in manual order (without sort)"
+        )
+    
+    columns = select_task_columns(fields)
+    keys = tuple(column.key for column in columns)
+    
+    # Select plain row tuples instead of hydrating Task objects
+    statement = select(*columns).where(Task.user_id == user_id)
+    if sort:
+        statement = statement.order_by(*TASK_ORDERINGS[sort], Task.id)
+    else:
+        # Pages are range scans on ix_task_user_rank
+        statement = statement.order_by(*ORDER)
+        if after is not None:
+            anchor = select(Task.rank).where(Task.id == after, Task.user_id == user_id).scalar_subquery()
+            statement = statement.where(after_position(anchor, after))
+        if limit:
+            statement = statement.limit(limit)
+    
+    async def query() -> bytes:
+        # Run the query off the event loop so identical requests can join it
+        rows = await run_in_threadpool(lambda: session.exec(statement).all())
+        # Rows already match TaskResponse, so encode them directly and skip
+        # FastAPI's second validation/encoding pass
+        return FastJSONResponse([dict(zip(keys, row)) for row in rows]).body
     
-    return tasks
+    # Concurrent identical requests share one query and its encoded body
+    body = await task_reads.do(user_id, ("rest", keys, sort, limit, after), query)
+    return Response(content=body, media_type=FastJSONResponse.media_type)
 
 
 @router.post("/{user_id}/tasks", response_model=TaskResponse, status_code=status.HTTP_201_CREATED)
 async def create_task(
     user_id: int,
     task_data: TaskCreate,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     session: Session = Depends(get_session),
     token_user_id: int = Depends(get_current_user_id)
 ):
-    """Create a new task."""
+    """Create a new task.
+    
+    A retry sent with the same Idempotency-Key returns the task created by
+    the first request instead of creating a duplicate.
+    """
     verify_user_access(user_id, token_user_id)
     
+    claimed = None
+    if idempotency_key:
+        claimed = await claim_key(user_id, "tasks.create", idempotency_key, request_fingerprint(task_data))
+        if isinstance(claimed, StoredResponse):
+            return claimed.to_response()
+    
     new_task = Task(
         user_id=user_id,
         title=task_data.title,
-        description=task_data.description
+        description=task_data.description,
+        due_at=normalize_due_at(task_data.due_at),
+        priority=task_data.priority
     )
     
-    session.add(new_task)
-    session.commit()
+    try:
+        session.add(new_task)
+        if claimed is not None:
+            # Store the response in the same transaction as the task
+            session.flush()
+            claimed.store(session, status.HTTP_201_CREATED, TaskResponse.model_validate(new_task, from_attributes=True))
+        session.commit()
+    except BaseException:
+        if claimed is not None:
+            session.rollback()
+            await claimed.release()
+        raise
+    if claimed is not None:
+        claimed.done()
     session.refresh(new_task)
     
     return new_task
 
 
-@router.get("/{user_id}/tasks/{task_id}", response_model=TaskResponse)
+@router.get("/{user_id}/tasks/stats", response_model=TaskStatsResponse)
+async def task_stats(
+    user_id: int,
+    session: Session = Depends(get_read_session),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Pending, completed and overdue task counts, without listing the tasks."""
+    verify_user_access(user_id, token_user_id)
+    
+    counts = await run_in_threadpool(get_stats, session, user_id)
+    return TaskStatsResponse(
+        pending=counts.pending,
+        completed=counts.completed,
+        total=counts.total,
+        overdue=counts.overdue
+    )
+
+
+@router.get("/{user_id}/tasks/due", response_model=List[TaskResponse], response_class=FastJSONResponse)
+async def list_due_tasks(
+    user_id: int,
+    hours: float = Query(24, gt=0, le=24 * 366, description="Include pending tasks due within this many hours"),
+    session: Session = Depends(get_read_session),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """List pending tasks due within the next hours (and overdue ones), soonest first."""
+    verify_user_access(user_id, token_user_id)
+    
+    # A range scan on ix_task_user_completed_due_at
+    statement = (
+        select(*TASK_COLUMNS)
+        .where(
+            Task.user_id == user_id,
+            Task.completed == False,
+            Task.due_at <= datetime.utcnow() + timedelta(hours=hours)
+        )
+        .order_by(Task.due_at, Task.priority.desc(), Task.id)
+    )
+    rows = await run_in_threadpool(lambda: session.exec(statement).all())
+    return FastJSONResponse([dict(zip(TASK_FIELDS, row)) for row in rows])
+
+
+@router.get("/{user_id}/tasks/export")
+async def export_user_tasks(
+    user_id: int,
+    format: str = Query("ndjson", pattern=f"^({'|'.join(FORMATS)})$", description="ndjson or csv"),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Stream all of the user's tasks as NDJSON or CSV."""
+    verify_user_access(user_id, token_user_id)
+    
+    return StreamingResponse(
+        export_tasks(user_id, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="tasks.{format}"'}
+    )
+
+
+@router.post("/{user_id}/tasks/import", response_model=ImportResult)
+async def import_user_tasks(
+    user_id: int,
+    request: Request,
+    format: Optional[str] = Query(
+        None, pattern=f"^({'|'.join(FORMATS)})$",
+        description="ndjson or csv; defaults to csv for a text/csv body, else ndjson"
+    ),
+    session: Session = Depends(get_session),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Create tasks from an NDJSON or CSV request body.
+    
+    Each row needs a title and may set description and completed. Invalid
+    rows are skipped and reported by row number; the rest are created.
+    """
+    verify_user_access(user_id, token_user_id)
+    
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if content_type.startswith("text/csv") else "ndjson"
+    
+    # Spool the body (to disk past 1 MB) so parsing never holds it all in memory
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as upload:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.TASK_IMPORT_MAX_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Import is larger than {settings.TASK_IMPORT_MAX_BYTES} bytes"
+                )
+            upload.write(chunk)
+        upload.seek(0)
+        return await run_in_threadpool(import_tasks, session, user_id, upload, format)
+
+
+@router.get("/{user_id}/tasks/{task_id}", response_model=TaskResponse, response_class=FastJSONResponse)
 async def get_task(
     user_id: int,
     task_id: int,
-    session: Session = Depends(get_session),
+    fields: Optional[str] = Query(None, description=FIELDS_QUERY_DESCRIPTION),
+    session: Session = Depends(get_read_session),
     token_user_id: int = Depends(get_current_user_id)
 ):
     """Get a specific task."""
     verify_user_access(user_id, token_user_id)
     
-    statement = select(Task).where(Task.id == task_id, Task.user_id == user_id)
-    task = session.exec(statement).first()
+    columns = select_task_columns(fields)
     
-    if not task:
+    statement = select(*columns).where(Task.id == task_id, Task.user_id == user_id)
+    row = session.exec(statement).first()
+    
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Task not found"
         )
     
-    return task
+    return FastJSONResponse(dict(zip((column.key for column in columns), row)))
 
 
 @router.put("/{user_id}/tasks/{task_id}", response_model=TaskResponse)
@@ -164,6 +406,14 @@ async def update_task(
         task.description = task_data.description
     if task_data.completed is not None:
         task.completed = task_data.completed
+    if task_data.priority is not None:
+        task.priority = task_data.priority
+    # An explicit null clears the due date
+    if "due_at" in task_data.model_fields_set:
+        due_at = normalize_due_at(task_data.due_at)
+        if due_at != task.due_at:
+            task.due_at = due_at
+            task.reminded_at = None  # Remind again at the new time
     
     task.updated_at = datetime.utcnow()
     
@@ -199,6 +449,35 @@ async def delete_task(
     return None
 
 
+@router.post("/{user_id}/tasks/{task_id}/move", response_model=TaskResponse)
+async def move_task(
+    user_id: int,
+    task_id: int,
+    move: TaskMove,
+    session: Session = Depends(get_session),
+    token_user_id: int = Depends(get_current_user_id)
+):
+    """Move a task in the manual order: right after or before another task, or to the top or bottom.
+    
+    Only the moved task's rank changes.
+    """
+    verify_user_access(user_id, token_user_id)
+    
+    try:
+        task = move_task_in_order(session, user_id, task_id, move.after_id, move.before_id, move.position)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    task.updated_at = datetime.utcnow()
+    session.add(task)
+    session.commit()
+    session.refresh(task)
+    
+    return task
+
+
 @router.patch("/{user_id}/tasks/{task_id}/complete", response_model=TaskResponse)
 async def toggle_complete(
     user_id: int,
@@ -0,0 +1,16 @@
+"""Production server pieces used by gunicorn.conf.py."""
+from uvicorn.workers import UvicornWorker
+
+
+class FastUvicornWorker(UvicornWorker):
+    """Uvicorn worker pinned to the uvloop event loop and httptools parser.
+
+    Both ship with uvicorn[standard]; pinning them makes a missing extra
+    fail loudly at boot instead of silently falling back to asyncio/h11.
+    """
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "loop": "uvloop",
+        "http": "httptools",
+    }
@@ -0,0 +1,70 @@
+"""Request coalescing (single-flight) for identical concurrent reads."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+from app.metrics import metrics
+from app.task_events import TaskChange, subscribe
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key.
+
+    Keys are scoped per user and include the user's write generation. A
+    committed write bumps the generation, so reads that start after the write
+    never join a query that started before it. Results are not cached: once
+    the leader finishes, the next caller runs a fresh query.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Tuple[int, int, Hashable], asyncio.Future] = {}
+        self._generations: Dict[int, int] = {}
+
+    def invalidate(self, user_id: int) -> None:
+        """Detach future callers from reads started before a write."""
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    async def do(self, user_id: int, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn, or wait for the identical call already in flight."""
+        flight_key = (user_id, self._generations.get(user_id, 0), key)
+        while True:
+            future = self._calls.get(flight_key)
+            if future is None:
+                break
+            metrics.increment(f"{self.name}.coalesced")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The leader was cancelled (client went away); if we were not
+                # cancelled ourselves, take over and run the call
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[flight_key] = future
+        metrics.increment(f"{self.name}.executed")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody else awaited is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(flight_key) is future:
+                del self._calls[flight_key]
+
+
+# Coalesces task list reads (REST endpoint and the list_tasks MCP tool)
+task_reads = SingleFlight("singleflight.task_reads")
+
+
+@subscribe
+def _invalidate_task_reads(changes: List[TaskChange]) -> None:
+    for user_id in {change.user_id for change in changes}:
+        task_reads.invalidate(user_id)
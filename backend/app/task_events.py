@@ -0,0 +1,81 @@
+"""Task change notifications delivered after a transaction commits.
+
+Any Session that flushes Task inserts, updates or deletes records the
+changes in ``session.info``; once the transaction commits, subscribers are
+called with the list of changes. Rolled-back changes are discarded, so
+subscribers (caches, indexes, coalescing layers) only ever see durable writes.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+from sqlalchemy import event
+from sqlmodel import Session
+from app.models import Task
+
+logger = logging.getLogger(__name__)
+
+
+class TaskChange(NamedTuple):
+    """A committed change to one task."""
+    kind: str  # "created", "updated" or "deleted"
+    task_id: int
+    user_id: int
+    title: Optional[str] = None
+    completed: Optional[bool] = None
+    due_at: Optional[datetime] = None
+
+
+_subscribers: List[Callable[[List[TaskChange]], None]] = []
+
+
+def subscribe(callback: Callable[[List[TaskChange]], None]):
+    """Register a callback for committed task changes (usable as a decorator)."""
+    _subscribers.append(callback)
+    return callback
+
+
+def publish(changes: List[TaskChange]) -> None:
+    """Deliver changes to subscribers.
+
+    Called automatically after ORM commits; bulk paths that bypass the ORM
+    call it themselves after committing.
+    """
+    if not changes:
+        return
+    for callback in _subscribers:
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.warning(f"Task change subscriber {callback!r} failed: {e}")
+
+
+def _snapshot(kind: str, task: Task) -> TaskChange:
+    return TaskChange(kind, task.id, task.user_id, task.title, task.completed, task.due_at)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    """Remember Task writes made by this flush until the transaction ends."""
+    changes = [_snapshot("created", obj) for obj in session.new if isinstance(obj, Task)]
+    changes += [
+        _snapshot("updated", obj) for obj in session.dirty
+        if isinstance(obj, Task) and session.is_modified(obj, include_collections=False)
+    ]
+    changes += [_snapshot("deleted", obj) for obj in session.deleted if isinstance(obj, Task)]
+    if changes:
+        session.info.setdefault("task_changes", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_changes(session):
+    publish(session.info.pop("task_changes", None))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("task_changes", None)
+
+
+def has_uncommitted_changes(session: Session) -> bool:
+    """True if this session has flushed task writes that are not committed yet."""
+    return bool(session.info.get("task_changes"))
@@ -0,0 +1,223 @@
+"""Manual task ordering with fractional ranks.
+
+Each task has a float ``rank``, and a user's list is ordered by (rank, id).
+New tasks go to the end, RANK_STEP past the largest rank (found on the
+(user_id, rank) index). Moving a task sets its rank to the midpoint of its
+new neighbours, so a reorder updates a single row.
+
+Every midpoint halves a gap, so repeated moves into the same spot run out
+of float precision after a few dozen moves. When a gap falls below
+RANK_MIN_GAP the user is queued for rebalancing, which renumbers their
+tasks RANK_STEP apart in the background. If a gap is already exhausted, or
+the neighbours tie (tasks that predate ranks all have rank 0), the list is
+rebalanced inline before the move. Moves and rebalances of a user are
+serialized by locking the user row.
+"""
+import asyncio
+import logging
+import threading
+from typing import Optional, Set, Tuple
+from sqlalchemy import and_, bindparam, event, func, or_, update
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import Task, User
+
+logger = logging.getLogger(__name__)
+
+RANK_STEP = 1024.0
+RANK_MIN_GAP = 1e-6
+
+MOVE_POSITIONS = ("top", "bottom")
+
+# Manual order; id breaks ties between equal ranks
+ORDER = (Task.rank, Task.id)
+
+
+def last_rank(session: Session, user_id: int) -> float:
+    """Largest rank among the user's tasks (0 without tasks)."""
+    rank = session.connection().execute(select(func.max(Task.rank)).where(Task.user_id == user_id)).scalar()
+    return rank if rank is not None else 0.0
+
+
+@event.listens_for(Session, "before_flush")
+def _rank_new_tasks(session, flush_context, instances):
+    """Append new tasks without a rank to the end of their user's list."""
+    new = sorted(
+        (obj for obj in session.new if isinstance(obj, Task) and obj.rank is None),
+        key=lambda task: task.created_at
+    )
+    next_rank = {}
+    for task in new:
+        if task.user_id not in next_rank:
+            next_rank[task.user_id] = last_rank(session, task.user_id) + RANK_STEP
+        task.rank = next_rank[task.user_id]
+        next_rank[task.user_id] += RANK_STEP
+
+
+def after_position(rank: float, task_id: int):
+    """Condition for tasks ordered after (rank, task_id)."""
+    return or_(Task.rank > rank, and_(Task.rank == rank, Task.id > task_id))
+
+
+def before_position(rank: float, task_id: int):
+    """Condition for tasks ordered before (rank, task_id)."""
+    return or_(Task.rank < rank, and_(Task.rank == rank, Task.id < task_id))
+
+
+def _get_task(session: Session, user_id: int, task_id: int) -> Task:
+    task = session.exec(select(Task).where(Task.id == task_id, Task.user_id == user_id)).first()
+    if task is None:
+        raise LookupError(f"Task {task_id} not found")
+    return task
+
+
+def _neighbours(session: Session, task: Task, after_id: Optional[int], before_id: Optional[int],
+                position: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """Ranks of the tasks the moved task will sit between (None at either end)."""
+    others = select(Task.rank).where(Task.user_id == task.user_id, Task.id != task.id)
+    if position == "top":
+        return None, session.exec(others.order_by(*ORDER).limit(1)).first()
+    if position == "bottom":
+        return session.exec(others.order_by(Task.rank.desc(), Task.id.desc()).limit(1)).first(), None
+    if after_id is not None:
+        anchor = _get_task(session, task.user_id, after_id)
+        higher = session.exec(
+            others.where(after_position(anchor.rank, anchor.id)).order_by(*ORDER).limit(1)
+        ).first()
+        return anchor.rank, higher
+    anchor = _get_task(session, task.user_id, before_id)
+    lower = session.exec(
+        others.where(before_position(anchor.rank, anchor.id)).order_by(Task.rank.desc(), Task.id.desc()).limit(1)
+    ).first()
+    return lower, anchor.rank
+
+
+def _rank_between(lower: Optional[float], higher: Optional[float]) -> float:
+    if lower is None and higher is None:
+        return RANK_STEP
+    if lower is None:
+        return higher - RANK_STEP
+    if higher is None:
+        return lower + RANK_STEP
+    return (lower + higher) / 2
+
+
+def _fits(rank: float, lower: Optional[float], higher: Optional[float]) -> bool:
+    return (lower is None or lower < rank) and (higher is None or rank < higher)
+
+
+def _lock_user(session: Session, user_id: int) -> None:
+    session.exec(select(User.id).where(User.id == user_id).with_for_update()).first()
+
+
+def move_task(session: Session, user_id: int, task_id: int, after_id: Optional[int] = None,
+              before_id: Optional[int] = None, position: Optional[str] = None) -> Task:
+    """Place a task right after or before another task, or at the top or bottom (caller commits).
+
+    Raises ValueError for an invalid target and LookupError for unknown tasks.
+    """
+    if sum(target is not None for target in (after_id, before_id, position)) != 1:
+        raise ValueError("Give exactly one of after_id, before_id or position")
+    if position is not None and position not in MOVE_POSITIONS:
+        raise ValueError(f"position must be one of {', '.join(MOVE_POSITIONS)}")
+    if task_id in (after_id, before_id):
+        raise ValueError("A task cannot be moved next to itself")
+
+    _lock_user(session, user_id)
+    task = _get_task(session, user_id, task_id)
+    lower, higher = _neighbours(session, task, after_id, before_id, position)
+    rank = _rank_between(lower, higher)
+    if not _fits(rank, lower, higher):
+        # Out of precision, or tied neighbours: renumber, then place again
+        rebalance(session, user_id)
+        lower, higher = _neighbours(session, task, after_id, before_id, position)
+        rank = _rank_between(lower, higher)
+    elif lower is not None and higher is not None and higher - lower < RANK_MIN_GAP:
+        schedule_rebalance(user_id)
+
+    task.rank = rank
+    session.add(task)
+    metrics.increment("tasks.moves")
+    return task
+
+
+def rebalance(session: Session, user_id: int) -> int:
+    """Renumber the user's tasks RANK_STEP apart, keeping their order (caller commits).
+
+    Returns how many ranks changed.
+    """
+    session.flush()
+    rows = session.exec(select(Task.id, Task.rank).where(Task.user_id == user_id).order_by(*ORDER)).all()
+    changes = [
+        {"task_id": task_id, "new_rank": (position + 1) * RANK_STEP}
+        for position, (task_id, rank) in enumerate(rows)
+        if rank != (position + 1) * RANK_STEP
+    ]
+    if changes:
+        table = Task.__table__
+        session.connection().execute(
+            update(table).where(table.c.id == bindparam("task_id")).values(rank=bindparam("new_rank")),
+            changes
+        )
+        # The statement bypassed the ORM; reload ranks of loaded tasks
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Task) and obj.user_id == user_id:
+                session.expire(obj, ["rank"])
+    metrics.increment("tasks.rank_rebalances")
+    return len(changes)
+
+
+_pending_rebalances: Set[int] = set()
+_pending_lock = threading.Lock()
+
+
+def schedule_rebalance(user_id: int) -> None:
+    """Queue a user for background rebalancing by this process."""
+    with _pending_lock:
+        _pending_rebalances.add(user_id)
+
+
+def rebalance_pending() -> int:
+    """Rebalance every queued user, one transaction each; returns users rebalanced."""
+    with _pending_lock:
+        user_ids = list(_pending_rebalances)
+        _pending_rebalances.clear()
+    for user_id in user_ids:
+        with Session(engine) as session:
+            _lock_user(session, user_id)
+            rebalance(session, user_id)
+            session.commit()
+    return len(user_ids)
+
+
+class RebalanceJob:
+    """Runs rebalance_pending() every TASK_RANK_REBALANCE_INTERVAL_SECONDS in the background."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="task-rank-rebalance")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(rebalance_pending)
+            except Exception as e:
+                metrics.increment("tasks.rank_rebalance_errors")
+                logger.warning(f"Task rank rebalancing failed: {e}")
+
+
+rebalance_job = RebalanceJob(interval=settings.TASK_RANK_REBALANCE_INTERVAL_SECONDS)
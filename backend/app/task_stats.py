@@ -0,0 +1,228 @@
+"""Materialized per-user task counters.
+
+Every flush that creates, deletes or (un)completes tasks adjusts the owner's
+task_stats row in the same transaction, so the counts commit or roll back
+with the task writes themselves. This covers the REST routes, agent tools
+and compensation alike. Bulk writes that bypass the ORM (imports) call
+apply_deltas() themselves.
+
+Counters are only incremented, never recomputed on the write path. A user
+without a row (created before this table existed) gets one from a full
+count on first read. A reconciliation job recounts in batches and repairs
+any drift. It locks the stats rows before counting, so concurrent writes
+are neither lost nor counted twice.
+
+Run a single reconciliation pass with:
+
+    python -m app.task_stats
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import case, event, func, inspect, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import Task, TaskStats, User
+from app.task_events import has_uncommitted_changes
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCounts(NamedTuple):
+    """A user's task counts."""
+    pending: int
+    completed: int
+    overdue: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.pending + self.completed
+
+
+def _add(deltas: Dict[int, List[int]], user_id: int, completed: bool, step: int) -> None:
+    delta = deltas.setdefault(user_id, [0, 0])
+    delta[1 if completed else 0] += step
+
+
+def _flush_deltas(session: Session) -> Dict[int, List[int]]:
+    """Per-user [pending, completed] changes made by the current flush."""
+    deltas: Dict[int, List[int]] = {}
+    for obj in session.new:
+        if isinstance(obj, Task):
+            _add(deltas, obj.user_id, obj.completed, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            _add(deltas, obj.user_id, obj.completed, -1)
+    for obj in session.dirty:
+        if isinstance(obj, Task):
+            history = inspect(obj).attrs.completed.history
+            if history.added and history.deleted and history.added[0] != history.deleted[0]:
+                _add(deltas, obj.user_id, history.deleted[0], -1)
+                _add(deltas, obj.user_id, history.added[0], 1)
+    return {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+
+
+def apply_deltas(session: Session, deltas: Dict[int, List[int]]) -> None:
+    """Adjust counters by per-user [pending, completed] deltas in the session's transaction."""
+    connection = session.connection()
+    now = datetime.utcnow()
+    for user_id, (pending, completed) in deltas.items():
+        # No row yet: it is built from a full count on first read
+        connection.execute(
+            update(TaskStats)
+            .where(TaskStats.user_id == user_id)
+            .values(pending=TaskStats.pending + pending, completed=TaskStats.completed + completed, updated_at=now)
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _update_counters(session, flush_context):
+    deltas = _flush_deltas(session)
+    if deltas:
+        apply_deltas(session, deltas)
+
+
+def count_tasks(session: Session, user_ids: List[int]) -> Dict[int, TaskCounts]:
+    """Count the users' tasks from the task table."""
+    rows = session.exec(
+        select(
+            Task.user_id,
+            func.sum(case((Task.completed == False, 1), else_=0)),
+            func.sum(case((Task.completed == True, 1), else_=0))
+        )
+        .where(Task.user_id.in_(user_ids))
+        .group_by(Task.user_id)
+    ).all()
+    counts = {user_id: TaskCounts(0, 0) for user_id in user_ids}
+    counts.update({user_id: TaskCounts(int(pending), int(completed)) for user_id, pending, completed in rows})
+    return counts
+
+
+def initialize(user_id: int) -> TaskCounts:
+    """Create a user's stats row from a full count (on the primary)."""
+    with Session(engine) as session:
+        counts = count_tasks(session, [user_id])[user_id]
+        session.add(TaskStats(user_id=user_id, pending=counts.pending, completed=counts.completed))
+        try:
+            session.commit()
+        except IntegrityError:
+            pass  # Created concurrently
+    metrics.increment("task_stats.initialized")
+    return counts
+
+
+def get_stats(session: Session, user_id: int) -> TaskCounts:
+    """The user's counters, plus overdue pending tasks counted on the due-date index."""
+    row = session.exec(
+        select(TaskStats.pending, TaskStats.completed).where(TaskStats.user_id == user_id)
+    ).first()
+    if row is None:
+        metrics.increment("task_stats.misses")
+        if has_uncommitted_changes(session):
+            # Count within this transaction; another session could block on its locks
+            row = count_tasks(session, [user_id])[user_id][:2]
+        else:
+            row = initialize(user_id)[:2]
+    overdue = session.exec(
+        select(func.count()).select_from(Task).where(
+            Task.user_id == user_id,
+            Task.completed == False,
+            Task.due_at < datetime.utcnow()
+        )
+    ).one()
+    return TaskCounts(row[0], row[1], overdue)
+
+
+def reconcile_batch(user_ids: List[int]) -> int:
+    """Recount the users' tasks and fix counters that drifted; returns rows repaired."""
+    repaired = 0
+    with Session(engine) as session:
+        # Lock first: writers block on their counter update until the recount commits
+        stored = {
+            stats.user_id: stats
+            for stats in session.exec(
+                select(TaskStats).where(TaskStats.user_id.in_(user_ids)).with_for_update()
+            ).all()
+        }
+        for user_id, counts in count_tasks(session, user_ids).items():
+            stats = stored.get(user_id)
+            if stats is None:
+                session.add(TaskStats(user_id=user_id, pending=counts.pending, completed=counts.completed))
+            elif (stats.pending, stats.completed) != counts[:2]:
+                logger.info(
+                    f"Task counters of user {user_id} drifted: "
+                    f"{stats.pending}/{stats.completed} counted {counts.pending}/{counts.completed}"
+                )
+                stats.pending, stats.completed = counts.pending, counts.completed
+                stats.updated_at = datetime.utcnow()
+                session.add(stats)
+                repaired += 1
+        try:
+            session.commit()
+        except IntegrityError:
+            return 0  # A row was created concurrently; the next pass covers these users
+    metrics.increment("task_stats.repaired", repaired)
+    return repaired
+
+
+def reconcile_all(batch_size: int) -> int:
+    """Reconcile every user's counters, batch_size users per transaction."""
+    repaired = 0
+    last_id = 0
+    while True:
+        with Session(engine) as session:
+            user_ids = session.exec(
+                select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+            ).all()
+        if not user_ids:
+            break
+        repaired += reconcile_batch(list(user_ids))
+        last_id = user_ids[-1]
+    metrics.increment("task_stats.reconcile_runs")
+    return repaired
+
+
+class ReconcileJob:
+    """Runs reconcile_all() every TASK_STATS_RECONCILE_INTERVAL_SECONDS in the background."""
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="task-stats-reconcile")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                repaired = await asyncio.to_thread(reconcile_all, self.batch_size)
+                if repaired:
+                    logger.warning(f"Repaired task counters of {repaired} user(s)")
+            except Exception as e:
+                metrics.increment("task_stats.reconcile_errors")
+                logger.warning(f"Task counter reconciliation failed: {e}")
+
+
+reconcile_job = ReconcileJob(
+    interval=settings.TASK_STATS_RECONCILE_INTERVAL_SECONDS,
+    batch_size=settings.TASK_STATS_RECONCILE_BATCH_SIZE,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Repaired task counters of {reconcile_all(settings.TASK_STATS_RECONCILE_BATCH_SIZE)} user(s)")
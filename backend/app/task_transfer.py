@@ -0,0 +1,211 @@
+"""Bulk task export and import (NDJSON and CSV).
+
+Exports stream rows in batches from a server-side cursor (``yield_per``), so
+memory stays flat however many tasks a user has.
+
+Imports parse the spooled upload one row at a time and validate each row
+against ImportedTask. Invalid rows are skipped and reported with their row
+number; valid rows are written in batches of IMPORT_BATCH_SIZE, with
+Postgres ``COPY`` or a multi-row INSERT elsewhere, and committed together.
+These writes bypass the ORM, so the created tasks are published to
+app.task_events afterwards.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from fastapi import HTTPException, status
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import insert
+from sqlmodel import Session, select
+from app import task_events, task_stats
+from app.database import read_session
+from app.models import Task
+from app.reminders import normalize_due_at
+from app.task_order import RANK_STEP, last_rank
+from app.responses import dumps
+from app.task_events import TaskChange
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+EXPORT_COLUMNS = (Task.id, Task.title, Task.description, Task.completed, Task.due_at, Task.priority,
+                  Task.created_at, Task.updated_at)
+EXPORT_FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+# Column order of the COPY stream
+COPY_FIELDS = ("user_id", "title", "description", "completed", "due_at", "priority", "rank",
+               "created_at", "updated_at")
+
+
+class ImportedTask(BaseModel):
+    """One imported row; other fields (e.g. id from an export) are ignored."""
+    title: str = Field(min_length=1, max_length=200)
+    description: str = Field(default="", max_length=1000)
+    completed: bool = False
+    due_at: Optional[datetime] = None
+    priority: int = Field(default=0, ge=0, le=3)
+
+
+class ImportResult(BaseModel):
+    """Outcome of an import."""
+    imported: int
+    failed: int
+    errors: List[Dict[str, object]] = []
+
+
+def export_tasks(user_id: int, fmt: str) -> Iterator[bytes]:
+    """Yield the user's tasks encoded as NDJSON or CSV, one chunk per batch."""
+    statement = (
+        select(*EXPORT_COLUMNS)
+        .where(Task.user_id == user_id)
+        .order_by(Task.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    with read_session(user_id) as session:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            for rows in session.exec(statement).partitions():
+                writer.writerows(
+                    (id_, title, description, "true" if completed else "false",
+                     due_at.isoformat() if due_at else "", priority,
+                     created_at.isoformat(), updated_at.isoformat())
+                    for id_, title, description, completed, due_at, priority, created_at, updated_at in rows
+                )
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        else:
+            for rows in session.exec(statement).partitions():
+                yield b"".join(dumps(dict(zip(EXPORT_FIELDS, row))) + b"\n" for row in rows)
+
+
+def _ndjson_rows(upload: IO[bytes]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yield (row number, fields, error) per non-blank line."""
+    for number, line in enumerate(upload, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield number, None, "invalid JSON"
+            continue
+        if not isinstance(data, dict):
+            yield number, None, "expected a JSON object"
+            continue
+        yield number, data, None
+
+
+def _csv_rows(upload: IO[bytes]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yield (row number, fields, error) per CSV record; row 1 is the first after the header."""
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", errors="replace", newline="")
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None or "title" not in reader.fieldnames:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="CSV header must include a 'title' column"
+        )
+    for number, row in enumerate(reader, start=1):
+        if not any(value for key, value in row.items() if key is not None):
+            continue
+        # Empty cells mean "use the default"
+        yield number, {key: value for key, value in row.items() if key is not None and value != ""}, None
+
+
+def _validation_message(error: ValidationError) -> str:
+    first = error.errors()[0]
+    field = ".".join(str(part) for part in first["loc"])
+    return f"{field}: {first['msg']}" if field else first["msg"]
+
+
+def _write_batch(session: Session, rows: List[dict]) -> None:
+    if session.get_bind().dialect.name == "postgresql":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(tuple(row[field] for field in COPY_FIELDS) for row in rows)
+        buffer.seek(0)
+        cursor = session.connection().connection.cursor()
+        try:
+            # csv.writer writes "" and None alike as an empty field, which COPY
+            # reads as NULL; only due_at may be NULL, so keep the text columns empty
+            cursor.copy_expert(
+                f"COPY {Task.__tablename__} ({', '.join(COPY_FIELDS)}) FROM STDIN "
+                f"WITH (FORMAT csv, FORCE_NOT_NULL (title, description))",
+                buffer
+            )
+        finally:
+            cursor.close()
+    else:
+        session.execute(insert(Task), rows)
+
+
+def import_tasks(session: Session, user_id: int, upload: IO[bytes], fmt: str) -> ImportResult:
+    """Validate and insert the uploaded tasks in one transaction."""
+    # One timestamp per import, which also identifies the rows to publish
+    imported_at = datetime.utcnow()
+    parse = _csv_rows if fmt == "csv" else _ndjson_rows
+    imported = failed = completed = 0
+    errors: List[Dict[str, object]] = []
+    batch: List[dict] = []
+    # Imported tasks are appended to the end of the manual order, in file order
+    next_rank = last_rank(session, user_id) + RANK_STEP
+
+    for number, data, error in parse(upload):
+        if error is None:
+            try:
+                task = ImportedTask.model_validate(data)
+            except ValidationError as e:
+                error = _validation_message(e)
+        if error is not None:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"row": number, "error": error})
+            continue
+        batch.append({
+            "user_id": user_id,
+            "title": task.title,
+            "description": task.description,
+            "completed": task.completed,
+            "due_at": normalize_due_at(task.due_at),
+            "priority": task.priority,
+            "rank": next_rank,
+            "created_at": imported_at,
+            "updated_at": imported_at,
+        })
+        completed += task.completed
+        next_rank += RANK_STEP
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _write_batch(session, batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        _write_batch(session, batch)
+        imported += len(batch)
+    if imported:
+        # These inserts bypass the ORM flush that maintains the counters
+        task_stats.apply_deltas(session, {user_id: [imported - completed, completed]})
+    session.commit()
+
+    if imported:
+        _publish_imported(session, user_id, imported_at)
+    return ImportResult(imported=imported, failed=failed, errors=errors)
+
+
+def _publish_imported(session: Session, user_id: int, imported_at: datetime) -> None:
+    statement = (
+        select(Task.id, Task.title, Task.completed, Task.due_at)
+        .where(Task.user_id == user_id, Task.created_at == imported_at)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for rows in session.exec(statement).partitions():
+        task_events.publish([
+            TaskChange("created", task_id, user_id, title, completed, due_at)
+            for task_id, title, completed, due_at in rows
+        ])
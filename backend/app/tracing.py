@@ -0,0 +1,333 @@
+"""Lightweight OpenTelemetry-style tracing for the chat pipeline.
+
+Spans are nested through a context variable, so a span opened in the chat
+route becomes the parent of the agent, LLM, tool and SQL spans created while
+it is active. Finished spans are handed to an exporter that writes JSON lines
+to a local file or ships OTLP/JSON batches to a collector.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from sqlalchemy import event
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """A single timed operation within a trace."""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "attributes",
+        "start_ns", "end_ns", "status", "error",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Attach an attribute (ignored when value is None)."""
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        """Attach several attributes at once."""
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_exception(self, exc: BaseException) -> None:
+        """Mark the span as failed."""
+        self.status = "error"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self) -> None:
+        """Stop the span clock."""
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1_000_000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Flat representation used by the file exporter."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Span stand-in used when tracing is disabled."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class FileSpanExporter:
+    """Append finished spans to a local JSON-lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    def shutdown(self) -> None:
+        pass
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class CollectorSpanExporter:
+    """Batch spans and POST them to an OTLP/HTTP (JSON) collector.
+
+    Export runs on a daemon thread so request handlers never wait on the
+    collector; spans are dropped (with a warning) if the buffer overflows.
+    """
+
+    def __init__(self, endpoint: str, service_name: str, batch_size: int = 256,
+                 flush_interval: float = 2.0, max_buffer: int = 10_000):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Span] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._start_thread()
+        # Threads do not survive fork; forked workers start their own exporter thread
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_thread(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._start_thread()
+
+    def export(self, spans: List[Span]) -> None:
+        with self._lock:
+            if len(self._buffer) + len(spans) > self.max_buffer:
+                logger.warning("Trace buffer full, dropping %d span(s)", len(spans))
+                return
+            self._buffer.extend(spans)
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        body = json.dumps(self._encode(batch)).encode("utf-8")
+        request = urllib.request.Request(
+            self.endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            logger.warning(f"Failed to export {len(batch)} span(s): {e}")
+
+    def _encode(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "app.tracing"},
+                    "spans": [
+                        {
+                            "traceId": span.trace_id,
+                            "spanId": span.span_id,
+                            "parentSpanId": span.parent_id or "",
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(span.start_ns),
+                            "endTimeUnixNano": str(span.end_ns),
+                            "attributes": [
+                                {"key": k, "value": _otlp_value(v)}
+                                for k, v in span.attributes.items()
+                            ],
+                            "status": {"code": 2, "message": span.error} if span.status == "error" else {"code": 1},
+                        }
+                        for span in spans
+                    ],
+                }],
+            }]
+        }
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self._flush()
+
+
+class Tracer:
+    """Creates spans and forwards finished ones to the exporter."""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_span(self, name: str, **attributes: Any) -> Span:
+        """Start a span as a child of the current span (not made current)."""
+        return Span(name, _current_span.get(), attributes)
+
+    def finish_span(self, span: Span) -> None:
+        """End a span started with start_span and export it."""
+        span.end()
+        try:
+            self.exporter.export([span])
+        except Exception as e:
+            logger.warning(f"Span export failed: {e}")
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """Context manager that times a block as the current span."""
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish_span(span)
+
+
+def _build_exporter():
+    """Create the exporter selected by TRACING_EXPORTER."""
+    kind = (settings.TRACING_EXPORTER or "none").lower()
+    if kind == "file":
+        return FileSpanExporter(settings.TRACING_FILE_PATH)
+    if kind == "otlp":
+        return CollectorSpanExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME)
+    if kind != "none":
+        logger.warning(f"Unknown TRACING_EXPORTER '{kind}', tracing disabled")
+    return None
+
+
+# Global tracer instance
+tracer = Tracer(_build_exporter())
+if tracer.exporter is not None:
+    atexit.register(tracer.exporter.shutdown)
+
+
+def span(name: str, **attributes: Any):
+    """Shortcut for tracer.span()."""
+    return tracer.span(name, **attributes)
+
+
+def instrument_engine(engine) -> None:
+    """Emit a span for every SQL statement executed on the engine."""
+    if not tracer.enabled:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_span = tracer.start_span(
+            "db.query",
+            **{
+                "db.system": engine.dialect.name,
+                "db.statement": statement[:2000],
+                "db.operation": statement.lstrip().split(" ", 1)[0].upper(),
+                "db.executemany": executemany,
+            },
+        )
+        conn.info.setdefault("trace_spans", []).append(db_span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if not spans:
+            return
+        db_span = spans.pop()
+        # rowcount is -1 for SELECTs on most drivers; only report real values
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            db_span.set_attribute("db.rows_affected", cursor.rowcount)
+        tracer.finish_span(db_span)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("trace_spans") if conn is not None else None
+        if not spans:
+            return
+        db_span = spans.pop()
+        db_span.record_exception(exception_context.original_exception)
+        tracer.finish_span(db_span)
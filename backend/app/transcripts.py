@@ -0,0 +1,406 @@
+"""Write-behind persistence of chat transcripts.
+
+With TRANSCRIPT_WRITE_BEHIND enabled, the chat route hands each finished turn
+(user message plus assistant reply) to the writer instead of inserting it
+before responding. The writer appends the turn to a local spool file (fsynced
+by default) so it survives a crash, keeps it in memory so history reads in
+this process see it at once, and a background task flushes pending turns
+every TRANSCRIPT_FLUSH_INTERVAL_SECONDS as one multi-row INSERT plus one
+``updated_at`` bump per conversation.
+
+Spool I/O runs in worker threads, never on the event loop, and under its
+own lock, so history reads (pending_turns) never wait for an fsync. After a
+flush the spool is rewritten to a temporary file that replaces it
+atomically, so a crash mid-rewrite leaves the old spool intact.
+
+Each process spools to its own file and holds an exclusive lock on it. At
+startup, spool files whose lock is free (left by a stopped process) are
+replayed. Replay skips messages that were already written, so a crash between
+commit and spool cleanup does not duplicate them.
+
+Content is checked against the message column before a turn is spooled. If a
+batch still fails on its data, its turns are written one at a time and any
+turn that fails alone is moved to DEAD_LETTER_FILE in the spool directory, so
+one bad turn cannot hold back the rest.
+
+Task writes made by tools are not affected; they still commit synchronously.
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Set
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# Longest message the content column holds
+MAX_CONTENT_LENGTH = Message.__table__.c.content.type.length
+# Errors caused by a row's data, as opposed to the database being unavailable
+ROW_ERRORS = (DataError, IntegrityError)
+# Turns that could not be written; not matched by the spool file pattern
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+class PendingTurn(NamedTuple):
+    """One user/assistant exchange waiting to be written."""
+    conversation_id: int
+    user_id: int
+    user_content: str
+    assistant_content: str
+    created_at: datetime
+
+    def message_rows(self) -> List[dict]:
+        # The reply is stamped just after the user message so history order holds
+        return [
+            {"conversation_id": self.conversation_id, "user_id": self.user_id, "role": "user",
+             "content": self.user_content, "created_at": self.created_at},
+            {"conversation_id": self.conversation_id, "user_id": self.user_id, "role": "assistant",
+             "content": self.assistant_content, "created_at": self.created_at + timedelta(microseconds=1)},
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "conversation_id": self.conversation_id,
+            "user_id": self.user_id,
+            "user": self.user_content,
+            "assistant": self.assistant_content,
+            "created_at": self.created_at.isoformat(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, line: str) -> "PendingTurn":
+        data = json.loads(line)
+        return cls(data["conversation_id"], data["user_id"], data["user"], data["assistant"],
+                   datetime.fromisoformat(data["created_at"]))
+
+
+def write_turns(session: Session, turns: List[PendingTurn], skip_existing: bool = False) -> int:
+    """Insert the turns' messages in one statement and bump conversation timestamps (caller commits)."""
+    # Turns of conversations deleted since they were queued are dropped
+    conversation_ids = {turn.conversation_id for turn in turns}
+    existing = set(session.exec(select(Conversation.id).where(Conversation.id.in_(conversation_ids))).all())
+    if existing != conversation_ids:
+        dropped = [turn for turn in turns if turn.conversation_id not in existing]
+        metrics.increment("transcripts.dropped", len(dropped))
+        turns = [turn for turn in turns if turn.conversation_id in existing]
+    rows = [row for turn in turns for row in turn.message_rows()]
+    if skip_existing:
+        rows = [row for row in rows if not _message_exists(session, row)]
+    if rows:
+        session.execute(insert(Message), rows)
+    latest: Dict[int, datetime] = {}
+    for turn in turns:
+        latest[turn.conversation_id] = max(turn.created_at, latest.get(turn.conversation_id, turn.created_at))
+    for conversation_id, updated_at in latest.items():
+        session.exec(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.updated_at < updated_at)
+            .values(updated_at=updated_at)
+        )
+    return len(rows)
+
+
+def _write(turns: List[PendingTurn], skip_existing: bool = False) -> int:
+    with Session(engine) as session:
+        written = write_turns(session, turns, skip_existing)
+        session.commit()
+    return written
+
+
+def _message_exists(session: Session, row: dict) -> bool:
+    statement = select(Message.id).where(
+        Message.conversation_id == row["conversation_id"],
+        Message.role == row["role"],
+        Message.created_at == row["created_at"],
+    )
+    return session.exec(statement).first() is not None
+
+
+class TranscriptWriter:
+    """Spool-backed, batching writer for chat transcript rows."""
+
+    def __init__(self, spool_dir: str, flush_interval: float, batch_size: int, fsync: bool):
+        self.spool_dir = spool_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._pending: List[PendingTurn] = []
+        self._by_conversation: Dict[int, List[PendingTurn]] = {}
+        # Guards _pending and _by_conversation; never held across file I/O
+        self._lock = threading.Lock()
+        # Serializes spool writes and rewrites; taken before _lock, never inside it
+        self._spool_lock = threading.Lock()
+        self._spool = None
+        self._spool_path: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """Replay spools left by stopped processes and start flushing."""
+        if self.started:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._open_spool()
+        self.replay_orphaned_spools()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="transcript-writer")
+
+    async def stop(self) -> None:
+        """Flush what is pending and stop."""
+        if not self.started:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            logger.warning(f"Final transcript flush failed; turns stay in {self._spool_path}: {e}")
+            return
+        self._close_spool(remove=True)
+
+    async def submit(self, conversation_id: int, user_id: int, user_content: str,
+                     assistant_content: str) -> PendingTurn:
+        """Durably queue a turn; once this returns it is visible to history reads."""
+        if len(user_content) > MAX_CONTENT_LENGTH:
+            raise ValueError(f"Message is longer than {MAX_CONTENT_LENGTH} characters")
+        if len(assistant_content) > MAX_CONTENT_LENGTH:
+            # The client still gets the full reply; history keeps what fits
+            metrics.increment("transcripts.truncated")
+            assistant_content = assistant_content[:MAX_CONTENT_LENGTH]
+        self.start()  # Lazily, e.g. without lifespan events
+        turn = PendingTurn(conversation_id, user_id, user_content, assistant_content, datetime.utcnow())
+        pending = await asyncio.to_thread(self._spool_turn, turn)
+        metrics.set_gauge("transcripts.pending", pending)
+        if pending >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return turn
+
+    def _spool_turn(self, turn: PendingTurn) -> int:
+        with self._spool_lock:
+            self._spool.write(turn.to_json() + "\n")
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            # Added while the spool lock is held, so a rewrite cannot drop it
+            with self._lock:
+                self._pending.append(turn)
+                self._by_conversation.setdefault(turn.conversation_id, []).append(turn)
+                return len(self._pending)
+
+    def pending_turns(self, conversation_id: int) -> List[PendingTurn]:
+        """Not-yet-written turns of a conversation, oldest first."""
+        with self._lock:
+            return list(self._by_conversation.get(conversation_id, ()))
+
+    def flush(self) -> int:
+        """Write everything pending in one transaction; returns rows written."""
+        with self._lock:
+            batch = list(self._pending)
+        if not batch:
+            return 0
+        try:
+            written = _write(batch)
+        except ROW_ERRORS as e:
+            logger.warning(f"Transcript batch of {len(batch)} turn(s) failed, writing them one at a time: {e.orig}")
+            return self._flush_one_at_a_time(batch)
+        self._remove(batch, written)
+        return written
+
+    def _flush_one_at_a_time(self, batch: List[PendingTurn]) -> int:
+        written = 0
+        done: List[PendingTurn] = []
+        try:
+            for turn in batch:
+                try:
+                    written += _write([turn])
+                except ROW_ERRORS as e:
+                    self._dead_letter(turn, e)
+                done.append(turn)
+        finally:
+            # Any other error stops here; the rest stay pending for the next flush
+            self._remove(done, written)
+        return written
+
+    def _dead_letter(self, turn: PendingTurn, error: Exception) -> None:
+        path = os.path.join(self.spool_dir, DEAD_LETTER_FILE)
+        # The driver's message, without the statement and its parameters
+        reason = str(getattr(error, "orig", error))
+        with open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Shared by every process
+            f.write(json.dumps({**turn.to_dict(), "error": reason}) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        metrics.increment("transcripts.dead_lettered")
+        logger.error(f"Moved a chat turn of conversation {turn.conversation_id} that could not be written to {path}: {reason}")
+
+    def _remove(self, batch: List[PendingTurn], written: int) -> None:
+        """Drop the written head of the queue from memory and the spool."""
+        if not batch:
+            return
+        with self._spool_lock:
+            with self._lock:
+                del self._pending[:len(batch)]
+                for turn in batch:
+                    turns = self._by_conversation.get(turn.conversation_id)
+                    if turns:
+                        turns.remove(turn)
+                        if not turns:
+                            del self._by_conversation[turn.conversation_id]
+                remaining = list(self._pending)
+            # Rewrite the spool with only what is still pending
+            self._rewrite_spool(remaining)
+        metrics.increment("transcripts.flushes")
+        metrics.increment("transcripts.rows_written", written)
+        metrics.set_gauge("transcripts.pending", len(remaining))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                # Turns stay pending and spooled; the next flush retries them
+                metrics.increment("transcripts.flush_errors")
+                logger.warning(f"Transcript flush failed: {e}")
+
+    def replay_orphaned_spools(self) -> int:
+        """Write turns from spool files no live process holds; returns rows written.
+        
+        A spool that cannot be replayed is logged and left for the next start.
+        """
+        written = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "transcripts-*.jsonl"))):
+            if path == self._spool_path:
+                continue
+            try:
+                written += self._replay_spool(path)
+            except Exception as e:
+                metrics.increment("transcripts.replay_errors")
+                logger.exception(f"Could not replay spooled chat turns from {path}: {e}")
+        return written
+
+    def _replay_spool(self, path: str) -> int:
+        written = 0
+        with open(path, "r+", encoding="utf-8") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Owned by a running process
+            turns = []
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    turns.append(PendingTurn.from_json(line))
+                except (ValueError, KeyError):
+                    # A line cut short by a crash; that turn was never acknowledged
+                    logger.warning(f"Skipping unreadable line in {path}")
+            if turns:
+                try:
+                    written = _write(turns, skip_existing=True)
+                except ROW_ERRORS:
+                    for turn in turns:
+                        try:
+                            written += _write([turn], skip_existing=True)
+                        except ROW_ERRORS as e:
+                            self._dead_letter(turn, e)
+                logger.info(f"Replayed {len(turns)} spooled chat turn(s) from {path}")
+            os.remove(path)
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")  # An interrupted rewrite; the spool itself was complete
+        return written
+
+    def _open_spool(self) -> None:
+        # Unique per process start, so a reused pid never adopts an orphaned spool
+        self._spool_path = os.path.join(self.spool_dir, f"transcripts-{os.getpid()}-{secrets.token_hex(4)}.jsonl")
+        self._spool = open(self._spool_path, "a+", encoding="utf-8")
+        fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _rewrite_spool(self, turns: List[PendingTurn]) -> None:
+        """Replace the spool with one holding only the given turns (caller holds _spool_lock)."""
+        tmp_path = self._spool_path + ".tmp"
+        spool = open(tmp_path, "w+", encoding="utf-8")
+        try:
+            # Locked before it takes the spool's name, so replay never adopts it
+            fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            for turn in turns:
+                spool.write(turn.to_json() + "\n")
+            spool.flush()
+            if self.fsync:
+                os.fsync(spool.fileno())
+            os.replace(tmp_path, self._spool_path)
+        except BaseException:
+            spool.close()
+            raise
+        if self.fsync:
+            directory = os.open(self.spool_dir, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self._spool.close()
+        self._spool = spool
+
+    def _close_spool(self, remove: bool) -> None:
+        if self._spool is None:
+            return
+        self._spool.close()
+        if remove:
+            os.remove(self._spool_path)
+        self._spool = None
+
+
+transcript_writer = TranscriptWriter(
+    spool_dir=settings.TRANSCRIPT_SPOOL_DIR,
+    flush_interval=settings.TRANSCRIPT_FLUSH_INTERVAL_SECONDS,
+    batch_size=settings.TRANSCRIPT_BATCH_SIZE,
+    fsync=settings.TRANSCRIPT_SPOOL_FSYNC,
+)
+
+
+def pending_turns(conversation_id: int) -> List[PendingTurn]:
+    """Turns of the conversation still waiting in this process's writer.
+
+    Take this snapshot before querying the conversation's messages and merge
+    with unwritten_messages(): a flush that commits in between then shows up
+    in the query and is skipped here, so nothing is lost or duplicated.
+    """
+    if not transcript_writer.started:
+        return []
+    return transcript_writer.pending_turns(conversation_id)
+
+
+def unwritten_messages(turns: List[PendingTurn], written: Set[datetime]) -> List[Dict[str, str]]:
+    """Messages of pending turns whose rows are not among the written timestamps."""
+    messages = []
+    for turn in turns:
+        if turn.created_at in written:
+            continue
+        messages.append({"role": "user", "content": turn.user_content})
+        messages.append({"role": "assistant", "content": turn.assistant_content})
+    return messages
@@ -0,0 +1,253 @@
+"""Per-user LLM token, cost and latency accounting.
+
+run_agent records every LLM call here: prompt, completion and cached prompt
+tokens, latency, and cost from the LLM_PRICE_* settings. Records are added
+to in-memory counters per (user, UTC day, model), which are flushed to the
+llm_usage table every USAGE_FLUSH_INTERVAL_SECONDS with one increment per
+key. Counters not yet flushed are lost if the process dies.
+
+check_budget() enforces USER_DAILY_TOKEN_BUDGET without a query per
+request. It adds this process's unflushed tokens to a cached copy of the
+user's stored total for the day. The cache is refreshed after
+USAGE_BUDGET_REFRESH_SECONDS, so usage recorded by other workers is seen
+within that delay.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import settings
+from app.database import engine
+from app.metrics import metrics
+from app.models import LLMUsage
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_ms", "cost_usd")
+
+
+class UsageKey(NamedTuple):
+    user_id: int
+    day: date
+    model: str
+
+
+def call_cost(prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """USD cost of one call at the configured per-million-token prices."""
+    return (
+        (prompt_tokens - cached_tokens) * settings.LLM_PRICE_PROMPT_PER_MTOK
+        + cached_tokens * settings.LLM_PRICE_CACHED_PROMPT_PER_MTOK
+        + completion_tokens * settings.LLM_PRICE_COMPLETION_PER_MTOK
+    ) / 1_000_000
+
+
+def _usage_tokens(usage: Any) -> Tuple[int, int, int]:
+    """(prompt, completion, cached) tokens from an OpenAI-style usage object."""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached or 0
+
+
+class UsageRecorder:
+    """In-memory usage counters with periodic batched flushes."""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[UsageKey, List[float]] = {}
+        # (user id, day) -> tokens recorded here and not yet committed
+        self._pending_tokens: Dict[Tuple[int, date], int] = {}
+        # user id -> (day, stored tokens, monotonic time loaded)
+        self._stored: Dict[int, Tuple[date, int, float]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="usage-flush")
+
+    async def stop(self) -> None:
+        """Flush what is pending and stop."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            logger.warning(f"Final usage flush failed: {e}")
+
+    def record(self, user_id: int, model: str, usage: Any, latency_seconds: float) -> None:
+        """Count one LLM call."""
+        prompt, completion, cached = _usage_tokens(usage)
+        cost = call_cost(prompt, completion, cached)
+        key = UsageKey(user_id, datetime.utcnow().date(), model[:100])
+        with self._lock:
+            counters = self._pending.setdefault(key, [0] * len(COUNTER_FIELDS))
+            for i, value in enumerate((1, prompt, completion, cached, latency_seconds * 1000, cost)):
+                counters[i] += value
+            user_day = (key.user_id, key.day)
+            self._pending_tokens[user_day] = self._pending_tokens.get(user_day, 0) + prompt + completion
+        metrics.increment("llm.tokens.prompt", prompt)
+        metrics.increment("llm.tokens.completion", completion)
+        metrics.increment("llm.tokens.cached", cached)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No event loop to flush from; written by the next flush() call
+        self.start()  # Lazily, e.g. in the external job worker
+
+    def pending_tokens(self, user_id: int, day: date) -> int:
+        with self._lock:
+            return self._pending_tokens.get((user_id, day), 0)
+
+    def flush(self) -> int:
+        """Add pending counters to llm_usage in one transaction; returns keys written."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            with Session(engine) as session:
+                now = datetime.utcnow()
+                for key, counters in batch.items():
+                    _add_usage(session, key, counters, now)
+                session.commit()
+        except Exception:
+            # Put the batch back so the next flush retries it
+            with self._lock:
+                for key, counters in batch.items():
+                    merged = self._pending.setdefault(key, [0] * len(COUNTER_FIELDS))
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+            raise
+        with self._lock:
+            # Move the flushed tokens from pending to the cached stored totals
+            for key, counters in batch.items():
+                tokens = int(counters[1] + counters[2])
+                user_day = (key.user_id, key.day)
+                remaining = self._pending_tokens.get(user_day, 0) - tokens
+                if remaining > 0:
+                    self._pending_tokens[user_day] = remaining
+                else:
+                    self._pending_tokens.pop(user_day, None)
+                stored = self._stored.get(key.user_id)
+                if stored is not None and stored[0] == key.day:
+                    self._stored[key.user_id] = (key.day, stored[1] + tokens, stored[2])
+        metrics.increment("usage.flushes")
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                metrics.increment("usage.flush_errors")
+                logger.warning(f"Usage flush failed: {e}")
+
+    def _stored_tokens(self, user_id: int, day: date) -> Optional[int]:
+        with self._lock:
+            stored = self._stored.get(user_id)
+        if stored is None or stored[0] != day or time.monotonic() - stored[2] > settings.USAGE_BUDGET_REFRESH_SECONDS:
+            return None
+        return stored[1]
+
+    def _load_stored_tokens(self, user_id: int, day: date) -> int:
+        with Session(engine) as session:
+            tokens = session.exec(
+                select(func.coalesce(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens), 0))
+                .where(LLMUsage.user_id == user_id, LLMUsage.day == day)
+            ).one()
+        with self._lock:
+            self._stored[user_id] = (day, int(tokens), time.monotonic())
+        return int(tokens)
+
+    async def tokens_today(self, user_id: int) -> int:
+        """The user's tokens for the current UTC day, as far as this process knows."""
+        day = datetime.utcnow().date()
+        stored = self._stored_tokens(user_id, day)
+        if stored is None:
+            stored = await run_in_threadpool(self._load_stored_tokens, user_id, day)
+        return stored + self.pending_tokens(user_id, day)
+
+
+def _add_usage(session: Session, key: UsageKey, counters: List[float], now: datetime) -> None:
+    """Increment the key's row, creating it on first use."""
+    increments = {field: getattr(LLMUsage, field) + value for field, value in zip(COUNTER_FIELDS, counters)}
+    statement = update(LLMUsage).where(
+        LLMUsage.user_id == key.user_id, LLMUsage.day == key.day, LLMUsage.model == key.model
+    ).values(updated_at=now, **increments)
+    if session.execute(statement).rowcount:
+        return
+    try:
+        with session.begin_nested():
+            session.add(LLMUsage(
+                user_id=key.user_id, day=key.day, model=key.model, updated_at=now,
+                **dict(zip(COUNTER_FIELDS, counters))
+            ))
+    except IntegrityError:
+        session.execute(statement)  # Created concurrently by another worker
+
+
+usage_recorder = UsageRecorder(flush_interval=settings.USAGE_FLUSH_INTERVAL_SECONDS)
+
+
+async def check_budget(user_id: int) -> None:
+    """Raise a 429 if the user has used up today's token budget."""
+    if settings.USER_DAILY_TOKEN_BUDGET <= 0:
+        return
+    if await usage_recorder.tokens_today(user_id) >= settings.USER_DAILY_TOKEN_BUDGET:
+        metrics.increment("usage.budget_rejected")
+        now = datetime.utcnow()
+        reset = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Daily LLM token budget exhausted",
+            headers={"Retry-After": str(max(1, math.ceil((reset - now).total_seconds())))},
+        )
+
+
+def top_consumers(session: Session, since: date, limit: int, order: str = "tokens") -> List[Dict[str, Any]]:
+    """Users with the most usage since a day (inclusive), highest first."""
+    tokens = func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens)
+    cost = func.sum(LLMUsage.cost_usd)
+    statement = (
+        select(
+            LLMUsage.user_id,
+            func.sum(LLMUsage.requests),
+            func.sum(LLMUsage.prompt_tokens),
+            func.sum(LLMUsage.completion_tokens),
+            func.sum(LLMUsage.cached_tokens),
+            tokens,
+            cost,
+            func.sum(LLMUsage.latency_ms),
+        )
+        .where(LLMUsage.day >= since)
+        .group_by(LLMUsage.user_id)
+        .order_by((cost if order == "cost" else tokens).desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "user_id": user_id,
+            "requests": int(requests),
+            "prompt_tokens": int(prompt),
+            "completion_tokens": int(completion),
+            "cached_tokens": int(cached),
+            "total_tokens": int(total),
+            "cost_usd": round(float(cost_usd), 6),
+            "avg_latency_ms": round(float(latency) / requests, 1) if requests else 0.0,
+        }
+        for user_id, requests, prompt, completion, cached, total, cost_usd, latency in session.exec(statement).all()
+    ]
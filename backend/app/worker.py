@@ -0,0 +1,52 @@
+"""Standalone agent job worker.
+
+Run alongside the API when JOB_WORKER_MODE=external:
+
+    python -m app.worker
+
+Polls the AgentJob table for queued jobs and runs up to JOB_WORKERS of them
+concurrently. Several worker processes can run at once; each job is claimed
+by exactly one of them.
+"""
+import asyncio
+import logging
+from typing import Set
+from app.config import settings
+from app.jobs import execute_job, fail_stale_jobs, queued_job_ids
+
+logger = logging.getLogger("app.worker")
+
+
+async def run_worker() -> None:
+    """Poll for queued jobs forever."""
+    running: Set[asyncio.Task] = set()
+    logger.info(f"Agent job worker started ({settings.JOB_WORKERS} slots)")
+    stale_check = 0
+    while True:
+        if stale_check <= 0:
+            failed = fail_stale_jobs()
+            if failed:
+                logger.warning(f"Marked {failed} stale job(s) as failed")
+            stale_check = settings.JOB_STALE_SECONDS
+
+        free_slots = settings.JOB_WORKERS - len(running)
+        if free_slots > 0:
+            for job_id in queued_job_ids(limit=free_slots):
+                task = asyncio.create_task(execute_job(job_id))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+        await asyncio.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+        stale_check -= settings.JOB_POLL_INTERVAL_SECONDS
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Connection hold time: session held across LLM waits vs per-batch sessions.
+
+Runs concurrent agent turns against a throwaway SQLite database with a fake
+LLM that sleeps before answering (one tool round, then a final reply), once
+with a single session held for the whole turn (the old chat route) and once
+with a session opened per tool batch (session_factory). Reports how long
+each pooled connection stays checked out and the peak number checked out.
+SQLite allows one writer at a time, so held sessions also serialize on its
+lock; set DATABASE_URL to a Postgres database for production-like numbers.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_chat_pool --turns 40 --concurrency 10 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp(prefix="bench-chat-pool-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/bench.db")
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ["ENVIRONMENT"] = "benchmark"  # Keep SQL echo off
+
+from types import SimpleNamespace  # noqa: E402
+from openai.types.chat import ChatCompletion  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+from app.database import engine, init_db  # noqa: E402
+from app.metrics import metrics  # noqa: E402
+from app.models import User  # noqa: E402
+from app.agents import todo_agent  # noqa: E402
+
+
+def _completion(content=None, tool_calls=None) -> ChatCompletion:
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [
+            {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+            for i, (name, args) in enumerate(tool_calls)
+        ]
+    return ChatCompletion.model_validate({
+        "id": "bench", "object": "chat.completion", "created": 0, "model": "bench",
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+    })
+
+
+class SlowLLM:
+    """Fake chat completions client: add a task, then answer."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, messages, **kwargs) -> ChatCompletion:
+        await asyncio.sleep(self.latency)
+        if messages[-1]["role"] == "tool":
+            return _completion("Done.")
+        return _completion(tool_calls=[("add_task", {"title": "bench task"})])
+
+
+async def held_turn(user_id: int) -> None:
+    with Session(engine) as session:
+        await todo_agent.run_agent(str(user_id), "add a task", session=session)
+        session.commit()
+
+
+async def released_turn(user_id: int) -> None:
+    await todo_agent.run_agent(str(user_id), "add a task", session_factory=lambda: Session(engine))
+
+
+async def run(strategy, turns: int, concurrency: int, user_id: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await strategy(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(turns)))
+    elapsed = time.perf_counter() - started
+    hold = metrics.snapshot()["summaries"].get("db.pool.hold_ms", {})
+    return {"elapsed_s": round(elapsed, 2), "hold_ms": hold}
+
+
+class PeakCheckedOut:
+    """Highest number of connections checked out at once."""
+
+    def __init__(self, db_engine):
+        self.current = 0
+        self.peak = 0
+        event.listen(db_engine, "checkout", self._checkout)
+        event.listen(db_engine, "checkin", self._checkin)
+
+    def _checkout(self, *args):
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+
+    def _checkin(self, *args):
+        self.current -= 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="Concurrent turns (keep below the pool size for the held strategy)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake LLM call")
+    args = parser.parse_args()
+
+    init_db()
+    with Session(engine) as session:
+        user = User(email="bench@example.com", name="bench", hashed_password="x")
+        session.add(user)
+        session.commit()
+        user_id = user.id
+    todo_agent.llm.client = SlowLLM(args.llm_latency)
+
+    for name, strategy in (("held", held_turn), ("released", released_turn)):
+        # Fresh metrics per strategy
+        metrics.__init__()
+        peak = PeakCheckedOut(engine)
+        result = asyncio.run(run(strategy, args.turns, args.concurrency, user_id))
+        hold = result["hold_ms"]
+        print(
+            f"{name:>9}: {result['elapsed_s']}s, peak checked out {peak.peak}, "
+            f"hold p50 {hold.get('p50')} ms, p95 {hold.get('p95')} ms, max {round(hold.get('max', 0), 3)} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Throughput comparison: single uvicorn process vs multi-worker gunicorn.
+
+Boots the API twice against a throwaway SQLite database, once as the old
+single `uvicorn app.main:app` process and once through gunicorn.conf.py,
+then drives the same mixed workload (task listing plus bcrypt-heavy logins)
+at fixed concurrency and reports requests/second and latency percentiles.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_throughput --duration 10 --concurrency 32 --workers 4
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(base: str, method: str, path: str, body: Optional[dict] = None,
+            token: Optional[str] = None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read() or b"null")
+
+
+def wait_ready(base: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            request(base, "GET", "/health")
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base} did not become ready")
+
+
+def start_server(mode: str, port: int, env: Dict[str, str], workers: int) -> subprocess.Popen:
+    if mode == "single":
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py",
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers)]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def run_load(base: str, token: str, user_id: int, duration: float, concurrency: int,
+             login_ratio: float) -> Dict[str, object]:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def worker() -> None:
+        nonlocal errors
+        rng = random.Random()
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                if rng.random() < login_ratio:
+                    request(base, "POST", "/api/auth/login",
+                            {"email": "bench@example.com", "password": "benchmark-password"})
+                else:
+                    request(base, "GET", f"/api/{user_id}/tasks", token=token)
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+
+    latencies.sort()
+    pick = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] if latencies else float("nan")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50": pick(50),
+        "p95": pick(95),
+        "p99": pick(99),
+        "mean": statistics.fmean(latencies) if latencies else float("nan"),
+    }
+
+
+def bench_mode(mode: str, args: argparse.Namespace) -> Dict[str, object]:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-secret"),
+        "OPENROUTER_API_KEY": os.environ.get("OPENROUTER_API_KEY", "benchmark"),
+        "ENVIRONMENT": "benchmark",
+        "CHAT_RATE_LIMIT_PER_MINUTE": "0",
+    }
+    proc = start_server(mode, port, env, args.workers)
+    try:
+        wait_ready(base)
+        auth = request(base, "POST", "/api/auth/signup",
+                       {"email": "bench@example.com", "password": "benchmark-password", "name": "Bench"})
+        token, user_id = auth["access_token"], auth["user"]["id"]
+        for i in range(args.tasks):
+            request(base, "POST", f"/api/{user_id}/tasks", {"title": f"Task {i}", "description": "x" * 80}, token)
+        run_load(base, token, user_id, min(2.0, args.duration), args.concurrency, args.login_ratio)  # warm-up
+        return run_load(base, token, user_id, args.duration, args.concurrency, args.login_ratio)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per mode")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent client threads")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="gunicorn workers")
+    parser.add_argument("--tasks", type=int, default=100, help="tasks seeded for the listing endpoint")
+    parser.add_argument("--login-ratio", type=float, default=0.2, help="fraction of requests that are logins")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("single", "multi"):
+        results[mode] = bench_mode(mode, args)
+        r = results[mode]
+        print(f"{mode:>6}: {r['rps']:8.1f} req/s  p50 {r['p50']:7.1f} ms  p95 {r['p95']:7.1f} ms  "
+              f"p99 {r['p99']:7.1f} ms  errors {r['errors']}")
+    if results["single"]["rps"]:
+        print(f"speedup: {results['multi']['rps'] / results['single']['rps']:.2f}x "
+              f"({args.workers} workers, {os.cpu_count()} CPUs)")
+
+
+if __name__ == "__main__":
+    main()
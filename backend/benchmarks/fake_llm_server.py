@@ -0,0 +1,160 @@
+"""Local OpenAI-compatible chat completions server with injectable faults.
+
+Answers ``POST /v1/chat/completions`` with a canned completion after a
+configurable delay, and can fail a share of requests (or the next N) with a
+given HTTP status. A share of user turns can be answered with a tool call
+first, so agent runs take the two-round path. Behaviour is set per model, so a slow or failing primary
+can be paired with a healthy fallback.
+
+Used by benchmarks/llm_resilience_drill.py and benchmarks/loadtest.py
+(in-process) and runnable on its own for manual or load testing; point LLM_BASE_URL at it:
+
+    python -m benchmarks.fake_llm_server --port 8089 --delay 0.3 --error-rate 0.1
+    LLM_BASE_URL=http://127.0.0.1:8089/v1 uvicorn app.main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+@dataclass
+class Behavior:
+    """How the server answers requests for one model."""
+    delay: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    fail_next: int = 0  # Fail this many upcoming requests, then recover
+    retry_after: Optional[float] = None
+    tool_call_rate: float = 0.0  # Share of user turns answered with a tool call
+    tool_name: str = "list_tasks"
+
+
+class FakeLLMServer:
+    """Threaded HTTP server; start() runs it in the background."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, default: Optional[Behavior] = None):
+        self.behaviors: Dict[str, Behavior] = {}
+        self.default = default or Behavior()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def behavior(self, model: str) -> Behavior:
+        return self.behaviors.get(model, self.default)
+
+    def start(self) -> "FakeLLMServer":
+        threading.Thread(target=self.httpd.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _decide(self, model: str) -> Optional[int]:
+        """HTTP status to fail with, or None to succeed."""
+        with self._lock:
+            self.requests[model] = self.requests.get(model, 0) + 1
+            behavior = self.behavior(model)
+            if behavior.fail_next > 0:
+                behavior.fail_next -= 1
+                return behavior.error_status
+        if behavior.error_rate and random.random() < behavior.error_rate:
+            return behavior.error_status
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client gave up (timeout or lost hedge race)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                model = request.get("model", "unknown")
+                behavior = server.behavior(model)
+                time.sleep(behavior.delay + random.uniform(0, behavior.jitter))
+
+                status = server._decide(model)
+                if status is not None:
+                    headers = {}
+                    if behavior.retry_after is not None:
+                        headers["Retry-After"] = str(behavior.retry_after)
+                    self._send(status, {"error": {"message": f"injected {status}", "type": "fake"}}, headers)
+                    return
+
+                messages = request.get("messages") or [{}]
+                if (messages[-1].get("role") == "user" and request.get("tools")
+                        and random.random() < behavior.tool_call_rate):
+                    finish_reason = "tool_calls"
+                    message = {"role": "assistant", "content": None, "tool_calls": [{
+                        "id": f"call_{time.time_ns()}",
+                        "type": "function",
+                        "function": {"name": behavior.tool_name, "arguments": "{}"},
+                    }]}
+                else:
+                    finish_reason = "stop"
+                    message = {"role": "assistant", "content": f"Hello from {model}"}
+
+                self._send(200, {
+                    "id": f"fake-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 4, "total_tokens": 14},
+                })
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0, help="Share of user turns answered with a tool call")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, Behavior(
+        delay=args.delay, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+        tool_call_rate=args.tool_call_rate
+    ))
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
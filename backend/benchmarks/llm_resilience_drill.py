@@ -0,0 +1,165 @@
+"""Fault-injection drill for the LLM resilience layer (app.llm).
+
+Starts benchmarks.fake_llm_server in-process and runs ResilientLLM through
+a series of scenarios: per-attempt deadlines, retries on 429/5xx, fallback
+after exhausted retries, hedging a slow primary, and the circuit breaker
+opening, failing fast and recovering. Each scenario prints PASS or FAIL;
+the exit status is non-zero if any fail.
+
+Usage (from the backend directory):
+    python -m benchmarks.llm_resilience_drill
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Settings are loaded at import time; provide throwaway values for the drill
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench.db")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from openai import APIStatusError, AsyncOpenAI  # noqa: E402
+from app.llm import CircuitBreaker, LLMUnavailableError, ResilientLLM  # noqa: E402
+from app.metrics import metrics  # noqa: E402
+from benchmarks.fake_llm_server import Behavior, FakeLLMServer  # noqa: E402
+
+PRIMARY = "primary-model"
+FALLBACK = "fallback-model"
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_llm(server: FakeLLMServer, **overrides) -> ResilientLLM:
+    client = AsyncOpenAI(api_key="drill", base_url=server.base_url, max_retries=0)
+    options = dict(
+        timeout=0.5, max_retries=2, retry_base_delay=0.05, retry_max_delay=0.2,
+        fallback_model=None, hedge_enabled=False, hedge_min_delay=0.2,
+        breaker=CircuitBreaker(failure_threshold=0, reset_seconds=0),
+    )
+    options.update(overrides)
+    return ResilientLLM(client, **options)
+
+
+def reset(server: FakeLLMServer, **behaviors: Behavior) -> None:
+    server.behaviors = {PRIMARY: behaviors.get("primary", Behavior()), FALLBACK: behaviors.get("fallback", Behavior())}
+    server.requests = {}
+    metrics.__init__()
+
+
+async def scenario_timeout(server):
+    """A hung provider is cut off at the per-attempt deadline, then retried."""
+    reset(server, primary=Behavior(delay=2.0))
+    llm = make_llm(server, max_retries=1)
+    started = time.perf_counter()
+    try:
+        await llm.create(model=PRIMARY, messages=MESSAGES)
+        return False, "call unexpectedly succeeded"
+    except asyncio.TimeoutError:
+        elapsed = time.perf_counter() - started
+    ok = metrics.counter("llm.timeouts") == 2 and elapsed < 1.6
+    return ok, f"2 attempts timed out in {elapsed:.2f}s"
+
+
+async def scenario_retry(server):
+    """Transient 503s and a 429 with Retry-After are retried to success."""
+    reset(server, primary=Behavior(fail_next=2, error_status=503))
+    llm = make_llm(server)
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    ok = response.model == PRIMARY and server.requests[PRIMARY] == 3
+    reset(server, primary=Behavior(fail_next=1, error_status=429, retry_after=0.1))
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    ok = ok and response.model == PRIMARY and server.requests[PRIMARY] == 2
+    return ok, f"retries={metrics.counter('llm.retries'):.0f}"
+
+
+async def scenario_no_retry_on_400(server):
+    """Client errors are raised at once."""
+    reset(server, primary=Behavior(fail_next=1, error_status=400))
+    llm = make_llm(server)
+    try:
+        await llm.create(model=PRIMARY, messages=MESSAGES)
+        return False, "call unexpectedly succeeded"
+    except APIStatusError as e:
+        return e.status_code == 400 and server.requests[PRIMARY] == 1, f"{server.requests[PRIMARY]} request(s)"
+
+
+async def scenario_fallback(server):
+    """A primary that keeps failing is replaced by the fallback model."""
+    reset(server, primary=Behavior(error_rate=1.0, error_status=502))
+    llm = make_llm(server, fallback_model=FALLBACK)
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    ok = response.model == FALLBACK and server.requests[PRIMARY] == 3
+    return ok, f"answered by {response.model} after {server.requests[PRIMARY]} primary attempts"
+
+
+async def scenario_hedge(server):
+    """A slow primary is raced against the fallback; the fast one wins."""
+    reset(server, primary=Behavior(delay=0.45), fallback=Behavior(delay=0.02))
+    llm = make_llm(server, fallback_model=FALLBACK, hedge_enabled=True, hedge_min_delay=0.1)
+    started = time.perf_counter()
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    elapsed = time.perf_counter() - started
+    ok = response.model == FALLBACK and elapsed < 0.4 and metrics.counter("llm.hedge_wins") == 1
+    reset(server, primary=Behavior(delay=0.02), fallback=Behavior(delay=0.02))
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    ok = ok and response.model == PRIMARY and metrics.counter("llm.hedges") == 0
+    return ok, f"hedged call took {elapsed:.2f}s; fast primary not hedged"
+
+
+async def scenario_circuit(server):
+    """Repeated failures open the circuit; calls fail fast, then a probe closes it."""
+    reset(server, primary=Behavior(error_rate=1.0, error_status=500))
+    llm = make_llm(server, max_retries=0, breaker=CircuitBreaker(failure_threshold=3, reset_seconds=0.3))
+    for _ in range(3):
+        try:
+            await llm.create(model=PRIMARY, messages=MESSAGES)
+        except APIStatusError:
+            pass
+    sent = server.requests[PRIMARY]
+    started = time.perf_counter()
+    try:
+        await llm.create(model=PRIMARY, messages=MESSAGES)
+        return False, "open circuit let a call through"
+    except LLMUnavailableError:
+        fail_fast = time.perf_counter() - started
+    ok = llm.breaker.state == "open" and server.requests[PRIMARY] == sent and fail_fast < 0.01
+
+    await asyncio.sleep(0.35)
+    server.behaviors[PRIMARY] = Behavior()
+    response = await llm.create(model=PRIMARY, messages=MESSAGES)
+    ok = ok and response.model == PRIMARY and llm.breaker.state == "closed"
+    return ok, f"rejected in {fail_fast * 1000:.2f} ms while open; closed after probe"
+
+
+SCENARIOS = [
+    scenario_timeout,
+    scenario_retry,
+    scenario_no_retry_on_400,
+    scenario_fallback,
+    scenario_hedge,
+    scenario_circuit,
+]
+
+
+async def run() -> bool:
+    server = FakeLLMServer().start()
+    all_ok = True
+    try:
+        for scenario in SCENARIOS:
+            try:
+                ok, detail = await scenario(server)
+            except Exception as e:
+                ok, detail = False, f"{type(e).__name__}: {e}"
+            all_ok = all_ok and ok
+            print(f"{'PASS' if ok else 'FAIL'}  {scenario.__doc__.splitlines()[0]}  ({detail})")
+    finally:
+        server.stop()
+    return all_ok
+
+
+def main() -> None:
+    sys.exit(0 if asyncio.run(run()) else 1)
+
+
+if __name__ == "__main__":
+    main()
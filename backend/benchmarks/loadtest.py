@@ -0,0 +1,395 @@
+"""End-to-end load test: the API under mixed workloads with a mock LLM.
+
+Seeds a database with users, tasks and conversations, boots the app (uvicorn,
+or gunicorn with --workers > 1) pointed at benchmarks.fake_llm_server, and
+drives a weighted mix of workloads at fixed concurrency:
+
+    login   POST /api/auth/login (bcrypt-bound)
+    poll    GET /api/{user_id}/tasks
+    crud    create, update, complete and delete a task
+    chat    multi-turn chat, continuing a seeded conversation
+
+Reports throughput and p50/p95/p99 latency per route. --output saves the
+results as JSON; --compare loads such a file, prints the change per route and
+exits non-zero when p95 latency or throughput regresses by more than
+--threshold percent. Environment variables (feature flags, pool sizes) are
+passed through to the server, so a change can be measured by running once
+on the baseline and once with it.
+
+Uses a throwaway SQLite database unless --database-url is given. SQLite
+allows one writer at a time; use Postgres for production-like write numbers.
+Seeded rows are tagged per run and left in place.
+
+Usage (from the backend directory):
+    python -m benchmarks.loadtest --duration 20 --concurrency 16 --output before.json
+    python -m benchmarks.loadtest --duration 20 --concurrency 16 --compare before.json
+    python -m benchmarks.loadtest --mix login-storm --concurrency 64
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Shared by the seeding code here and the server; tokens are minted locally
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+os.environ["ENVIRONMENT"] = "benchmark"  # Keep SQL echo off
+
+from benchmarks.bench_throughput import free_port, start_server, wait_ready  # noqa: E402
+from benchmarks.fake_llm_server import Behavior, FakeLLMServer  # noqa: E402
+
+PASSWORD = "benchmark-password"
+
+MIXES = {
+    "mixed": {"login": 1, "poll": 6, "crud": 2, "chat": 1},
+    "login-storm": {"login": 1},
+    "polling": {"poll": 1},
+    "crud": {"crud": 1},
+    "chat": {"chat": 1},
+}
+
+CHAT_PROMPTS = [
+    "What's on my list?",
+    "Add a task to buy groceries",
+    "Which tasks are still pending?",
+    "Thanks, that's all for now",
+]
+
+
+class SeededUser(NamedTuple):
+    id: int
+    email: str
+    token: str
+    conversation_ids: List[int]
+
+
+def seed(args: argparse.Namespace, tag: str) -> List[SeededUser]:
+    """Insert users with tasks and conversation history; returns them with tokens."""
+    # Imported here: app settings read DATABASE_URL at import time
+    from sqlalchemy import insert
+    from sqlmodel import Session, select
+    from app.auth import create_access_token, get_password_hash
+    from app.database import engine, init_db
+    from app.models import Conversation, Message, Task, User
+
+    init_db()
+    hashed = get_password_hash(PASSWORD)  # bcrypt once, shared by all users
+    now = datetime.utcnow()
+    seeded = []
+    with Session(engine) as session:
+        users = [
+            User(email=f"load-{tag}-{i}@example.com", hashed_password=hashed, name=f"Load {i}")
+            for i in range(args.users)
+        ]
+        session.add_all(users)
+        session.flush()
+
+        task_rows = [
+            {"user_id": user.id, "title": f"Task {i}", "description": "x" * 80,
+             "completed": i % 3 == 0, "created_at": now, "updated_at": now}
+            for user in users for i in range(args.tasks)
+        ]
+        if task_rows:
+            session.execute(insert(Task), task_rows)
+
+        conversations = [Conversation(user_id=user.id) for user in users for _ in range(args.conversations)]
+        session.add_all(conversations)
+        session.flush()
+        message_rows = []
+        for conversation in conversations:
+            for i in range(args.messages):
+                message_rows.append({
+                    "conversation_id": conversation.id,
+                    "user_id": conversation.user_id,
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": random.choice(CHAT_PROMPTS) if i % 2 == 0 else "Done. " + "y" * 120,
+                    "created_at": now - timedelta(seconds=args.messages - i),
+                })
+        if message_rows:
+            session.execute(insert(Message), message_rows)
+        session.commit()
+
+        by_user: Dict[int, List[int]] = {}
+        for conversation in conversations:
+            by_user.setdefault(conversation.user_id, []).append(conversation.id)
+        for user_id, email in session.exec(select(User.id, User.email).where(User.email.like(f"load-{tag}-%"))):
+            token = create_access_token(data={"sub": str(user_id), "user_id": user_id})
+            seeded.append(SeededUser(user_id, email, token, by_user.get(user_id, [])))
+    engine.dispose()
+    return seeded
+
+
+def call(base: str, method: str, path: str, body: Optional[dict] = None,
+         token: Optional[str] = None) -> Tuple[int, object]:
+    """Send a request; returns (status, decoded body), including for error statuses."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None
+
+
+class Recorder:
+    """Latencies and errors per route label."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, label: str, elapsed_ms: float, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(label, []).append(elapsed_ms)
+            else:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, float]]:
+        routes = {label: summarize(values, self.errors.get(label, 0), duration)
+                  for label, values in self.latencies.items()}
+        for label, errors in self.errors.items():
+            routes.setdefault(label, summarize([], errors, duration))
+        everything = [value for values in self.latencies.values() for value in values]
+        routes["all"] = summarize(everything, sum(self.errors.values()), duration)
+        return routes
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": len(ordered) / duration,
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "mean": statistics.fmean(ordered) if ordered else float("nan"),
+    }
+
+
+class VirtualClient:
+    """One concurrent client; chat turns stick to one user's conversation."""
+
+    def __init__(self, base: str, users: List[SeededUser], home: SeededUser, recorder: Recorder,
+                 rng: random.Random, chat_turns: int):
+        self.base = base
+        self.users = users
+        self.home = home
+        self.recorder = recorder
+        self.rng = rng
+        self.chat_turns = chat_turns
+        self.conversation_id: Optional[int] = None
+        self.turns_left = 0
+
+    def timed(self, label: str, method: str, path: str, body: Optional[dict] = None,
+              token: Optional[str] = None) -> Optional[object]:
+        start = time.perf_counter()
+        try:
+            status, payload = call(self.base, method, path, body, token)
+        except Exception:
+            status, payload = 0, None
+        ok = 200 <= status < 300
+        self.recorder.add(label, (time.perf_counter() - start) * 1000, ok)
+        return payload if ok else None
+
+    def login(self) -> None:
+        user = self.rng.choice(self.users)
+        self.timed("POST /api/auth/login", "POST", "/api/auth/login", {"email": user.email, "password": PASSWORD})
+
+    def poll(self) -> None:
+        user = self.rng.choice(self.users)
+        self.timed("GET /api/{user_id}/tasks", "GET", f"/api/{user.id}/tasks", token=user.token)
+
+    def crud(self) -> None:
+        user = self.rng.choice(self.users)
+        prefix = f"/api/{user.id}/tasks"
+        task = self.timed("POST /api/{user_id}/tasks", "POST", prefix,
+                          {"title": "Load test task", "description": "created under load"}, user.token)
+        if not task:
+            return
+        path = f"{prefix}/{task['id']}"
+        self.timed("PUT /api/{user_id}/tasks/{task_id}", "PUT", path, {"title": "Load test task (edited)"}, user.token)
+        self.timed("PATCH /api/{user_id}/tasks/{task_id}/complete", "PATCH", f"{path}/complete", token=user.token)
+        self.timed("DELETE /api/{user_id}/tasks/{task_id}", "DELETE", path, token=user.token)
+
+    def chat(self) -> None:
+        if self.turns_left <= 0:
+            # Continue a seeded conversation (with history) or start a new one
+            self.conversation_id = self.rng.choice(self.home.conversation_ids or [None])
+            self.turns_left = self.chat_turns
+        body = {"message": self.rng.choice(CHAT_PROMPTS)}
+        if self.conversation_id is not None:
+            body["conversation_id"] = self.conversation_id
+        reply = self.timed("POST /api/{user_id}/chat", "POST", f"/api/{self.home.id}/chat", body, self.home.token)
+        self.turns_left -= 1
+        if reply:
+            self.conversation_id = reply["conversation_id"]
+
+
+def run_load(base: str, users: List[SeededUser], mix: Dict[str, float], duration: float,
+             concurrency: int, chat_turns: int, seed_value: int) -> Dict[str, Dict[str, float]]:
+    recorder = Recorder()
+    stop_at = time.time() + duration
+    names, weights = list(mix), list(mix.values())
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed_value + index)
+        client = VirtualClient(base, users, users[index % len(users)], recorder, rng, chat_turns)
+        while time.time() < stop_at:
+            getattr(client, rng.choices(names, weights)[0])()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+    return recorder.summary(duration)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in MIXES["mixed"]:
+            raise argparse.ArgumentTypeError(f"unknown workload {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'route':<46} {'reqs':>7} {'errs':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label in sorted(routes, key=lambda label: (label == "all", label)):
+        r = routes[label]
+        print(f"{label:<46} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} "
+              f"{r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f}")
+
+
+def compare(baseline: dict, routes: Dict[str, Dict[str, float]], threshold: float) -> bool:
+    """Print per-route changes against a baseline; True if nothing regressed."""
+    print(f"\nvs baseline {baseline.get('revision') or ''} (threshold {threshold:.0f}%):")
+    print(f"{'route':<46} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    change = lambda new, old: (new - old) / old * 100 if old else float("nan")
+    ok = True
+    for label in sorted(routes, key=lambda label: (label == "all", label)):
+        old = baseline["routes"].get(label)
+        if old is None:
+            continue
+        new = routes[label]
+        deltas = [change(new[key], old[key]) for key in ("p50", "p95", "p99", "rps")]
+        regressed = deltas[1] > threshold or deltas[3] < -threshold
+        ok = ok and not regressed
+        print(f"{label:<46} " + " ".join(f"{delta:>+8.1f}%" for delta in deltas)
+              + ("  REGRESSION" if regressed else ""))
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="database to seed and serve (default: throwaway SQLite)")
+    parser.add_argument("--users", type=int, default=20, help="users to seed")
+    parser.add_argument("--tasks", type=int, default=50, help="tasks seeded per user")
+    parser.add_argument("--conversations", type=int, default=2, help="conversations seeded per user")
+    parser.add_argument("--messages", type=int, default=20, help="messages seeded per conversation")
+    parser.add_argument("--mix", type=parse_mix, default="mixed",
+                        help=f"preset ({', '.join(MIXES)}) or weights, e.g. 'poll=6,crud=2,chat=1'")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load first")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--workers", type=int, default=1, help="server workers (>1 runs gunicorn)")
+    parser.add_argument("--chat-turns", type=int, default=3, help="turns per conversation before switching")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="mock LLM delay per completion, seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="extra random mock LLM delay, up to seconds")
+    parser.add_argument("--tool-call-rate", type=float, default=0.5, help="share of chat turns that call a tool")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the workload")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output run")
+    parser.add_argument("--threshold", type=float, default=10, help="regression threshold, percent")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='loadtest-')}/load.db"
+    os.environ["DATABASE_URL"] = database_url
+    tag = secrets.token_hex(3)
+    started = time.perf_counter()
+    users = seed(args, tag)
+    print(f"Seeded {len(users)} users, {len(users) * args.tasks} tasks, "
+          f"{len(users) * args.conversations * args.messages} messages in {time.perf_counter() - started:.1f}s")
+
+    llm = FakeLLMServer(default=Behavior(
+        delay=args.llm_latency, jitter=args.llm_jitter, tool_call_rate=args.tool_call_rate
+    )).start()
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "LLM_BASE_URL": llm.base_url,
+        "CHAT_RATE_LIMIT_PER_MINUTE": "0",
+    }
+    proc = start_server("single" if args.workers <= 1 else "multi", port, env, args.workers)
+    try:
+        wait_ready(base)
+        if args.warmup > 0:
+            run_load(base, users, args.mix, args.warmup, args.concurrency, args.chat_turns, args.seed)
+        routes = run_load(base, users, args.mix, args.duration, args.concurrency, args.chat_turns, args.seed)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+        llm.stop()
+
+    print_report(routes)
+    results = {
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "compare", "database_url")},
+        "routes": routes,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("warning: baseline was recorded with different options")
+        if not compare(baseline, routes, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Gunicorn configuration for multi-worker production deployments.
+
+Usage:
+    gunicorn app.main:app -c gunicorn.conf.py
+
+Graceful reload:
+    kill -HUP <master pid>   re-reads this file and replaces workers one by
+                             one after they finish in-flight requests
+    kill -USR2 <master pid>  starts a new master with freshly imported code
+                             (needed for code changes because of preload_app);
+                             then `kill -QUIT <old master pid>`
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# One async worker per core; WEB_CONCURRENCY overrides. Every worker has its
+# own DB pool (5 + 10 overflow), so keep workers x pool within the DB limit.
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or multiprocessing.cpu_count()
+# Exported so the preloaded app can check settings that need a single worker
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "app.server.FastUvicornWorker"
+
+# Import the app once in the master and fork workers from it: faster boots and
+# copy-on-write sharing of imported modules. app.database re-initializes the
+# engine's pool in each child (os.register_at_fork), so no connection is
+# shared across processes.
+preload_app = True
+
+# Let in-flight chat turns (several LLM calls) finish on reload/shutdown
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth; jitter avoids
+# restarting them all at once
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
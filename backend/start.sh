@@ -1,4 +1,4 @@
 #!/bin/bash
 # Start script for Render deployment
-uvicorn app.main:app --host 0.0.0.0 --port ${PORT:-8000}
-
+# Multi-worker gunicorn + uvicorn (uvloop/httptools), see gunicorn.conf.py
+exec gunicorn app.main:app -c gunicorn.conf.py